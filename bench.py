@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import sys
+import time
+
+import numpy as np
+
+import config
+import exporter
+import monitor
+import plotter
+import result
+
+# Differences smaller than this are noise, whatever the percentage. Several of
+# the timings are only tens of microseconds.
+seconds_floor = 10 ** -4
+
+
+def _p99(values):
+    return float(np.percentile(values, 99))
+
+
+# A database, its WAL and shm, and a temp directory of a few files for the
+# monitor to sample
+def _synthetic_files():
+    db_file = config.BENCH_DIR + "/bench.db"
+    tmp_dir = config.BENCH_DIR + "/tmpdir/"
+    os.makedirs(tmp_dir)
+    for (file_name, size) in (
+        (db_file, 10 ** 6),
+        (db_file + "-wal", 10 ** 5),
+        (db_file + "-shm", 32768),
+    ):
+        with open(file_name, "wb") as f:
+            f.truncate(size)
+    for i in range(config.BENCH_TMP_FILES):
+        with open(f"{tmp_dir}/etilqs_{i}", "wb") as f:
+            f.truncate(4096)
+    return (db_file, tmp_dir)
+
+
+# CPU and wall time of one of the monitor's samples
+def bench_sampling(db_file, tmp_dir, count):
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for _ in range(count):
+        monitor.get_file_sizes(
+            db_file, db_file + "-shm", db_file + "-wal", tmp_dir, os.getpid()
+        )
+    return {
+        "sample cpu (s)": (time.process_time() - cpu) / count,
+        "sample wall (s)": (time.perf_counter() - wall) / count,
+    }
+
+
+# How far apart the monitor's samples are against config.SAMPLE_INTERVAL, from
+# a monitor process left running for the given seconds. Given a metrics_port,
+# the monitor serves OpenMetrics and is scraped back to back meanwhile, as a
+# stand in for Prometheus.
+def bench_jitter(db_file, tmp_dir, seconds, metrics_port=None):
+    result_file = config.BENCH_DIR + "/jitter"
+    (sender, receiver) = multiprocessing.Pipe()
+    stop_event = multiprocessing.Event()
+    process = multiprocessing.Process(
+        target=monitor.monitor,
+        args=(stop_event, receiver, db_file, tmp_dir, result_file, os.getpid()),
+        kwargs={"metrics_port": metrics_port},
+    )
+    process.start()
+    scrapes = list()
+    end = time.perf_counter() + seconds
+    if metrics_port is None:
+        time.sleep(seconds)
+    while time.perf_counter() < end:
+        try:
+            scrapes.append(exporter.scrape(metrics_port)[0])
+        except OSError:
+            # Not serving yet
+            time.sleep(0.01)
+    stop_event.set()
+    process.join()
+
+    timestamps = np.array(
+        [r.timestamp for r in result.load(result_file + ".pickled").l],
+        dtype="datetime64[us]",
+    )
+    error = np.diff(timestamps) / np.timedelta64(1, "s") - config.SAMPLE_INTERVAL
+    if metrics_port is None:
+        return {
+            "sample interval error mean (s)": float(error.mean()),
+            "sample interval error p99 (s)": _p99(error),
+        }
+    return {
+        "scraped sample interval error mean (s)": float(error.mean()),
+        "scraped sample interval error p99 (s)": _p99(error),
+        "scrape latency median (s)": float(np.median(scrapes)),
+        "scrape latency p99 (s)": _p99(scrapes),
+    }
+
+
+def _echo_receive_times(connection):
+    while True:
+        message = connection.recv()
+        if message is None:
+            return
+        connection.send(time.perf_counter())
+
+
+# Time from sending an Action until another process has received it. Both
+# processes share perf_counter's clock.
+def bench_pipe(count):
+    (local, remote) = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_echo_receive_times, args=(remote,))
+    process.start()
+    latency = list()
+    for i in range(count):
+        sent = time.perf_counter()
+        local.send(result.Action(f"Action {i}"))
+        latency.append(local.recv() - sent)
+    local.send(None)
+    process.join()
+    return {
+        "pipe latency median (s)": float(np.median(latency)),
+        "pipe latency p99 (s)": _p99(latency),
+    }
+
+
+# A monitor's worth of samples, an action every hundred
+def _synthetic_results(count):
+    results = result.ResultList()
+    results.add(result.Title("Synthetic"))
+    for i in range(count):
+        if i % 100 == 0:
+            results.add(result.Action(f"Action {i}"))
+        results.add(result.FileSize(i * 4096, 32768, i % 1000 * 4120, 0, 10 ** 7))
+    return results
+
+
+# Time to write out and plot a run's results, per sample
+def bench_results(count):
+    results = _synthetic_results(count)
+    result_file = config.BENCH_DIR + f"/results_{count}"
+
+    start = time.perf_counter()
+    results.write_csv(result_file + ".csv")
+    write_csv = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open(result_file + ".pickled", "wb") as pickle_file:
+        pickle.dump(results, pickle_file)
+    dump = time.perf_counter() - start
+
+    start = time.perf_counter()
+    plotter.plot_file_data(result_file + ".pickled", False)
+    plot = time.perf_counter() - start
+
+    return {
+        f"write_csv {count} samples (s)": write_csv,
+        f"pickle.dump {count} samples (s)": dump,
+        f"plot_file_data {count} samples (s)": plot,
+    }
+
+
+# Every benchmark, repeats times over. Returns the median, fastest and slowest
+# of each timing.
+def run_benchmarks(counts, repeats):
+    if os.path.exists(config.BENCH_DIR):
+        shutil.rmtree(config.BENCH_DIR)
+    os.makedirs(config.BENCH_DIR)
+    (db_file, tmp_dir) = _synthetic_files()
+
+    runs = dict()
+    for repeat in range(repeats):
+        print(f"Run {repeat + 1}/{repeats}")
+        timings = dict()
+        timings.update(bench_sampling(db_file, tmp_dir, config.BENCH_SAMPLES))
+        timings.update(bench_jitter(db_file, tmp_dir, config.BENCH_JITTER_SECONDS))
+        timings.update(
+            bench_jitter(
+                db_file, tmp_dir, config.BENCH_JITTER_SECONDS, config.BENCH_METRICS_PORT
+            )
+        )
+        timings.update(bench_pipe(config.BENCH_MESSAGES))
+        for count in counts:
+            timings.update(bench_results(count))
+        for (name, seconds) in timings.items():
+            runs.setdefault(name, list()).append(seconds)
+
+    shutil.rmtree(config.BENCH_DIR)
+    return {
+        name: {
+            "median": float(np.median(values)),
+            "min": min(values),
+            "max": max(values),
+        }
+        for (name, values) in runs.items()
+    }
+
+
+# Baselines saved before timings were repeated have a single value for each
+def read_baseline(file_name):
+    try:
+        with open(file_name) as baseline_file:
+            baseline = json.load(baseline_file)
+    except FileNotFoundError:
+        return dict()
+    return {
+        name: (
+            timing
+            if isinstance(timing, dict)
+            else {"median": timing, "min": timing, "max": timing}
+        )
+        for (name, timing) in baseline.items()
+    }
+
+
+# Slower only if even the fastest run is slower than the slowest of the
+# baseline, by more than the floor, and the median is slower by more than the
+# threshold
+def is_regression(old, new, threshold):
+    if new["min"] - old["max"] <= seconds_floor:
+        return False
+    delta = new["median"] - old["median"]
+    return old["median"] <= 0 or delta / old["median"] * 100 > threshold
+
+
+# Every timing's median against the baseline, returning how many are slower
+# than it by more than the threshold
+def report(timings, baseline, threshold):
+    regressions = 0
+    print(f"    {'timing':<40} {'baseline':>12} {'now':>12}")
+    for (name, new) in timings.items():
+        old = baseline.get(name)
+        change = ""
+        flag = ""
+        if old is not None:
+            if old["median"]:
+                change = (new["median"] - old["median"]) / old["median"] * 100
+                change = f"{change:+.1f}%"
+            if is_regression(old, new, threshold):
+                flag = "REGRESSION"
+                regressions += 1
+        old = "" if old is None else f"{old['median']:.6f}"
+        print(f"    {name:<40} {old:>12} {new['median']:12.6f} {change:>9} {flag}")
+    print(f"\n{regressions} regression(s) above {threshold}%")
+    return regressions
+
+
+if __name__ == "__main__":
+    # Forked, as main.py forks its monitor, so the monitor is measured the way
+    # scenarios run it. Newer Pythons no longer fork by default.
+    multiprocessing.set_start_method("fork")
+
+    parser = argparse.ArgumentParser(prog="SQLiteWALBench")
+    parser.add_argument(
+        "--samples",
+        type=int,
+        nargs="+",
+        default=config.BENCH_RESULT_SIZES,
+        help="Numbers of samples to write and plot",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=config.BENCH_BASELINE,
+        help=f"Timings to compare against, default {config.BENCH_BASELINE}",
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="Save these timings as the baseline"
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=config.BENCH_REPEATS,
+        help="Times to run every benchmark, comparing the median of them",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=25,
+        help="Percentage slow down counted as a regression",
+    )
+    args = parser.parse_args()
+
+    timings = run_benchmarks(args.samples, args.repeats)
+    regressions = report(timings, read_baseline(args.baseline), args.threshold)
+    if args.save:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(timings, baseline_file, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions > 0:
+        sys.exit(1)
@@ -0,0 +1,212 @@
+import gzip
+import json
+import sqlite3
+import threading
+import time
+
+import config
+
+# A capture is a gzipped file of JSON lines. Each statement's text is written
+# once, as {"s": id, "q": sql}, and referred to by its id from then on. Every
+# call is a line of its own:
+# - t: microseconds from the start of the capture until the call
+# - d: microseconds the call took
+# - c: which of the captured connections made it
+# - s and p: the statement and its parameters, or m: a list of parameters for
+#   executemany, or x: set for executescript
+# - k: "commit", "rollback" or "close" instead of a statement
+# - e: set if the call raised
+# Strings and blobs longer than config.CAPTURE_VALUE_BYTES are recorded as
+# their size only, as {"s": length} and {"b": length}. Shorter blobs are
+# recorded in hex, as {"h": hex}.
+
+
+def encode(value):
+    if isinstance(value, str):
+        return value if len(value) <= config.CAPTURE_VALUE_BYTES else {"s": len(value)}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value)
+        if len(value) <= config.CAPTURE_VALUE_BYTES:
+            return {"h": value.hex()}
+        return {"b": len(value)}
+    return value
+
+
+# Values recorded by their size only come back as that many "x"s
+def decode(value):
+    if not isinstance(value, dict):
+        return value
+    if "s" in value:
+        return "x" * value["s"]
+    if "b" in value:
+        return b"x" * value["b"]
+    return bytes.fromhex(value["h"])
+
+
+def encode_parameters(parameters):
+    if isinstance(parameters, dict):
+        return {"n": {k: encode(v) for (k, v) in parameters.items()}}
+    return [encode(v) for v in parameters]
+
+
+def decode_parameters(parameters):
+    if isinstance(parameters, dict):
+        return {k: decode(v) for (k, v) in parameters["n"].items()}
+    return [decode(v) for v in parameters]
+
+
+# Where the calls of any number of connections are written. Given the database
+# being captured, it's first copied to log_file + ".db" through the backup API,
+# for the capture to be replayed from the same starting point.
+class Log:
+    def __init__(self, log_file, database=None):
+        if database is not None:
+            source = sqlite3.connect(database)
+            snapshot = sqlite3.connect(log_file + ".db")
+            source.backup(snapshot)
+            snapshot.close()
+            source.close()
+        self.file = gzip.open(log_file, "wt")
+        self.lock = threading.Lock()
+        self.statements = dict()
+        self.connections = 0
+        self.start = time.perf_counter()
+
+    def new_connection(self):
+        with self.lock:
+            self.connections += 1
+            return self.connections - 1
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    # Times call(), then writes what it did
+    def record(self, connection_id, call, **fields):
+        start = time.perf_counter()
+        error = False
+        try:
+            return call()
+        except sqlite3.Error:
+            error = True
+            raise
+        finally:
+            end = time.perf_counter()
+            record = {
+                "t": round((start - self.start) * 10 ** 6),
+                "d": round((end - start) * 10 ** 6),
+                "c": connection_id,
+            }
+            with self.lock:
+                sql = fields.pop("sql", None)
+                if sql is not None:
+                    if sql not in self.statements:
+                        self.statements[sql] = len(self.statements)
+                        self._write({"s": self.statements[sql], "q": sql})
+                    record["s"] = self.statements[sql]
+                record.update(fields)
+                if error:
+                    record["e"] = 1
+                self._write(record)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class CapturingCursor:
+    def __init__(self, cursor, log, connection_id):
+        self.cursor = cursor
+        self.log = log
+        self.connection_id = connection_id
+
+    def execute(self, sql, parameters=()):
+        self.log.record(
+            self.connection_id,
+            lambda: self.cursor.execute(sql, parameters),
+            sql=sql,
+            p=encode_parameters(parameters),
+        )
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        self.log.record(
+            self.connection_id,
+            lambda: self.cursor.executemany(sql, seq_of_parameters),
+            sql=sql,
+            m=[encode_parameters(p) for p in seq_of_parameters],
+        )
+        return self
+
+    def executescript(self, sql):
+        self.log.record(
+            self.connection_id, lambda: self.cursor.executescript(sql), sql=sql, x=1
+        )
+        return self
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+# Stands in for the sqlite3.Connection of an application, writing each
+# statement, its parameters and timing to the log
+class CapturingConnection:
+    def __init__(self, connection, log):
+        self.connection = connection
+        self.log = log
+        self.connection_id = log.new_connection()
+
+    def cursor(self):
+        return CapturingCursor(self.connection.cursor(), self.log, self.connection_id)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql):
+        return self.cursor().executescript(sql)
+
+    def commit(self):
+        self.log.record(self.connection_id, self.connection.commit, k="commit")
+
+    def rollback(self):
+        self.log.record(self.connection_id, self.connection.rollback, k="rollback")
+
+    def close(self):
+        self.log.record(self.connection_id, self.connection.close, k="close")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+def connect(database, log, **kwargs):
+    return CapturingConnection(sqlite3.connect(database, **kwargs), log)
+
+
+# The calls of a capture in order, with each statement's text as "q"
+def read(log_file):
+    statements = dict()
+    with gzip.open(log_file, "rt") as f:
+        for line in f:
+            record = json.loads(line)
+            if "q" in record:
+                statements[record["s"]] = record["q"]
+                continue
+            if "s" in record:
+                record["q"] = statements[record["s"]]
+            yield record
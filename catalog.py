@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import glob
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+import config
+import metrics
+
+schema = """
+CREATE TABLE IF NOT EXISTS Runs (
+    RunId INTEGER PRIMARY KEY,
+    Name TEXT UNIQUE NOT NULL,
+    Path TEXT,
+    SQLiteVersion TEXT,
+    SQLiteVersionNumber INTEGER,
+    Ingested TEXT);
+CREATE INDEX IF NOT EXISTS RunsVersion ON Runs (SQLiteVersionNumber);
+
+CREATE TABLE IF NOT EXISTS RunFiles (
+    RunId INTEGER REFERENCES Runs,
+    File TEXT,
+    ModifiedNs INTEGER);
+CREATE INDEX IF NOT EXISTS RunFilesRun ON RunFiles (RunId);
+
+CREATE TABLE IF NOT EXISTS Environment (
+    RunId INTEGER REFERENCES Runs,
+    Key TEXT,
+    Value TEXT);
+CREATE INDEX IF NOT EXISTS EnvironmentKey ON Environment (Key, Value);
+
+CREATE TABLE IF NOT EXISTS Scenarios (
+    ScenarioId INTEGER PRIMARY KEY,
+    RunId INTEGER REFERENCES Runs,
+    Key TEXT,
+    Scenario INTEGER,
+    Label TEXT,
+    Title TEXT);
+CREATE INDEX IF NOT EXISTS ScenariosScenario ON Scenarios (Scenario, RunId);
+
+CREATE TABLE IF NOT EXISTS Kpis (
+    ScenarioId INTEGER REFERENCES Scenarios,
+    Name TEXT,
+    Value);
+CREATE INDEX IF NOT EXISTS KpisName ON Kpis (Name, ScenarioId);
+
+CREATE TABLE IF NOT EXISTS Actions (
+    ScenarioId INTEGER REFERENCES Scenarios,
+    Seconds REAL,
+    Action TEXT,
+    DbBefore INTEGER,
+    DbAfter INTEGER,
+    WalBefore INTEGER,
+    WalAfter INTEGER,
+    Peak INTEGER);
+CREATE INDEX IF NOT EXISTS ActionsScenario ON Actions (ScenarioId, Action);
+
+CREATE TABLE IF NOT EXISTS Samples (
+    ScenarioId INTEGER REFERENCES Scenarios,
+    Seconds REAL,
+    Db INTEGER,
+    Shm INTEGER,
+    Wal INTEGER,
+    Tmp INTEGER,
+    Rss INTEGER);
+CREATE INDEX IF NOT EXISTS SamplesScenario ON Samples (ScenarioId, Seconds);
+"""
+
+
+def connect(catalog_file):
+    connection = sqlite3.connect(catalog_file)
+    connection.executescript(schema)
+    return connection
+
+
+# "3.31.1" as SQLite numbers its versions, 3031001, so they can be compared
+def version_number(version):
+    parts = [int(part) for part in version.split(".")[:3]]
+    parts += [0] * (3 - len(parts))
+    return parts[0] * 10 ** 6 + parts[1] * 10 ** 3 + parts[2]
+
+
+def read_environment(directory):
+    try:
+        with open(directory + "/versions.txt") as version_file:
+            lines = version_file.read().strip().splitlines()
+    except FileNotFoundError:
+        return dict()
+    return dict(line.partition(": ")[::2] for line in lines)
+
+
+# At most count samples, each the largest of its stretch of samples so the
+# peaks survive, timed from the start of the stretch
+def downsample(samples, count):
+    starts = np.unique(np.linspace(0, len(samples.t), count, endpoint=False, dtype=int))
+    columns = [
+        np.maximum.reduceat(column, starts)
+        for column in (samples.db, samples.shm, samples.wal, samples.tmp, samples.rss)
+    ]
+    return zip(samples.t[starts].tolist(), *[c.tolist() for c in columns])
+
+
+def _ingest_scenario(cursor, run_id, key, results):
+    summary = metrics.summarise(results)
+    (scenario, _, label) = key.partition("_")
+    cursor.execute(
+        "INSERT INTO Scenarios (RunId, Key, Scenario, Label, Title) "
+        "VALUES (?, ?, ?, ?, ?);",
+        (run_id, key, int(scenario), label, summary["title"]),
+    )
+    scenario_id = cursor.lastrowid
+    cursor.executemany(
+        "INSERT INTO Kpis (ScenarioId, Name, Value) VALUES (?, ?, ?);",
+        [
+            (scenario_id, name, value)
+            for (name, value) in summary["kpis"].items()
+            if value is not None
+        ],
+    )
+    cursor.executemany(
+        "INSERT INTO Actions VALUES (?, ?, ?, ?, ?, ?, ?, ?);",
+        [
+            (scenario_id,) + tuple(a[c] for c in metrics.action_table_columns)
+            for a in summary["actions"]
+        ],
+    )
+    cursor.executemany(
+        "INSERT INTO Samples VALUES (?, ?, ?, ?, ?, ?, ?);",
+        [
+            (scenario_id,) + row
+            for row in downsample(metrics.Samples(results), config.CATALOG_SAMPLES)
+        ],
+    )
+
+
+# The scenario results of a run and when each was last written
+def _result_files(directory):
+    return {
+        os.path.basename(f): os.stat(f).st_mtime_ns
+        for f in glob.glob(directory + "/results_scenario_*.pickled")
+    }
+
+
+def _delete_run(cursor, run_id):
+    scenarios = "SELECT ScenarioId FROM Scenarios WHERE RunId = ?"
+    for table in ("Samples", "Actions", "Kpis"):
+        cursor.execute(
+            f"DELETE FROM {table} WHERE ScenarioId IN ({scenarios});", (run_id,)
+        )
+    for table in ("Scenarios", "Environment", "RunFiles", "Runs"):
+        cursor.execute(f"DELETE FROM {table} WHERE RunId = ?;", (run_id,))
+
+
+# Each run is ingested in a single transaction, so a run is either all there
+# or not at all. A run already in the catalog is ingested again if any of its
+# scenario results have been added, removed or rewritten since, as happens when
+# a run still in progress was ingested. Returns what was done.
+def ingest_run(connection, directory):
+    name = os.path.basename(os.path.normpath(directory))
+    files = _result_files(directory)
+    if not files:
+        return "no scenario results"
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT RunId FROM Runs WHERE Name = ?;", (name,))
+    row = cursor.fetchone()
+    if row is not None:
+        cursor.execute("SELECT File, ModifiedNs FROM RunFiles WHERE RunId = ?;", row)
+        if dict(cursor.fetchall()) == files:
+            return "already in the catalog"
+
+    environment = read_environment(directory)
+    version = environment.get("SQLite3 version")
+    with connection:
+        if row is not None:
+            _delete_run(cursor, row[0])
+        cursor.execute(
+            "INSERT INTO Runs (Name, Path, SQLiteVersion, SQLiteVersionNumber, "
+            "Ingested) VALUES (?, ?, ?, ?, ?);",
+            (
+                name,
+                os.path.abspath(directory),
+                version,
+                version_number(version) if version else None,
+                datetime.datetime.now().isoformat(),
+            ),
+        )
+        run_id = cursor.lastrowid
+        cursor.executemany(
+            "INSERT INTO RunFiles (RunId, File, ModifiedNs) VALUES (?, ?, ?);",
+            [(run_id, f, modified) for (f, modified) in files.items()],
+        )
+        cursor.executemany(
+            "INSERT INTO Environment (RunId, Key, Value) VALUES (?, ?, ?);",
+            [(run_id, key, value) for (key, value) in environment.items()],
+        )
+        run = metrics.load_run(directory)
+        for key in sorted(run, key=metrics.sort_key):
+            _ingest_scenario(cursor, run_id, key, run[key])
+    return "reingested" if row is not None else "ingested"
+
+
+def ingest(connection, directories):
+    for directory in sorted(directories):
+        start = time.perf_counter()
+        done = ingest_run(connection, directory)
+        if done.endswith("ingested"):
+            print(
+                f"{done.capitalize()} {directory} in "
+                f"{time.perf_counter() - start:.3f}s"
+            )
+        else:
+            print(f"Skipped {directory}, {done}")
+
+
+def fmt(value):
+    return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+
+def print_rows(cursor):
+    # Statements such as DELETE return no rows at all
+    if cursor.description is None:
+        print("No rows returned")
+        return
+    columns = [d[0] for d in cursor.description]
+    rows = [[fmt(value) for value in row] for row in cursor.fetchall()]
+    widths = [
+        max([len(c)] + [len(row[i]) for row in rows]) for (i, c) in enumerate(columns)
+    ]
+    print("  ".join(c.ljust(w) for (c, w) in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for (v, w) in zip(row, widths)))
+
+
+def list_runs(connection):
+    print_rows(
+        connection.execute(
+            "SELECT Name, SQLiteVersion, COUNT(ScenarioId) AS Scenarios, Ingested "
+            "FROM Runs LEFT JOIN Scenarios USING (RunId) "
+            "GROUP BY RunId ORDER BY Name;"
+        )
+    )
+
+
+# One KPI of the scenarios of every run, optionally only of some scenarios or
+# SQLite versions
+def query(connection, kpi, scenarios, min_sqlite, max_sqlite):
+    conditions = ["Kpis.Name = ?"]
+    parameters = [kpi]
+    if scenarios:
+        conditions.append(f"Scenario IN ({', '.join('?' * len(scenarios))})")
+        parameters += scenarios
+    if min_sqlite:
+        conditions.append("SQLiteVersionNumber >= ?")
+        parameters.append(version_number(min_sqlite))
+    if max_sqlite:
+        conditions.append("SQLiteVersionNumber <= ?")
+        parameters.append(version_number(max_sqlite))
+    print_rows(
+        connection.execute(
+            "SELECT Runs.Name AS Run, SQLiteVersion, Key AS Scenario, "
+            "Value FROM Kpis JOIN Scenarios USING (ScenarioId) "
+            "JOIN Runs USING (RunId) "
+            f"WHERE {' AND '.join(conditions)} "
+            "ORDER BY Scenarios.Scenario, Label, Run;",
+            parameters,
+        )
+    )
+
+
+parser = argparse.ArgumentParser(prog="SQLiteWALCatalog")
+parser.add_argument(
+    "--catalog",
+    type=str,
+    default=config.CATALOG_FILE,
+    help=f"Catalog database, default {config.CATALOG_FILE}",
+)
+commands = parser.add_subparsers(dest="command", required=True)
+ingest_parser = commands.add_parser(
+    "ingest", help="Add results folders not already in the catalog"
+)
+ingest_parser.add_argument(
+    "result",
+    type=str,
+    nargs="*",
+    default=glob.glob(config.WORKING_DIR + "/results/*/"),
+    help="Results folders, default every folder in results",
+)
+commands.add_parser("runs", help="List the runs in the catalog")
+query_parser = commands.add_parser(
+    "query", help="A metric of every scenario, as metrics.py names it"
+)
+query_parser.add_argument("kpi", type=str, help='For example "peak wal (B)"')
+query_parser.add_argument("--scenario", type=int, nargs="+", help="Only these")
+query_parser.add_argument("--min_sqlite", type=str, help="For example 3.35")
+query_parser.add_argument("--max_sqlite", type=str)
+sql_parser = commands.add_parser("sql", help="Run a query on the catalog")
+sql_parser.add_argument("statement", type=str)
+args = parser.parse_args()
+
+connection = connect(args.catalog)
+if args.command == "ingest":
+    ingest(connection, args.result)
+elif args.command == "runs":
+    list_runs(connection)
+elif args.command == "query":
+    query(connection, args.kpi, args.scenario, args.min_sqlite, args.max_sqlite)
+else:
+    connection.execute("PRAGMA query_only = ON;")
+    print_rows(connection.execute(args.statement))
+connection.close()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+
+import metrics
+
+# Differences smaller than these are noise, whatever the percentage
+byte_floor = 10 ** 6
+seconds_floor = 0.5
+
+
+def read_versions(directory):
+    try:
+        with open(directory + "/versions.txt") as version_file:
+            return version_file.read().strip().splitlines()
+    except FileNotFoundError:
+        return ["No versions.txt"]
+
+
+# The metrics compared, and any step durations
+compared_kpis = (
+    "peak wal (B)",
+    "peak db+shm+wal+tmp (B)",
+    "final db (B)",
+    "steady state (s)",
+)
+
+
+def comparable(kpis):
+    return {
+        name: value
+        for (name, value) in kpis.items()
+        if name in compared_kpis or name not in metrics.standard_kpis
+    }
+
+
+def fmt(value):
+    return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+
+def is_regression(old, new, threshold):
+    delta = new - old
+    floor = seconds_floor if isinstance(old, float) else byte_floor
+    if delta <= floor:
+        return False
+    return old == 0 or delta / old * 100 > threshold
+
+
+def compare(old_dir, new_dir, threshold):
+    print(f"Old: {old_dir}")
+    for line in read_versions(old_dir):
+        print(f"    {line}")
+    print(f"New: {new_dir}")
+    for line in read_versions(new_dir):
+        print(f"    {line}")
+
+    old_run = metrics.summarise_run(old_dir)
+    new_run = metrics.summarise_run(new_dir)
+
+    regressions = 0
+    for key in sorted(old_run.keys() | new_run.keys(), key=metrics.sort_key):
+        print(f"\nScenario {key}")
+        if key not in old_run or key not in new_run:
+            print(f"    only in {'old' if key in old_run else 'new'} run")
+            continue
+
+        old_metrics = comparable(old_run[key]["kpis"])
+        new_metrics = comparable(new_run[key]["kpis"])
+        for name in old_metrics:
+            if name not in new_metrics:
+                continue
+            old = old_metrics[name]
+            new = new_metrics[name]
+            change = f"{(new - old) / old * 100:+.1f}%" if old else ""
+            flag = ""
+            if is_regression(old, new, threshold):
+                flag = "REGRESSION"
+                regressions += 1
+            print(f"    {name:<40} {fmt(old):>12} {fmt(new):>12} {change:>9} {flag}")
+
+    print(f"\n{regressions} regression(s) above {threshold}%")
+    return regressions
+
+
+parser = argparse.ArgumentParser(prog="SQLiteWALCompare")
+parser.add_argument("old", type=str, help="Result folder of the baseline run")
+parser.add_argument("new", type=str, help="Result folder of the run to check")
+parser.add_argument(
+    "--threshold",
+    type=float,
+    default=10,
+    help="Percentage increase counted as a regression",
+)
+args = parser.parse_args()
+
+if compare(args.old, args.new, args.threshold) > 0:
+    sys.exit(1)
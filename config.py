@@ -1,6 +1,7 @@
 import datetime
 
 NUM_ROWS_IN_DB = 100
+ROW_SIZE = 10 ** 6
 
 WORKING_DIR = "./"
 
@@ -8,6 +9,156 @@ DB_FILE = WORKING_DIR + "/db/test.db"
 RESULT_DIR = (
     WORKING_DIR + "/results/" + datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + "/"
 )
+# A scenario whose fingerprint matches one of an earlier run in results is
+# linked from there rather than run again
+REUSE_RESULTS = True
+
 TMP_DIR = WORKING_DIR + "/tmpdir/"
+# Shape of the table the scenarios write to, one of schemas.profiles
+SCHEMA = "rowid"
+
+# tmpfs stand-in, used when comparing where VACUUM stages its temporary copy
+SHM_TMP_DIR = "/dev/shm/sqlite_vacuuming_tmpdir/"
+# Alongside the database, so guaranteed to be on the same filesystem
+DB_FS_TMP_DIR = WORKING_DIR + "/db/tmpdir/"
+
+# Where VACUUM INTO writes the compacted copy. None for alongside the database.
+COMPACT_DIR = None
+
+# Where populated databases are kept for scenarios to clone rather than write
+# every row again. None for always writing them.
+TEMPLATE_DIR = None
+
+# Throttling for compaction through the online backup API
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_DELAY = 0.05
+# Times a backup may be restarted by a concurrent writer's commits before the
+# writer is paused to let it finish
+BACKUP_MAX_RESTARTS = 3
+
+# Small commits made alongside maintenance, to measure its effect on a writer
+CONCURRENT_WRITE_INTERVAL = 0.1
+CONCURRENT_WRITE_SIZE = 1000
+# How long the writer's connection waits on a locked database before the commit
+# is counted as failed
+CONCURRENT_WRITE_BUSY_TIMEOUT = 5.0
+
+# Reader threads querying the database throughout a scenario, 0 for none.
+# Each picks a point lookup with the given probability, otherwise a scan of
+# READ_PROBE_RANGE_ROWS keys, then waits READ_PROBE_INTERVAL seconds.
+READ_PROBE_THREADS = 0
+READ_PROBE_POINT_FRACTION = 0.8
+READ_PROBE_RANGE_ROWS = 10
+READ_PROBE_INTERVAL = 0.05
+READ_PROBE_SEED = 0
+
+# Sampling from inside vacuum statements through SQLite's progress handler,
+# every STATEMENT_PROGRESS_STEPS virtual machine instructions, 0 for off. With
+# large rows VACUUM runs few instructions per MB, so keep it small. Samples are
+# sent at most every STATEMENT_PROGRESS_INTERVAL seconds.
+STATEMENT_PROGRESS_STEPS = 0
+STATEMENT_PROGRESS_INTERVAL = 0.05
+# Seconds a statement may run before it is paused for STATEMENT_PAUSE seconds
+# or cancelled, as STATEMENT_OVER_BUDGET says. None for no limit.
+STATEMENT_BUDGET = None
+STATEMENT_OVER_BUDGET = "pause"
+STATEMENT_PAUSE = 1.0
+
+# fleet.py's databases, all in FLEET_DIR, and the workload spread over them
+FLEET_DIR = WORKING_DIR + "/fleet/"
+FLEET_SIZE = 100
+FLEET_ROWS = 50
+FLEET_ROW_SIZE = 10 ** 4
+FLEET_OPERATIONS = 5000
+FLEET_RATE = 500
+# Maintenance is queued for a database once this fraction of its pages are free,
+# or its WAL reaches FLEET_WAL_THRESHOLD bytes. The databases are checked every
+# FLEET_CHECK_INTERVAL seconds.
+FLEET_POLICY = "vacuum"
+FLEET_MAX_CONCURRENT = 4
+FLEET_FREELIST_THRESHOLD = 0.2
+FLEET_WAL_THRESHOLD = 10 ** 6
+FLEET_CHECK_INTERVAL = 1.0
+# Workload operations kept waiting at least this long by maintenance are
+# recorded
+FLEET_BLOCKED_SECONDS = 0.001
+
+# WAL sizes the crash scenario kills the writer at, as fractions of the size
+# of the database
+CRASH_WAL_FRACTIONS = (0.1, 0.25, 0.5, 1.0)
+
+# Scenarios are aborted rather than let free space on the database or temp
+# filesystems drop below this
+MIN_FREE_BYTES = 10 ** 9
+DISK_CHECK_INTERVAL = 0.5
+
+# Seconds between progress reports while writing or deleting rows
+PROGRESS_INTERVAL = 10
+
+# Seconds between the monitor's samples, and how many of the latest samples it
+# shares with the scenario
+SAMPLE_INTERVAL = 0.2
+SAMPLE_RING_SIZE = 1024
+# Port on localhost the monitor serves its latest sample, actions and step
+# timings on in the OpenMetrics text format, None for off
+METRICS_PORT = None
+
+# Churn applied by the workload scenarios. Rows for updates and deletes are
+# picked with one of workload.distributions, at WORKLOAD_RATE operations per
+# second. WORKLOAD_MIX weights inserts, updates and deletes, and each insert or
+# update writes between the two WORKLOAD_ROW_SIZES multiples of ROW_SIZE.
+WORKLOAD_DISTRIBUTION = "uniform"
+WORKLOAD_OPERATIONS = 300
+WORKLOAD_RATE = 20
+WORKLOAD_SEED = 0
+WORKLOAD_MIX = (1, 2, 1)
+WORKLOAD_ROW_SIZES = (0.25, 2)
+WORKLOAD_ZIPF_EXPONENT = 1.1
+# Fraction of the oldest rows the window distribution picks from
+WORKLOAD_WINDOW = 0.2
+# Seconds between page usage samples during the workload
+WORKLOAD_PAGES_INTERVAL = 1.0
+
+# Traffic captured with capture.py, replayed by the replay scenarios at
+# REPLAY_SPEED times the captured rate (0 for as fast as possible), each
+# captured connection on one of its own. Captures from more than
+# REPLAY_MAX_CONNECTIONS connections aren't replayed, None for no limit. The
+# replay scenarios are skipped without a REPLAY_LOG. Strings and blobs longer
+# than CAPTURE_VALUE_BYTES are captured as their size only.
+REPLAY_LOG = None
+REPLAY_SPEED = 1.0
+REPLAY_MAX_CONNECTIONS = None
+REPLAY_BUSY_TIMEOUT = 30.0
+CAPTURE_VALUE_BYTES = 64
+
+# The group commit scenario writes from GROUP_COMMIT_PRODUCERS threads, their
+# rows committed together until GROUP_COMMIT_MAX_ROWS rows or
+# GROUP_COMMIT_MAX_BYTES bytes are waiting, or the first has waited
+# GROUP_COMMIT_MAX_LATENCY seconds. With no latency allowed, whatever rows
+# arrived during the previous commit are committed together.
+GROUP_COMMIT_PRODUCERS = 8
+GROUP_COMMIT_MAX_ROWS = 64
+GROUP_COMMIT_MAX_BYTES = 8 * 10 ** 6
+GROUP_COMMIT_MAX_LATENCY = 0.0
+
+# catalog.py's database of every ingested run, and the most samples it keeps of
+# each scenario, each the largest of its stretch of samples
+CATALOG_FILE = WORKING_DIR + "/catalog.db"
+CATALOG_SAMPLES = 500
+
+# bench.py's measurements of the harness itself, on synthetic data in
+# BENCH_DIR: samples taken by the monitor's stat loop, files in the temp
+# directory it scans, seconds the monitor runs for to measure its jitter, with
+# and without being scraped on BENCH_METRICS_PORT, Actions sent down a Pipe,
+# sizes of results written and plotted, and times every benchmark is run
+BENCH_DIR = WORKING_DIR + "/bench/"
+BENCH_BASELINE = WORKING_DIR + "/bench_baseline.json"
+BENCH_SAMPLES = 2000
+BENCH_TMP_FILES = 10
+BENCH_JITTER_SECONDS = 5
+BENCH_METRICS_PORT = 9465
+BENCH_MESSAGES = 2000
+BENCH_RESULT_SIZES = (10 ** 4, 10 ** 5)
+BENCH_REPEATS = 5
 
 MANUAL_PROMPT = False
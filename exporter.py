@@ -0,0 +1,198 @@
+import http.server
+import threading
+import time
+import urllib.request
+
+import result
+
+content_type = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+prefix = "sqlite_monitor_"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _family(lines, name, kind, help_text, samples, unit=None):
+    lines.append(f"# TYPE {prefix}{name} {kind}")
+    if unit is not None:
+        lines.append(f"# UNIT {prefix}{name} {unit}")
+    lines.append(f"# HELP {prefix}{name} {help_text}")
+    for (suffix, labels, value) in samples:
+        label_text = ",".join(f'{k}="{_escape(str(v))}"' for (k, v) in labels)
+        label_text = f"{{{label_text}}}" if label_text else ""
+        lines.append(f"{prefix}{name}{suffix}{label_text} {value}")
+
+
+# What the monitor has seen so far, kept up to date by the monitor loop and
+# rendered in the OpenMetrics text format when scraped. Only totals and the
+# latest values are kept, so it can run alongside a database indefinitely.
+class Exporter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latest = None
+        self.samples = 0
+        self.sample_seconds = 0.0
+        self.actions = 0
+        self.last_action = None
+        # Per step: count, total seconds and the latest duration
+        self.steps = dict()
+        self.server = None
+
+    def add(self, r, sample_seconds=0.0):
+        with self.lock:
+            if isinstance(r, result.FileSize):
+                self.latest = r
+                self.samples += 1
+                self.sample_seconds += sample_seconds
+            elif isinstance(r, result.Action):
+                self.actions += 1
+                self.last_action = r
+            elif isinstance(r, result.Duration):
+                (count, total, _) = self.steps.get(r.msg, (0, 0.0, 0.0))
+                self.steps[r.msg] = (count + 1, total + r.seconds(), r.seconds())
+
+    def render(self):
+        lines = list()
+        with self.lock:
+            _family(
+                lines,
+                "samples",
+                "counter",
+                "Samples taken of the file sizes",
+                [("_total", (), self.samples)],
+            )
+            _family(
+                lines,
+                "sample_seconds",
+                "counter",
+                "Time spent taking samples",
+                [("_total", (), self.sample_seconds)],
+                unit="seconds",
+            )
+            if self.latest is not None:
+                s = self.latest
+                _family(
+                    lines,
+                    "file_bytes",
+                    "gauge",
+                    "Size of the database's files at the latest sample",
+                    [
+                        ("", (("file", "db"),), s.db),
+                        ("", (("file", "shm"),), s.shm),
+                        ("", (("file", "wal"),), s.wal),
+                        ("", (("file", "tmp"),), s.tmp_dir),
+                    ],
+                    unit="bytes",
+                )
+                _family(
+                    lines,
+                    "rss_bytes",
+                    "gauge",
+                    "Resident memory of the process using the database",
+                    [("", (), s.rss)],
+                    unit="bytes",
+                )
+                _family(
+                    lines,
+                    "last_sample_timestamp_seconds",
+                    "gauge",
+                    "When the latest sample was taken",
+                    [("", (), s.timestamp.timestamp())],
+                    unit="seconds",
+                )
+                if isinstance(s, result.FleetSize):
+                    _family(
+                        lines,
+                        "databases",
+                        "gauge",
+                        "Databases in the fleet directory",
+                        [("", (), s.databases)],
+                    )
+            _family(
+                lines,
+                "actions",
+                "counter",
+                "Scenario steps started",
+                [("_total", (), self.actions)],
+            )
+            if self.last_action is not None:
+                a = self.last_action
+                _family(
+                    lines,
+                    "last_action",
+                    "info",
+                    "The latest step started",
+                    [("_info", (("action", a.msg),), 1)],
+                )
+                _family(
+                    lines,
+                    "last_action_timestamp_seconds",
+                    "gauge",
+                    "When the latest step started",
+                    [("", (), a.timestamp.timestamp())],
+                    unit="seconds",
+                )
+            if self.steps:
+                _family(
+                    lines,
+                    "step_seconds",
+                    "summary",
+                    "Time taken by each timed step",
+                    [
+                        (suffix, (("step", msg),), value)
+                        for (msg, (count, total, _)) in sorted(self.steps.items())
+                        for (suffix, value) in (("_count", count), ("_sum", total))
+                    ],
+                    unit="seconds",
+                )
+                _family(
+                    lines,
+                    "last_step_seconds",
+                    "gauge",
+                    "Time taken by the latest of each timed step",
+                    [
+                        ("", (("step", msg),), last)
+                        for (msg, (_, _, last)) in sorted(self.steps.items())
+                    ],
+                    unit="seconds",
+                )
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    # Serves /metrics on localhost from a thread of its own
+    def serve(self, port):
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+# Scrapes an exporter, returning the seconds taken and the text
+def scrape(port):
+    start = time.perf_counter()
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+        text = response.read().decode()
+    return (time.perf_counter() - start, text)
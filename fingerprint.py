@@ -0,0 +1,118 @@
+import glob
+import hashlib
+import inspect
+import os
+import platform
+import shutil
+import sqlite3
+
+import config
+import sqlite_scenarios
+
+# Whatever else a scenario's results depend on. main.py sets up and runs it,
+# the rest are used by the steps in sqlite_scenarios.
+code_files = (
+    "main.py",
+    "monitor.py",
+    "result.py",
+    "schemas.py",
+    "workload.py",
+    "replay.py",
+    "capture.py",
+    "group_commit.py",
+    "template.py",
+)
+
+# Config values with no bearing on the results of a scenario run by main.py
+unrelated_config = ("RESULT_DIR", "REUSE_RESULTS", "METRICS_PORT", "MANUAL_PROMPT")
+unrelated_config_prefixes = ("FLEET_", "CATALOG_", "BENCH_")
+
+
+def _read(file_name):
+    with open(os.path.join(os.path.dirname(__file__), file_name), "rb") as f:
+        return f.read()
+
+
+# sqlite_scenarios without any of its scenarios, so changing one scenario
+# doesn't change the fingerprint of the others
+def _helper_source():
+    lines = inspect.getsource(sqlite_scenarios).splitlines(keepends=True)
+    for (name, function) in vars(sqlite_scenarios).items():
+        if name.startswith("scenario_"):
+            (source, start) = inspect.getsourcelines(function)
+            lines[start - 1 : start - 1 + len(source)] = [""] * len(source)
+    return "".join(lines)
+
+
+def _config_values():
+    return sorted(
+        (name, repr(value))
+        for (name, value) in vars(config).items()
+        if name.isupper()
+        and name not in unrelated_config
+        and not name.startswith(unrelated_config_prefixes)
+    )
+
+
+# A hash of everything the results of running scenario_function with
+# temp_mode depend on: the scenario, the helper code, the config values and
+# the SQLite and Python versions. The capture replayed is taken to be
+# unchanged if its size and modification time are.
+def fingerprint(scenario_function, temp_mode):
+    h = hashlib.sha256()
+
+    def add(value):
+        value = value if isinstance(value, bytes) else str(value).encode()
+        h.update(len(value).to_bytes(8, "little"))
+        h.update(value)
+
+    add(inspect.getsource(scenario_function))
+    add(_helper_source())
+    for file_name in code_files:
+        add(file_name)
+        add(_read(file_name))
+    for (name, value) in _config_values():
+        add(f"{name}={value}")
+    if config.REPLAY_LOG is not None and os.path.exists(config.REPLAY_LOG):
+        stat = os.stat(config.REPLAY_LOG)
+        add(f"replay log {stat.st_size} {stat.st_mtime_ns}")
+    add(temp_mode)
+    add(sqlite3.sqlite_version)
+    add(platform.python_implementation() + platform.python_version())
+    return h.hexdigest()
+
+
+def record(result_file, digest):
+    with open(result_file + ".fingerprint", "w") as f:
+        print(digest, file=f)
+
+
+# The newest earlier result file, in any folder of results, whose fingerprint is
+# digest. None if there isn't one.
+def find(result_file, digest):
+    name = os.path.basename(result_file)
+    here = os.path.realpath(os.path.dirname(result_file))
+    for fingerprint_file in sorted(
+        glob.glob(f"{config.WORKING_DIR}/results/*/{name}.fingerprint"),
+        reverse=True,
+    ):
+        found = fingerprint_file[: -len(".fingerprint")]
+        if os.path.realpath(os.path.dirname(found)) == here:
+            continue
+        if not os.path.exists(found + ".pickled"):
+            continue
+        with open(fingerprint_file) as f:
+            if f.read().strip() == digest:
+                return found
+    return None
+
+
+# Hard links the files of an earlier result into place, copying them if they
+# are on another filesystem
+def reuse(found, result_file):
+    for source in glob.glob(glob.escape(found) + ".*"):
+        destination = result_file + source[len(found) :]
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copy2(source, destination)
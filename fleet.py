@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+import argparse
+import concurrent.futures
+import datetime
+import multiprocessing
+import os
+import resource
+import shutil
+import threading
+import time
+
+import numpy as np
+
+import config
+import monitor
+import result
+import schemas
+import sqlite_scenarios
+import workload
+
+policies = ("none", "checkpoint", "incremental", "vacuum")
+
+
+# One database of the fleet, with the handles sqlite_scenarios and workload
+# expect of a scenario. The lock is held by whoever is using the connection,
+# the workload driver or a maintenance job.
+class Member:
+    def __init__(self, db_file, monitor_pipe):
+        self.db_file = db_file
+        self.name = os.path.basename(db_file)
+        self.connection = None
+        self.cursor = None
+        self.monitor_pipe = monitor_pipe
+        self.temp_dir = config.TMP_DIR
+        self.temp_store = None
+        self.live = None
+        self.probe = None
+        self.auto_checkpoint = None
+        self.lock = threading.Lock()
+        self.churn = None
+        self.queued = False
+
+
+# Adds the databases to members as they are created, so those created before
+# a failure can still be closed
+def create_fleet(members, monitor_pipe, rng):
+    for i in range(config.FLEET_SIZE):
+        member = Member(f"{config.FLEET_DIR}/db_{i:05}.db", monitor_pipe)
+        members.append(member)
+        sqlite_scenarios.setup_database(member, member.db_file)
+        member.cursor.executemany(
+            "INSERT INTO Data (PrimaryKey, Stuff) VALUES (?, ?);",
+            [
+                (key, schemas.payload(config.ROW_SIZE))
+                for key in range(config.FLEET_ROWS)
+            ],
+        )
+        member.connection.commit()
+        member.churn = workload.Churn(member, config.WORKLOAD_DISTRIBUTION, rng)
+
+
+def close_fleet(members):
+    for member in members:
+        if member.connection is not None:
+            member.cursor.close()
+            member.connection.close()
+
+
+def needs_maintenance(member):
+    member.cursor.execute("PRAGMA page_count;")
+    page_count = member.cursor.fetchone()[0]
+    member.cursor.execute("PRAGMA freelist_count;")
+    freelist_count = member.cursor.fetchone()[0]
+    # The workload can't commit while a statement is still in progress
+    member.cursor.fetchall()
+    wal = monitor.get_size_or_zero(member.db_file + "-wal")
+    return (
+        freelist_count >= page_count * config.FLEET_FREELIST_THRESHOLD
+        or wal >= config.FLEET_WAL_THRESHOLD
+    )
+
+
+def maintain(member, policy):
+    with member.lock:
+        start = datetime.datetime.now()
+        if policy == "vacuum":
+            member.cursor.execute("vacuum;")
+        elif policy == "incremental":
+            member.cursor.executescript("PRAGMA incremental_vacuum(0);")
+        member.cursor.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+        member.cursor.fetchall()
+        member.monitor_pipe.send(result.Duration(policy, start))
+        member.queued = False
+
+
+# Checks the fleet every config.FLEET_CHECK_INTERVAL seconds, queueing
+# maintenance for the databases which need it, at most max_concurrent running
+# at a time. A database busy with the workload is checked next time round.
+class Maintainer(threading.Thread):
+    def __init__(self, members, policy, max_concurrent, monitor_pipe):
+        super().__init__(name="maintainer", daemon=True)
+        self.members = members
+        self.policy = policy
+        self.monitor_pipe = monitor_pipe
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_concurrent, thread_name_prefix="maintenance"
+        )
+        self.jobs = list()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while self.stop_event.wait(config.FLEET_CHECK_INTERVAL) is False:
+            for member in self.members:
+                if member.queued or member.lock.acquire(blocking=False) is False:
+                    continue
+                try:
+                    member.queued = needs_maintenance(member)
+                finally:
+                    member.lock.release()
+                if member.queued:
+                    self.jobs.append(self.pool.submit(maintain, member, self.policy))
+
+            for job in self.jobs:
+                if job.done():
+                    # Raise anything the job failed with
+                    job.result()
+            self.jobs = [job for job in self.jobs if not job.done()]
+            running = sum(job.running() for job in self.jobs)
+            self.monitor_pipe.send(
+                result.FleetMaintenance(len(self.jobs) - running, running)
+            )
+
+    # Waits for the jobs already queued, raising anything they failed with if
+    # check is set
+    def stop(self, check=True):
+        self.stop_event.set()
+        self.join()
+        self.pool.shutdown()
+        if check:
+            for job in self.jobs:
+                job.result()
+
+
+# One driver spreads the workload over the fleet, picking a database for each
+# operation. Time spent waiting for a database busy with maintenance is
+# recorded.
+def drive(members, rng, monitor_pipe):
+    blocked = list()
+    start = time.monotonic()
+    last_report = start
+    last_check = start
+    for i in range(config.FLEET_OPERATIONS):
+        delay = start + i / config.FLEET_RATE - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        member = members[int(rng.integers(len(members)))]
+        waiting = datetime.datetime.now()
+        timer = time.perf_counter()
+        with member.lock:
+            wait = time.perf_counter() - timer
+            member.churn.step()
+        if wait >= config.FLEET_BLOCKED_SECONDS:
+            blocked.append(result.Duration("blocked by maintenance", waiting))
+
+        now = time.monotonic()
+        if now - last_check >= config.DISK_CHECK_INTERVAL:
+            # Every database is in the same folder, with the same temp directory
+            sqlite_scenarios._check_disk_space(members[0])
+            last_check = now
+        if now - last_report >= config.PROGRESS_INTERVAL:
+            print(
+                f"Fleet: {i + 1}/{config.FLEET_OPERATIONS} operations, "
+                f"{(i + 1) / (now - start):.1f} ops/s"
+            )
+            last_report = now
+
+    for duration in blocked:
+        monitor_pipe.send(duration)
+    return blocked
+
+
+# Each database keeps its db, WAL and shm open
+def raise_open_file_limit():
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = config.FLEET_SIZE * 3 + 64
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+    if needed > hard:
+        print(f"Open file limit {hard} is too low for {config.FLEET_SIZE} databases")
+
+
+def run_fleet(policy, max_concurrent):
+    print(f"Running fleet of {config.FLEET_SIZE} with policy {policy}")
+    result_file = f"{config.RESULT_DIR}/results_fleet_{policy}"
+
+    # Before the monitor starts scanning it
+    if os.path.exists(config.FLEET_DIR):
+        shutil.rmtree(config.FLEET_DIR)
+    os.makedirs(config.FLEET_DIR)
+
+    (monitor_pipe, pipe_receive) = multiprocessing.Pipe()
+    stop_event = multiprocessing.Event()
+    monitor_process = multiprocessing.Process(
+        name="monitor",
+        target=monitor.monitor,
+        kwargs={
+            "stop_event": stop_event,
+            "action_log_receiver": pipe_receive,
+            "db_file": None,
+            "temp_dir": config.TMP_DIR,
+            "result_file": result_file,
+            "scenario_pid": os.getpid(),
+            "fleet_dir": config.FLEET_DIR,
+            "metrics_port": config.METRICS_PORT,
+        },
+    )
+    monitor_process.start()
+
+    members = list()
+    maintainer = None
+    # The monitor process has to be stopped whatever happens, or it keeps this
+    # process from ever exiting
+    try:
+        monitor_pipe.send(
+            result.Title(
+                f"Fleet of {config.FLEET_SIZE}, {policy} at "
+                f"{config.FLEET_FREELIST_THRESHOLD:.0%} free, "
+                f"{max_concurrent} at a time"
+            )
+        )
+        rng = np.random.default_rng(config.WORKLOAD_SEED)
+        monitor_pipe.send(result.Action(f"Creating {config.FLEET_SIZE} databases"))
+        create_fleet(members, monitor_pipe, rng)
+
+        if policy != "none":
+            maintainer = Maintainer(members, policy, max_concurrent, monitor_pipe)
+            maintainer.start()
+
+        # Stop short of filling the disk, but keep the results gathered so far
+        monitor_pipe.send(result.Action(f"Workload of {config.FLEET_OPERATIONS}"))
+        try:
+            blocked = drive(members, rng, monitor_pipe)
+        except sqlite_scenarios.DiskSpaceError as e:
+            print(f"Aborting fleet {policy}: {e}")
+            monitor_pipe.send(result.Action(f"Aborted: {e}"))
+            blocked = list()
+
+        if maintainer is not None:
+            monitor_pipe.send(result.Action("Waiting for maintenance"))
+            maintainer.stop()
+    finally:
+        if maintainer is not None:
+            maintainer.stop(check=False)
+        monitor_pipe.send(result.Action("Closing connections"))
+        close_fleet(members)
+
+        time.sleep(1)
+        stop_event.set()
+        monitor_process.join()
+
+    results = result.load(result_file + ".pickled")
+    sizes = [r for r in results.l if isinstance(r, result.FleetSize)]
+    jobs = [r for r in results.l if isinstance(r, result.Duration) and r.msg == policy]
+    print(
+        f"Fleet {policy}: peak footprint {max(r.total_disk() for r in sizes)} B, "
+        f"final {sizes[-1].total_disk()} B, {len(jobs)} maintenance jobs, "
+        f"{len(blocked)} operations blocked for "
+        f"{sum(d.seconds() for d in blocked):.3f}s"
+    )
+
+
+if __name__ == "__main__":
+    # The monitor relies on being forked, as the command line options are only in
+    # this process's config. Newer Pythons no longer fork by default.
+    multiprocessing.set_start_method("fork")
+
+    parser = argparse.ArgumentParser(prog="SQLiteWALFleet")
+    parser.add_argument(
+        "--databases",
+        type=int,
+        help=f"Databases in the fleet, default {config.FLEET_SIZE}",
+    )
+    parser.add_argument(
+        "--rows", type=int, help=f"Rows in each database, default {config.FLEET_ROWS}"
+    )
+    parser.add_argument(
+        "--row_size",
+        type=int,
+        help=f"Bytes per row, default {config.FLEET_ROW_SIZE}",
+    )
+    parser.add_argument(
+        "--schema",
+        choices=schemas.profiles,
+        help=f"Shape of each database's table, default {config.SCHEMA}",
+    )
+    parser.add_argument(
+        "--operations",
+        type=int,
+        help=f"Workload operations over the fleet, default {config.FLEET_OPERATIONS}",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        help=f"Workload operations per second, default {config.FLEET_RATE}",
+    )
+    parser.add_argument(
+        "--policy",
+        nargs="+",
+        choices=policies,
+        default=[config.FLEET_POLICY],
+        help="Maintenance applied to a database once its freelist or WAL passes "
+        "the thresholds in config.py. Each policy is run on a new fleet.",
+    )
+    parser.add_argument(
+        "--max_concurrent",
+        type=int,
+        default=config.FLEET_MAX_CONCURRENT,
+        help="Maintenance jobs running at once",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        help="Serve the monitor's latest sample, actions and step timings on this "
+        "localhost port in the OpenMetrics text format",
+    )
+    args = parser.parse_args()
+
+    config.ROW_SIZE = config.FLEET_ROW_SIZE
+    if args.databases is not None:
+        config.FLEET_SIZE = args.databases
+    if args.rows is not None:
+        config.FLEET_ROWS = args.rows
+    if args.row_size is not None:
+        config.ROW_SIZE = args.row_size
+    if args.schema is not None:
+        config.SCHEMA = args.schema
+    if args.operations is not None:
+        config.FLEET_OPERATIONS = args.operations
+    if args.rate is not None:
+        config.FLEET_RATE = args.rate
+    if args.metrics_port is not None:
+        config.METRICS_PORT = args.metrics_port
+
+    os.makedirs(config.TMP_DIR, exist_ok=True)
+    os.makedirs(config.RESULT_DIR, exist_ok=True)
+    raise_open_file_limit()
+
+    for policy in args.policy:
+        run_fleet(policy, args.max_concurrent)
@@ -0,0 +1,167 @@
+import concurrent.futures
+import queue
+import sqlite3
+import struct
+import threading
+import time
+
+import numpy as np
+
+
+# The last frame in the WAL and the WAL's salt, from the header of the -shm
+# WAL index. The salt changes whenever the WAL starts again from its first
+# frame. (0, None) before there is a WAL index.
+def wal_position(db_file):
+    try:
+        with open(db_file + "-shm", "rb") as shm:
+            header = shm.read(40)
+    except FileNotFoundError:
+        return (0, None)
+    if len(header) < 40:
+        return (0, None)
+    (max_frame,) = struct.unpack("=I", header[16:20])
+    return (max_frame, header[32:40])
+
+
+class _Request:
+    def __init__(self, sql, parameters, size):
+        self.sql = sql
+        self.parameters = parameters
+        self.size = size
+        self.submitted = time.monotonic()
+        self.future = concurrent.futures.Future()
+
+
+# Any number of producer threads submit statements, and a single writer
+# connection runs them in transactions of up to max_rows statements or
+# max_bytes bytes, committed no later than max_latency seconds after the first
+# of them was submitted. Each submit() returns a Future, done once the
+# statement is committed, with the statement's rowcount as its result. A
+# statement which fails fails its own Future only; a commit which fails fails
+# them all. Coroutines can await a Future through asyncio.wrap_future().
+class GroupCommitWriter:
+    def __init__(self, db_file, max_rows, max_bytes, max_latency):
+        self.db_file = db_file
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.requests = queue.Queue()
+        self.transactions = 0
+        self.wal_frames = 0
+        self.page_size = None
+        self.thread = threading.Thread(target=self._run, name="group commit")
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, sql, parameters=(), size=0):
+        request = _Request(sql, parameters, size)
+        self.requests.put(request)
+        return request.future
+
+    # Commits whatever was submitted before, then stops the writer
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+
+    # The requests of the next transaction, and whether the writer was closed
+    def _next_batch(self):
+        first = self.requests.get()
+        if first is None:
+            return ([], True)
+        batch = [first]
+        size = first.size
+        deadline = first.submitted + self.max_latency
+        while len(batch) < self.max_rows and size < self.max_bytes:
+            timeout = deadline - time.monotonic()
+            try:
+                request = (
+                    self.requests.get(timeout=timeout)
+                    if timeout > 0
+                    else self.requests.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if request is None:
+                return (batch, True)
+            batch.append(request)
+            size += request.size
+        return (batch, False)
+
+    def _commit(self, connection, batch):
+        results = list()
+        for request in batch:
+            try:
+                results.append(connection.execute(request.sql, request.parameters))
+            except sqlite3.Error as e:
+                results.append(e)
+        try:
+            connection.commit()
+        except sqlite3.Error as e:
+            connection.rollback()
+            results = [e] * len(batch)
+        for (request, r) in zip(batch, results):
+            if isinstance(r, Exception):
+                request.future.set_exception(r)
+            else:
+                request.future.set_result(r.rowcount)
+
+    def _run(self):
+        connection = sqlite3.connect(self.db_file)
+        self.page_size = connection.execute("PRAGMA page_size;").fetchone()[0]
+        (last_frame, last_salt) = wal_position(self.db_file)
+        closed = False
+        while not closed:
+            (batch, closed) = self._next_batch()
+            if not batch:
+                continue
+            self._commit(connection, batch)
+            self.transactions += 1
+            # The WAL starts again from its first frame once it has been
+            # checkpointed, in which case every frame is this commit's
+            (frame, salt) = wal_position(self.db_file)
+            self.wal_frames += frame if salt != last_salt else frame - last_frame
+            (last_frame, last_salt) = (frame, salt)
+        connection.close()
+
+    # Each frame is a 24 byte header and a page
+    def wal_bytes(self):
+        return self.wal_frames * (24 + self.page_size)
+
+
+# Each producer inserts its share of num_rows rows of row_data, one at a time,
+# waiting for each to be committed before submitting the next, as a request
+# handler would. Returns the rows per second, the latency of every row from
+# submit to commit, the transactions and the bytes written to the WAL.
+def run(db_file, producers, num_rows, row_data, max_rows, max_bytes, max_latency):
+    writer = GroupCommitWriter(db_file, max_rows, max_bytes, max_latency)
+    writer.start()
+    latencies = [list() for _ in range(producers)]
+
+    def produce(producer):
+        for key in range(producer, num_rows, producers):
+            start = time.monotonic()
+            writer.submit(
+                "INSERT INTO Data (PrimaryKey, Stuff) VALUES (?, ?);",
+                (key, row_data),
+                len(row_data),
+            ).result()
+            latencies[producer].append(time.monotonic() - start)
+
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(
+        producers, thread_name_prefix="producer"
+    ) as pool:
+        for future in [pool.submit(produce, p) for p in range(producers)]:
+            future.result()
+    seconds = time.monotonic() - start
+    writer.close()
+
+    latency = np.concatenate([np.array(l, dtype=np.float64) for l in latencies])
+    return {
+        "rows per second": num_rows / seconds,
+        "latency p50 (s)": float(np.percentile(latency, 50)),
+        "latency p99 (s)": float(np.percentile(latency, 99)),
+        "transactions": writer.transactions,
+        "wal bytes": writer.wal_bytes(),
+    }
@@ -2,13 +2,19 @@
 
 import sqlite3
 import os
+import fcntl
 import time
 import multiprocessing
 import argparse
+import itertools
 
+import fingerprint
+import metrics
 import monitor
 import result
+import schemas
 import sqlite_scenarios
+import workload
 import config
 
 
@@ -18,6 +24,13 @@ class ScenarioHandles:
         self.cursor = None
         self.monitor_pipe = None
         self.monitor_stop_event = None
+        self.db_file = None
+        self.temp_dir = config.TMP_DIR
+        self.temp_store = None
+        self.live = None
+        self.probe = None
+        self.step = None
+        self.auto_checkpoint = None
 
 
 def write_versioning():
@@ -27,6 +40,17 @@ def write_versioning():
         )
         print(f"SQLite3 version: {sqlite3.sqlite_version}", file=version_file)
         print(f"num_rows: {config.NUM_ROWS_IN_DB}", file=version_file)
+        print(f"row_size: {config.ROW_SIZE}", file=version_file)
+        print(
+            f"workload: {config.WORKLOAD_OPERATIONS} operations "
+            f"at {config.WORKLOAD_RATE}/s, seed {config.WORKLOAD_SEED}",
+            file=version_file,
+        )
+        if config.REPLAY_LOG is not None:
+            print(
+                f"replay: {config.REPLAY_LOG} at {config.REPLAY_SPEED}x",
+                file=version_file,
+            )
 
 
 def start_monitor(td, result_file):
@@ -34,6 +58,7 @@ def start_monitor(td, result_file):
     (td.monitor_pipe, pipe_receive) = multiprocessing.Pipe()
 
     td.monitor_stop_event = multiprocessing.Event()
+    td.live = monitor.SampleRing.create(config.SAMPLE_RING_SIZE)
 
     monitor_process = multiprocessing.Process(
         name="monitor",
@@ -42,14 +67,28 @@ def start_monitor(td, result_file):
             "stop_event": td.monitor_stop_event,
             "action_log_receiver": pipe_receive,
             "db_file": config.DB_FILE,
-            "temp_dir": config.TMP_DIR,
+            "temp_dir": td.temp_dir,
             "result_file": result_file,
+            "scenario_pid": os.getpid(),
+            "extra_tmp_files": [
+                sqlite_scenarios.compact_file(config.DB_FILE, config.COMPACT_DIR),
+                config.DB_FILE + "-swap",
+            ],
+            "ring_name": td.live.name,
+            "metrics_port": config.METRICS_PORT,
         },
     )
     monitor_process.start()
     return monitor_process
 
 
+def stop_monitor(td, monitor_process):
+    td.monitor_stop_event.set()
+    monitor_process.join()
+    td.live.close()
+    td.live.memory.unlink()
+
+
 ################################################################################
 
 scenarios = {
@@ -83,47 +122,479 @@ scenarios = {
     64: sqlite_scenarios.scenario_64_delete_and_granular_incremental_vacuum_last_15_200,
     65: sqlite_scenarios.scenario_65_delete_and_granular_incremental_vacuum_last_15_200,
     66: sqlite_scenarios.scenario_66_delete_and_entire_incremetal_last_15_no_autocheckpoint,
+    70: sqlite_scenarios.scenario_70_delete_first_60_in_place_vacuum,
+    71: sqlite_scenarios.scenario_71_delete_first_60_vacuum_into_and_swap,
+    72: sqlite_scenarios.scenario_72_delete_first_60_in_place_vacuum_concurrent_writer,
+    73: sqlite_scenarios.scenario_73_delete_first_60_throttled_backup_concurrent_writer,
+    74: sqlite_scenarios.scenario_74_delete_first_15_incremental_vacuum_checkpoint_on_wal_size,
+    80: sqlite_scenarios.scenario_80_workload_in_place_vacuum,
+    81: sqlite_scenarios.scenario_81_workload_entire_incremental_vacuum,
+    82: sqlite_scenarios.scenario_82_workload_granular_incremental_vacuum_checkpoint,
+    83: sqlite_scenarios.scenario_83_workload_vacuum_into_and_swap,
+    84: sqlite_scenarios.scenario_84_replay_in_place_vacuum,
+    85: sqlite_scenarios.scenario_85_replay_entire_incremental_vacuum,
+    86: sqlite_scenarios.scenario_86_replay_granular_incremental_vacuum_checkpoint,
+    87: sqlite_scenarios.scenario_87_replay_vacuum_into_and_swap,
+    88: sqlite_scenarios.scenario_88_per_row_and_group_commits,
+    90: sqlite_scenarios.scenario_90_crash_writer_at_wal_sizes,
+    91: sqlite_scenarios.scenario_91_delete_first_60_crash_mid_vacuum,
 }
 
 
-def run_scenario(scenario):
+temp_modes = ("tmpdir", "shm", "db_fs", "memory")
+
+
+# Where SQLite puts its temporary files (most notably VACUUM's copy of the
+# database) and the temp_store to use. Looked up when the scenario starts, as
+# trials move the directories into their own workspaces.
+def temp_location(temp_mode):
+    return {
+        "tmpdir": (config.TMP_DIR, None),
+        "shm": (config.SHM_TMP_DIR, None),
+        "db_fs": (config.DB_FS_TMP_DIR, None),
+        "memory": (config.TMP_DIR, "MEMORY"),
+    }[temp_mode]
+
+
+# Runs the scenario with the disk watchdog and any read probe alongside it.
+# Returns whether it was aborted for lack of disk space.
+def run_guarded(td, scenario):
+    sqlite_scenarios.setup_database(td, config.DB_FILE)
+
+    # Stop short of filling the disk, but keep the results gathered so far
+    watchdog = sqlite_scenarios.DiskWatchdog(td)
+    watchdog.start()
+    try:
+        if config.READ_PROBE_THREADS > 0:
+            sqlite_scenarios.start_read_probe(td, config.READ_PROBE_THREADS)
+        try:
+            scenarios[scenario](td)
+        except sqlite3.OperationalError:
+            if watchdog.reason is None:
+                raise
+            abort_scenario(td, scenario, watchdog.reason)
+            return True
+        except sqlite_scenarios.DiskSpaceError as e:
+            abort_scenario(td, scenario, str(e))
+            return True
+        return False
+    finally:
+        sqlite_scenarios.end_step(td)
+        watchdog.stop()
+        if td.probe is not None:
+            sqlite_scenarios.stop_read_probe(td)
+
+
+def run_scenario(scenario, label="", temp_mode=None):
 
-    print(f"Running scenario {scenario}")
+    print(f"Running scenario {scenario} {label}")
     td = ScenarioHandles()
 
-    os.makedirs(config.RESULT_DIR, exist_ok=True)
     result_file = f"{config.RESULT_DIR}/results_scenario_{scenario}"
+    if label:
+        result_file += f"_{label}"
+    if temp_mode is not None:
+        (td.temp_dir, td.temp_store) = temp_location(temp_mode)
+
+    os.makedirs(config.RESULT_DIR, exist_ok=True)
+    digest = fingerprint.fingerprint(scenarios[scenario], temp_mode)
+    found = fingerprint.find(result_file, digest) if config.REUSE_RESULTS else None
+    if found is not None:
+        print(f"Reusing {found}, nothing it depends on has changed")
+        fingerprint.reuse(found, result_file)
+        return result_file
+
+    os.makedirs(td.temp_dir, exist_ok=True)
     monitor_process = start_monitor(td, result_file)
+    # The monitor process has to be stopped whatever happens, or it keeps this
+    # process from ever exiting
+    try:
+        aborted = run_guarded(td, scenario)
+        sqlite_scenarios.cleanup_database(td)
 
-    sqlite_scenarios.setup_database(td, config.DB_FILE)
-    scenarios[scenario](td)
+        print(f"Waiting for scenario {scenario} to finish ...")
+        time.sleep(3)
+    finally:
+        stop_monitor(td, monitor_process)
 
-    sqlite_scenarios.cleanup_database(td)
+    # Aborted runs are kept, but never reused
+    if not aborted:
+        fingerprint.record(result_file, digest)
+    print(f"Finished scenario {scenario}")
+    return result_file
 
-    print(f"Waiting for scenario {scenario} to finish ...")
 
-    time.sleep(3)
-    td.monitor_stop_event.set()
-    monitor_process.join()
+# Give a trial its own copy of every path it writes to, so trials can run side
+# by side. Only called in the trial's own process.
+def use_workspace(trial):
+    workspace = f"{config.WORKING_DIR}/workspaces/trial_{trial}/"
+    config.DB_FILE = workspace + "db/test.db"
+    config.TMP_DIR = workspace + "tmpdir/"
+    config.DB_FS_TMP_DIR = workspace + "db/tmpdir/"
+    config.SHM_TMP_DIR += f"trial_{trial}/"
+    if config.COMPACT_DIR is not None:
+        config.COMPACT_DIR += f"/trial_{trial}/"
+        os.makedirs(config.COMPACT_DIR, exist_ok=True)
+
+
+def run_trial(scenario, label, temp_mode, trial):
+    use_workspace(trial)
+    trial_label = f"{label}_trial{trial}" if label else f"trial{trial}"
+    result_file = run_scenario(scenario, trial_label, temp_mode)
+    write_summary(scenario, trial_label, temp_mode, result_file)
+
+
+# Each trial runs in its own process, at most jobs at a time
+def run_trials(scenario, label, temp_mode, repeat, jobs):
+    pending = list(range(repeat))
+    running = list()
+    while pending or running:
+        while pending and len(running) < jobs:
+            trial = pending.pop(0)
+            process = multiprocessing.Process(
+                name=f"trial {trial}",
+                target=run_trial,
+                args=(scenario, label, temp_mode, trial),
+            )
+            process.start()
+            running.append(process)
+
+        process = running.pop(0)
+        process.join()
+        if process.exitcode != 0:
+            print(f"Scenario {scenario} {process.name} failed")
 
-    print(f"Finished scenario {scenario}")
+
+def abort_scenario(td, scenario, reason):
+    print(f"Aborting scenario {scenario}: {reason}")
+    td.monitor_pipe.send(result.Action(f"Aborted: {reason}"))
+    if td.connection.in_transaction:
+        td.connection.rollback()
+
+
+# Appends line to the CSV file_name, starting it with header if it's new. Locked,
+# as trials running side by side append to the same file.
+def append_csv(file_name, header, line):
+    with open(file_name, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        if os.fstat(f.fileno()).st_size == 0:
+            print(header, file=f)
+        print(line, file=f)
+
+
+# One line per scenario run, so strategies can be compared without plotting.
+# Runs with a temp mode also get a line in the temp mode report.
+def write_summary(scenario, label, temp_mode, result_file):
+    results = result.load(result_file + ".pickled")
+
+    sizes = [r for r in results.l if isinstance(r, result.FileSize)]
+    durations = dict()
+    for r in results.l:
+        if isinstance(r, result.Duration):
+            durations.setdefault(r.msg, list()).append(r.seconds())
+    peak_disk = max(r.total_disk() for r in sizes)
+    peak_rss = max(r.rss for r in sizes)
+
+    step_times = list()
+    for (msg, secs) in durations.items():
+        if len(secs) == 1:
+            step_times.append(f"{msg}={secs[0]:.3f}s")
+        else:
+            step_times.append(
+                f"{msg}={len(secs)}x mean {sum(secs) / len(secs):.3f}s "
+                f"max {max(secs):.3f}s"
+            )
+    step_times = "; ".join(step_times)
+
+    append_csv(
+        config.RESULT_DIR + "summary.csv",
+        "scenario, label, peak db+shm+wal+tmp, peak rss, step durations",
+        f"{scenario}, {label}, {peak_disk}, {peak_rss}, {step_times}",
+    )
+    if temp_mode is not None:
+        vacuum_seconds = sum(durations.get("vacuum", list()))
+        append_csv(
+            config.RESULT_DIR + "temp_mode_report.csv",
+            "scenario, temp mode, vacuum seconds, peak db+shm+wal+tmp, peak rss",
+            f"{scenario}, {temp_mode}, {vacuum_seconds:.3f}, {peak_disk}, {peak_rss}",
+        )
+
+    print(
+        f"Scenario {scenario} ({label}): peak disk {peak_disk} B, "
+        f"peak rss {peak_rss} B, {step_times}"
+    )
 
 
 ################################################################################
 
+# The monitor and trial processes rely on being forked: this file runs the
+# scenarios when imported, and the command line options are only in its config.
+# Newer Pythons no longer fork by default.
+multiprocessing.set_start_method("fork")
+
 os.makedirs(config.TMP_DIR, exist_ok=True)
 os.environ["SQLITE_TMPDIR"] = config.TMP_DIR
 
-os.makedirs(config.RESULT_DIR, exist_ok=True)
-write_versioning()
-
 parser = argparse.ArgumentParser(prog="SQLiteWAL")
 parser.add_argument("--scenario", type=int, choices=scenarios)
+parser.add_argument(
+    "--temp_mode",
+    nargs="+",
+    choices=temp_modes,
+    help="Run each scenario once per temp file placement and report the cost of each",
+)
+parser.add_argument(
+    "--compact_dir",
+    type=str,
+    help="Where VACUUM INTO writes the compacted copy, default alongside the database",
+)
+parser.add_argument(
+    "--backup_pages",
+    nargs="+",
+    type=int,
+    help="Pages copied per backup step, -1 for all at once",
+)
+parser.add_argument(
+    "--backup_delay",
+    nargs="+",
+    type=float,
+    help="Seconds to sleep between backup steps",
+)
+parser.add_argument(
+    "--schema",
+    nargs="+",
+    choices=schemas.profiles,
+    help="Run each scenario once per shape of table, "
+    + "; ".join(f"{n}: {p.description}" for (n, p) in schemas.profiles.items()),
+)
+parser.add_argument(
+    "--distribution",
+    nargs="+",
+    choices=workload.distributions,
+    help="How the workload scenarios pick rows to update and delete, "
+    f"default {config.WORKLOAD_DISTRIBUTION}",
+)
+parser.add_argument(
+    "--workload_ops",
+    type=int,
+    help=f"Operations in the workload, default {config.WORKLOAD_OPERATIONS}",
+)
+parser.add_argument(
+    "--workload_rate",
+    type=float,
+    help=f"Workload operations per second, default {config.WORKLOAD_RATE}",
+)
+parser.add_argument(
+    "--seed",
+    type=int,
+    help=f"Seed for the workload, default {config.WORKLOAD_SEED}",
+)
+parser.add_argument(
+    "--replay",
+    type=str,
+    help="Traffic captured with capture.py for the replay scenarios to replay",
+)
+parser.add_argument(
+    "--replay_speed",
+    type=float,
+    help="Multiple of the captured rate to replay at, 0 for as fast as possible, "
+    f"default {config.REPLAY_SPEED}",
+)
+parser.add_argument(
+    "--replay_max_connections",
+    type=int,
+    help="Refuse to replay captures from more connections than this, "
+    "each being replayed on a connection and thread of its own",
+)
+parser.add_argument(
+    "--producers",
+    type=int,
+    help="Threads writing through the group commit writer, "
+    f"default {config.GROUP_COMMIT_PRODUCERS}",
+)
+parser.add_argument(
+    "--group_rows",
+    type=int,
+    help=f"Most rows in a group commit, default {config.GROUP_COMMIT_MAX_ROWS}",
+)
+parser.add_argument(
+    "--group_latency",
+    type=float,
+    help="Most seconds a row waits for its group commit, "
+    f"default {config.GROUP_COMMIT_MAX_LATENCY}",
+)
+parser.add_argument(
+    "--read_probe",
+    type=int,
+    help="Reader threads querying the database throughout each scenario, "
+    "to measure read latency during maintenance",
+)
+parser.add_argument(
+    "--statement_progress",
+    type=int,
+    help="Sample vacuum statements from the inside every this many SQLite "
+    "VM instructions",
+)
+parser.add_argument(
+    "--statement_budget",
+    type=float,
+    help="Seconds a vacuum statement may run before it is paused or cancelled",
+)
+parser.add_argument(
+    "--over_budget",
+    choices=("pause", "cancel"),
+    help=f"What to do with a statement over budget, "
+    f"default {config.STATEMENT_OVER_BUDGET}",
+)
+parser.add_argument(
+    "--num_rows",
+    type=int,
+    help=f"Rows in the database, default {config.NUM_ROWS_IN_DB}",
+)
+parser.add_argument(
+    "--row_size", type=int, help=f"Bytes per row, default {config.ROW_SIZE}"
+)
+parser.add_argument(
+    "--db_size_gb",
+    type=float,
+    help="Size of database to aim for, sets the number of rows from the row size",
+)
+parser.add_argument(
+    "--min_free_gb",
+    type=float,
+    help="Free space to leave on the db and temp filesystems, "
+    f"default {config.MIN_FREE_BYTES / 10 ** 9}",
+)
+parser.add_argument(
+    "--repeat",
+    type=int,
+    default=1,
+    help="Run each scenario this many times, each in its own workspace, "
+    "and summarise the spread of the results",
+)
+parser.add_argument(
+    "--jobs",
+    type=int,
+    default=1,
+    help="Trials to run at the same time when repeating. "
+    "Trials running together compete for the disk.",
+)
+parser.add_argument(
+    "--template_dir",
+    type=str,
+    help="Keep each populated database here the first time it is written, and "
+    "clone it from there rather than write it again",
+)
+parser.add_argument(
+    "--force",
+    action="store_true",
+    help="Run every scenario, even those with an earlier result to reuse",
+)
+parser.add_argument(
+    "--metrics_port",
+    type=int,
+    help="Serve the monitor's latest sample, actions and step timings on this "
+    "localhost port in the OpenMetrics text format",
+)
 args = parser.parse_args()
 
+if args.row_size is not None:
+    config.ROW_SIZE = args.row_size
+if args.num_rows is not None:
+    config.NUM_ROWS_IN_DB = args.num_rows
+if args.db_size_gb is not None:
+    config.NUM_ROWS_IN_DB = int(args.db_size_gb * 10 ** 9 / config.ROW_SIZE)
+if args.min_free_gb is not None:
+    config.MIN_FREE_BYTES = int(args.min_free_gb * 10 ** 9)
+if args.read_probe is not None:
+    config.READ_PROBE_THREADS = args.read_probe
+if args.statement_progress is not None:
+    config.STATEMENT_PROGRESS_STEPS = args.statement_progress
+if args.statement_budget is not None:
+    config.STATEMENT_BUDGET = args.statement_budget
+if args.over_budget is not None:
+    config.STATEMENT_OVER_BUDGET = args.over_budget
+if args.workload_ops is not None:
+    config.WORKLOAD_OPERATIONS = args.workload_ops
+if args.workload_rate is not None:
+    config.WORKLOAD_RATE = args.workload_rate
+if args.seed is not None:
+    config.WORKLOAD_SEED = args.seed
+if args.replay is not None:
+    config.REPLAY_LOG = args.replay
+if args.replay_speed is not None:
+    config.REPLAY_SPEED = args.replay_speed
+if args.replay_max_connections is not None:
+    config.REPLAY_MAX_CONNECTIONS = args.replay_max_connections
+if args.producers is not None:
+    config.GROUP_COMMIT_PRODUCERS = args.producers
+if args.group_rows is not None:
+    config.GROUP_COMMIT_MAX_ROWS = args.group_rows
+if args.group_latency is not None:
+    config.GROUP_COMMIT_MAX_LATENCY = args.group_latency
+if args.compact_dir is not None:
+    config.COMPACT_DIR = args.compact_dir
+if args.template_dir is not None:
+    config.TEMPLATE_DIR = args.template_dir
+if args.force:
+    config.REUSE_RESULTS = False
+if args.metrics_port is not None:
+    config.METRICS_PORT = args.metrics_port
+
+os.makedirs(config.RESULT_DIR, exist_ok=True)
+write_versioning()
+
+scenarios_to_run = [args.scenario] if args.scenario is not None else scenarios.keys()
+
+# Scenarios which replay config.REPLAY_LOG, and have nothing to do without one
+replay_scenarios = (84, 85, 86, 87)
 
-if args.scenario is not None:
-    run_scenario(args.scenario)
-else:
-    for scen_id in scenarios.keys():
-        run_scenario(scen_id)
+
+# Options which run each scenario once per value given: the argument, the
+# config value it overrides and how it appears in the label
+varied_options = (
+    ("temp_mode", None, "{}"),
+    ("backup_pages", "BACKUP_PAGES_PER_STEP", "pages{}"),
+    ("backup_delay", "BACKUP_STEP_DELAY", "delay{}"),
+    ("distribution", "WORKLOAD_DISTRIBUTION", "{}"),
+    ("schema", "SCHEMA", "{}"),
+)
+
+
+# Every combination of the options given more than one value, as the temp mode
+# and the config values to use. The label names the options which were given on
+# the command line.
+def variants():
+    choices = [
+        getattr(args, option) or [getattr(config, name) if name else None]
+        for (option, name, _) in varied_options
+    ]
+    for values in itertools.product(*choices):
+        label = list()
+        overrides = dict()
+        for ((option, name, label_format), value) in zip(varied_options, values):
+            if getattr(args, option):
+                label.append(label_format.format(value))
+            if name is not None:
+                overrides[name] = value
+        yield ("_".join(label), values[0], overrides)
+
+
+for scen_id in scenarios_to_run:
+    if scen_id in replay_scenarios and config.REPLAY_LOG is None:
+        print(f"Skipping scenario {scen_id}, no capture given to --replay")
+        continue
+    for (label, mode, overrides) in variants():
+        for (name, value) in overrides.items():
+            setattr(config, name, value)
+        if args.repeat > 1:
+            run_trials(scen_id, label, mode, args.repeat, args.jobs)
+            continue
+        result_file = run_scenario(scen_id, label, mode)
+        write_summary(scen_id, label, mode, result_file)
+
+if args.repeat > 1:
+    metrics.write_trials_csv(
+        metrics.summarise_trials(metrics.summarise_run(config.RESULT_DIR)),
+        config.RESULT_DIR + "trials.csv",
+    )
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+import result
+import sqlite_scenarios
+
+
+# A WAL holding N frames is a 32 byte header and N frames, each a 24 byte header
+# and a page
+def wal_bytes(pages):
+    return 32 + pages * (24 + sqlite_scenarios.page_size)
+
+
+# Roughly the WAL file of the default wal_autocheckpoint of 1000 pages. Only
+# the file's size is sampled, and the file isn't truncated when the WAL starts
+# again after an autocheckpoint, so time with a file at least this large says
+# nothing about how much of it is in use.
+large_wal_file_bytes = 4 * 10 ** 6
+
+# Actions whose step is expected to give space back
+reclaiming_actions = ("vacuum", "incremental_vacuum", "Swap", "backup")
+
+# Steps whose effect on the read probe's latency is reported
+maintenance_steps = ("vacuum", "incremental_vacuum", "checkpoint", "backup", "swap")
+
+
+def scenario_key(file_name):
+    name = os.path.basename(file_name)
+    return name[len("results_scenario_") : -len(".pickled")]
+
+
+def sort_key(key):
+    (scenario, _, label) = key.partition("_")
+    return (int(scenario), label)
+
+
+def load_run(directory):
+    return {
+        scenario_key(f): result.load(f)
+        for f in glob.glob(directory + "/results_scenario_*.pickled")
+    }
+
+
+# The samples of a run as arrays, in seconds from the first sample, and the
+# index of the first sample taken after each action
+class Samples:
+    def __init__(self, results):
+        sizes = [r for r in results.l if isinstance(r, result.FileSize)]
+        timestamps = np.array([r.timestamp for r in sizes], dtype="datetime64[us]")
+        start = timestamps[0]
+
+        self.t = (timestamps - start) / np.timedelta64(1, "s")
+        self.db = np.array([r.db for r in sizes], dtype=np.int64)
+        self.shm = np.array([r.shm for r in sizes], dtype=np.int64)
+        self.wal = np.array([r.wal for r in sizes], dtype=np.int64)
+        self.tmp = np.array([r.tmp_dir for r in sizes], dtype=np.int64)
+        self.rss = np.array([r.rss for r in sizes], dtype=np.int64)
+        self.total = self.db + self.shm + self.wal + self.tmp
+
+        actions = [r for r in results.l if isinstance(r, result.Action)]
+        self.action_msgs = [r.msg for r in actions]
+        self.action_t = (
+            np.array([r.timestamp for r in actions], dtype="datetime64[us]") - start
+        ) / np.timedelta64(1, "s")
+        self.action_index = np.searchsorted(self.t, self.action_t)
+
+        self.durations = [r for r in results.l if isinstance(r, result.Duration)]
+
+        reads = [r for r in results.l if isinstance(r, result.Read)]
+        self.read_t = (
+            np.array([r.timestamp for r in reads], dtype="datetime64[us]") - start
+        ) / np.timedelta64(1, "s")
+        self.read_seconds = np.array([r.seconds for r in reads], dtype=np.float64)
+        self.start = start
+
+        self.recoveries = [r for r in results.l if isinstance(r, result.Recovery)]
+
+        pages = [r for r in results.l if isinstance(r, result.Pages)]
+        self.freelist = np.array([r.free for r in pages], dtype=np.int64)
+        self.fragmentation = np.array(
+            [r.fragmentation for r in pages if r.fragmentation is not None]
+        )
+
+
+action_table_columns = (
+    "seconds",
+    "action",
+    "db before (B)",
+    "db after (B)",
+    "wal before (B)",
+    "wal after (B)",
+    "db+shm+wal+tmp peak (B)",
+)
+
+
+# The sizes just before each action, and at the end of its segment, just
+# before the next action
+def action_table(samples):
+    last = len(samples.t) - 1
+    before = np.clip(samples.action_index - 1, 0, last)
+    after = np.clip(np.append(samples.action_index[1:] - 1, last), 0, last)
+
+    return [
+        {
+            "seconds": float(samples.action_t[i]),
+            "action": samples.action_msgs[i],
+            "db before (B)": int(samples.db[before[i]]),
+            "db after (B)": int(samples.db[after[i]]),
+            "wal before (B)": int(samples.wal[before[i]]),
+            "wal after (B)": int(samples.wal[after[i]]),
+            "db+shm+wal+tmp peak (B)": int(
+                samples.total[before[i] : after[i] + 1].max()
+            ),
+        }
+        for i in range(len(samples.action_msgs))
+    ]
+
+
+# A timestamp as seconds from the first sample
+def seconds_at(samples, timestamp):
+    return float(
+        (np.datetime64(timestamp, "us") - samples.start) / np.timedelta64(1, "s")
+    )
+
+
+# The maintenance steps, and which reads overlapped each of them
+def _maintenance_reads(samples):
+    read_end = samples.read_t + samples.read_seconds
+    return [
+        (
+            d,
+            (samples.read_t < seconds_at(samples, d.end))
+            & (read_end > seconds_at(samples, d.timestamp)),
+        )
+        for d in samples.durations
+        if d.msg.startswith(maintenance_steps)
+    ]
+
+
+def _p99(seconds):
+    return float(np.percentile(seconds, 99)) if len(seconds) else None
+
+
+# Each maintenance step, as seconds from the first sample, and the 99th
+# percentile latency of the reads overlapping it. None if no read did.
+def read_windows(samples):
+    return [
+        (
+            d.msg,
+            seconds_at(samples, d.timestamp),
+            seconds_at(samples, d.end),
+            _p99(samples.read_seconds[overlapping]),
+        )
+        for (d, overlapping) in _maintenance_reads(samples)
+    ]
+
+
+# Seconds from the first sample until the file sizes stop changing. Closing the
+# connection at the end of every scenario removes the WAL, so only the samples
+# taken before then count.
+def steady_state_seconds(samples):
+    end = len(samples.t)
+    for (msg, index) in zip(samples.action_msgs, samples.action_index):
+        if msg == "Closing connection":
+            end = index
+    sizes = np.stack((samples.db, samples.wal, samples.tmp))[:, :end]
+    changed = np.flatnonzero((np.diff(sizes, axis=1) != 0).any(axis=0))
+    if len(changed) == 0:
+        return 0.0
+    return float(samples.t[changed[-1] + 1])
+
+
+standard_kpis = (
+    "samples",
+    "duration (s)",
+    "peak db (B)",
+    "peak wal (B)",
+    "peak tmp (B)",
+    "peak db+shm+wal+tmp (B)",
+    "peak rss (B)",
+    "final db (B)",
+    "final wal (B)",
+    "wal file > 4 MB (s)",
+    "steady state (s)",
+    "reclaimed by vacuum (B)",
+    "peak freelist (pages)",
+    "final freelist (pages)",
+    "peak fragmentation (ratio)",
+    "final fragmentation (ratio)",
+    "reads",
+    "read p99 (s)",
+    "read p99 outside maintenance (s)",
+    "failed quick_checks",
+)
+
+
+# Names end with the unit. Step durations are summed over repeats of the step.
+def scenario_kpis(samples, actions):
+    # Each sample stands for the time until the next one
+    dt = np.diff(samples.t, append=samples.t[-1])
+
+    reclaimed = sum(
+        a["db before (B)"] - a["db after (B)"]
+        for a in actions
+        if a["action"].startswith(reclaiming_actions)
+    )
+
+    kpis = {
+        "samples": len(samples.t),
+        "duration (s)": float(samples.t[-1]),
+        "peak db (B)": int(samples.db.max()),
+        "peak wal (B)": int(samples.wal.max()),
+        "peak tmp (B)": int(samples.tmp.max()),
+        "peak db+shm+wal+tmp (B)": int(samples.total.max()),
+        "peak rss (B)": int(samples.rss.max()),
+        "final db (B)": int(samples.db[-1]),
+        "final wal (B)": int(samples.wal[-1]),
+        "wal file > 4 MB (s)": float(dt[samples.wal > large_wal_file_bytes].sum()),
+        "steady state (s)": steady_state_seconds(samples),
+        "reclaimed by vacuum (B)": int(reclaimed),
+    }
+    # Only scenarios which measure their page usage
+    if len(samples.freelist):
+        kpis["peak freelist (pages)"] = int(samples.freelist.max())
+        kpis["final freelist (pages)"] = int(samples.freelist[-1])
+    if len(samples.fragmentation):
+        kpis["peak fragmentation (ratio)"] = float(samples.fragmentation.max())
+        kpis["final fragmentation (ratio)"] = float(samples.fragmentation[-1])
+    if len(samples.read_seconds):
+        kpis.update(read_kpis(samples))
+    if samples.recoveries:
+        kpis["peak recovery (s)"] = max(r.seconds() for r in samples.recoveries)
+        kpis["failed quick_checks"] = sum(
+            r.quick_check != "ok" for r in samples.recoveries
+        )
+    for d in samples.durations:
+        name = f"{d.msg} (s)"
+        kpis[name] = kpis.get(name, 0.0) + d.seconds()
+    return kpis
+
+
+# p99 read latency over the whole run, outside maintenance, and during each
+# kind of maintenance step, over every repeat of the step
+def read_kpis(samples):
+    kpis = {
+        "reads": len(samples.read_seconds),
+        "read p99 (s)": _p99(samples.read_seconds),
+    }
+    during = dict()
+    in_maintenance = np.zeros(len(samples.read_seconds), dtype=bool)
+    for (d, overlapping) in _maintenance_reads(samples):
+        during[d.msg] = during.get(d.msg, overlapping) | overlapping
+        in_maintenance |= overlapping
+
+    if (~in_maintenance).any():
+        kpis["read p99 outside maintenance (s)"] = _p99(
+            samples.read_seconds[~in_maintenance]
+        )
+    for (msg, overlapping) in during.items():
+        if overlapping.any():
+            kpis[f"read p99 during {msg} (s)"] = _p99(samples.read_seconds[overlapping])
+    return kpis
+
+
+def summarise(results):
+    samples = Samples(results)
+    actions = action_table(samples)
+    return {
+        "title": results.title,
+        "kpis": scenario_kpis(samples, actions),
+        "actions": actions,
+    }
+
+
+def summarise_run(directory):
+    run = load_run(directory)
+    return {key: summarise(run[key]) for key in sorted(run, key=sort_key)}
+
+
+def write_csv(summary, file_name):
+    columns = list()
+    for s in summary.values():
+        columns += [c for c in s["kpis"] if c not in columns]
+
+    with open(file_name + ".csv", "w") as f:
+        f.write(", ".join(["scenario", "title"] + columns) + "\n")
+        for (key, s) in summary.items():
+            values = [str(s["kpis"].get(c, "")) for c in columns]
+            f.write(", ".join([key, f'"{s["title"]}"'] + values) + "\n")
+
+    action_columns = list(action_table_columns)
+    with open(file_name + "_actions.csv", "w") as f:
+        f.write(", ".join(["scenario"] + action_columns) + "\n")
+        for (key, s) in summary.items():
+            for a in s["actions"]:
+                values = [str(a[c]) for c in action_columns]
+                values[action_columns.index("action")] = f'"{a["action"]}"'
+                f.write(", ".join([key] + values) + "\n")
+
+
+# Two sided 95% critical values of Student's t distribution, by degrees of
+# freedom. In between, the next lowest is used, which errs on the wide side.
+t_critical_95 = {
+    1: 12.706,
+    2: 4.303,
+    3: 3.182,
+    4: 2.776,
+    5: 2.571,
+    6: 2.447,
+    7: 2.365,
+    8: 2.306,
+    9: 2.262,
+    10: 2.228,
+    15: 2.131,
+    20: 2.086,
+    30: 2.042,
+    60: 2.000,
+    120: 1.980,
+}
+
+
+def t_critical(degrees_of_freedom):
+    return t_critical_95[max(df for df in t_critical_95 if df <= degrees_of_freedom)]
+
+
+def trial_group(key):
+    (group, separator, trial) = key.rpartition("_trial")
+    if not separator or not trial.isdigit():
+        return None
+    return group
+
+
+# Outliers are outside Tukey's fences, 1.5 interquartile ranges beyond the
+# quartiles
+def distribution(values):
+    v = np.array(values, dtype=np.float64)
+    n = len(v)
+    std = v.std(ddof=1) if n > 1 else 0.0
+    half_width = t_critical(n - 1) * std / np.sqrt(n) if n > 1 else 0.0
+    (q1, q3) = np.percentile(v, [25, 75])
+    fence = 1.5 * (q3 - q1)
+    outliers = np.flatnonzero((v < q1 - fence) | (v > q3 + fence))
+
+    return {
+        "n": n,
+        "mean": float(v.mean()),
+        "std": float(std),
+        "ci95 low": float(v.mean() - half_width),
+        "ci95 high": float(v.mean() + half_width),
+        "min": float(v.min()),
+        "max": float(v.max()),
+        "outliers": outliers,
+    }
+
+
+# Group the scenarios of a run by trial, and summarise the spread of each KPI
+def summarise_trials(summary):
+    groups = dict()
+    for (key, s) in summary.items():
+        group = trial_group(key)
+        if group is not None:
+            groups.setdefault(group, list()).append((key, s["kpis"]))
+
+    trials = dict()
+    for (group, members) in groups.items():
+        names = list()
+        for (_, kpis) in members:
+            names += [name for name in kpis if name not in names]
+        trials[group] = dict()
+        for name in names:
+            present = [(key, kpis[name]) for (key, kpis) in members if name in kpis]
+            d = distribution([value for (_, value) in present])
+            d["outliers"] = [present[i][0] for i in d["outliers"]]
+            trials[group][name] = d
+    return trials
+
+
+def write_trials_csv(trials, file_name):
+    columns = ("n", "mean", "std", "ci95 low", "ci95 high", "min", "max")
+    with open(file_name, "w") as f:
+        f.write(", ".join(("scenario", "kpi") + columns + ("outliers",)) + "\n")
+        for (group, kpis) in trials.items():
+            for (name, d) in kpis.items():
+                values = [str(d[c]) for c in columns]
+                outliers = " ".join(d["outliers"])
+                f.write(", ".join([group, name] + values + [outliers]) + "\n")
+
+
+def write_json(summary, file_name):
+    with open(file_name + ".json", "w") as f:
+        json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="SQLiteWALMetrics")
+    parser.add_argument(
+        "result", type=str, help="Result folder to summarise every scenario of"
+    )
+    parser.add_argument(
+        "--format",
+        choices=("csv", "json"),
+        default="csv",
+        help="Written to metrics.csv and metrics_actions.csv, or metrics.json",
+    )
+    parser.add_argument(
+        "--trials",
+        action="store_true",
+        help="Also summarise repeated trials of each scenario to trials.csv",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    summary = summarise_run(args.result)
+    output = args.result + "/metrics"
+    if args.format == "csv":
+        write_csv(summary, output)
+    else:
+        write_json(summary, output)
+    if args.trials:
+        write_trials_csv(summarise_trials(summary), args.result + "/trials.csv")
+    print(
+        f"Summarised {len(summary)} scenarios in "
+        f"{time.perf_counter() - start:.3f}s to {output}.{args.format}"
+    )
@@ -1,10 +1,87 @@
 #!/usr/bin/env python3
 
+import argparse
 import os
 import time
 import result
 
 import pickle
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import config
+import exporter
+
+sample_dtype = np.dtype(
+    [
+        ("timestamp_us", np.int64),
+        ("db", np.int64),
+        ("shm", np.int64),
+        ("wal", np.int64),
+        ("tmp_dir", np.int64),
+        ("rss", np.int64),
+    ]
+)
+
+
+# The monitor's latest samples, in shared memory so the scenario can act on
+# them as they are taken. The header holds the number of samples ever published
+# and the capacity, followed by the ring of samples. Readers only look at the
+# newest sample, which won't be overwritten until the ring wraps, so no locking
+# is needed.
+class SampleRing:
+    header = np.dtype([("count", np.int64), ("capacity", np.int64)])
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.name = memory.name
+        self.header_view = np.ndarray((), dtype=self.header, buffer=memory.buf)
+        self.samples = np.ndarray(
+            (int(self.header_view["capacity"]),),
+            dtype=sample_dtype,
+            buffer=memory.buf,
+            offset=self.header.itemsize,
+        )
+
+    @classmethod
+    def create(cls, capacity):
+        memory = shared_memory.SharedMemory(
+            create=True, size=cls.header.itemsize + capacity * sample_dtype.itemsize
+        )
+        header_view = np.ndarray((), dtype=cls.header, buffer=memory.buf)
+        header_view["count"] = 0
+        header_view["capacity"] = capacity
+        return cls(memory)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name))
+
+    def publish(self, file_size):
+        count = int(self.header_view["count"])
+        self.samples[count % len(self.samples)] = (
+            int(file_size.timestamp.timestamp() * 10 ** 6),
+            file_size.db,
+            file_size.shm,
+            file_size.wal,
+            file_size.tmp_dir,
+            file_size.rss,
+        )
+        self.header_view["count"] = count + 1
+
+    # A view of the newest sample, or None before the first
+    def latest(self):
+        count = int(self.header_view["count"])
+        if count == 0:
+            return None
+        return self.samples[(count - 1) % len(self.samples)]
+
+    def close(self):
+        # numpy views have to go before the memory can be closed
+        del self.header_view
+        del self.samples
+        self.memory.close()
 
 
 def get_size_or_zero(filename):
@@ -14,32 +91,213 @@ def get_size_or_zero(filename):
         return 0
 
 
-def get_file_sizes(db, shm, wal, tmp_dir):
+# SQLite unlinks its temporary files as soon as they are opened, so they never
+# show up in a directory listing. Find them through the scenario process's open
+# file descriptors instead.
+def get_deleted_open_files_size(pid, directory):
+    if pid is None:
+        return 0
+
+    directory = os.path.abspath(directory)
+    fd_dir = f"/proc/{pid}/fd"
+    size = 0
+    try:
+        fds = os.listdir(fd_dir)
+    except FileNotFoundError:
+        return 0
+
+    for fd in fds:
+        try:
+            target = os.readlink(f"{fd_dir}/{fd}")
+            if target.startswith(directory) and target.endswith(" (deleted)"):
+                size += os.stat(f"{fd_dir}/{fd}").st_size
+        except (FileNotFoundError, PermissionError):
+            continue
+    return size
+
+
+def get_rss_or_zero(pid):
+    if pid is None:
+        return 0
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+    return 0
+
 
+def get_tmp_dir_size(tmp_dir, pid=None, extra_tmp_files=()):
+    if tmp_dir is None:
+        return sum(get_size_or_zero(f) for f in extra_tmp_files)
     try:
         tmp_dir_size = sum(f.stat().st_size for f in os.scandir(tmp_dir))
     except FileNotFoundError:
         # Lazy - give it another shot
         tmp_dir_size = sum(f.stat().st_size for f in os.scandir(tmp_dir))
 
+    tmp_dir_size += get_deleted_open_files_size(pid, tmp_dir)
+    tmp_dir_size += sum(get_size_or_zero(f) for f in extra_tmp_files)
+    return tmp_dir_size
+
+
+def get_file_sizes(db, shm, wal, tmp_dir, pid=None, extra_tmp_files=()):
     return result.FileSize(
-        get_size_or_zero(db), get_size_or_zero(shm), get_size_or_zero(wal), tmp_dir_size
+        get_size_or_zero(db),
+        get_size_or_zero(shm),
+        get_size_or_zero(wal),
+        get_tmp_dir_size(tmp_dir, pid, extra_tmp_files),
+        get_rss_or_zero(pid),
+    )
+
+
+# Every database in a directory, from one scan of it rather than looking up
+# each database's three files by name. Only the files found are stat'ed.
+def get_fleet_sizes(fleet_dir, tmp_dir, pid=None):
+    sizes = {"db": 0, "shm": 0, "wal": 0}
+    per_db = dict()
+    with os.scandir(fleet_dir) as entries:
+        for entry in entries:
+            (base, _, suffix) = entry.name.partition(".db")
+            if suffix not in ("", "-shm", "-wal") or not base:
+                continue
+            try:
+                size = entry.stat().st_size
+            except FileNotFoundError:
+                continue
+            sizes[suffix[1:] or "db"] += size
+            per_db[base] = per_db.get(base, 0) + size
+
+    return result.FleetSize(
+        sizes["db"],
+        sizes["shm"],
+        sizes["wal"],
+        get_tmp_dir_size(tmp_dir, pid),
+        get_rss_or_zero(pid),
+        len(per_db),
+        max(per_db.values(), default=0),
     )
 
 
-def monitor(stop_event, action_log_receiver, db_file, temp_dir, result_file):
-    db_shm_file = db_file + "-shm"
-    db_wal_file = db_file + "-wal"
+# One sample of the database, or given a fleet_dir, of every database in it
+def sample(db_file, temp_dir, scenario_pid, extra_tmp_files=(), fleet_dir=None):
+    if fleet_dir is not None:
+        return get_fleet_sizes(fleet_dir, temp_dir, scenario_pid)
+    return get_file_sizes(
+        db_file,
+        db_file + "-shm",
+        db_file + "-wal",
+        temp_dir,
+        scenario_pid,
+        extra_tmp_files,
+    )
+
+
+def start_exporter(metrics_port):
+    if metrics_port is None:
+        return None
+    metrics = exporter.Exporter()
+    try:
+        metrics.serve(metrics_port)
+    except OSError as e:
+        print(f"Not serving metrics on port {metrics_port}: {e}")
+        return None
+    return metrics
+
 
+# Files in extra_tmp_files, such as a compacted copy of the database waiting to
+# be swapped in, are counted as temp space. Given a fleet_dir, every database
+# in it is sampled instead of db_file. Given a metrics_port, the latest sample,
+# actions and step timings are served on localhost as OpenMetrics.
+def monitor(
+    stop_event,
+    action_log_receiver,
+    db_file,
+    temp_dir,
+    result_file,
+    scenario_pid=None,
+    extra_tmp_files=(),
+    ring_name=None,
+    fleet_dir=None,
+    metrics_port=None,
+):
     result_list = result.ResultList()
+    ring = SampleRing.attach(ring_name) if ring_name is not None else None
+    metrics = start_exporter(metrics_port)
 
     while stop_event.is_set() is False:
-        if action_log_receiver.poll():
-            result_list.add(action_log_receiver.recv())
-        result_list.add(get_file_sizes(db_file, db_shm_file, db_wal_file, temp_dir))
-        time.sleep(0.2)
+        while action_log_receiver.poll():
+            r = action_log_receiver.recv()
+            result_list.add(r)
+            if metrics is not None:
+                metrics.add(r)
+        start = time.perf_counter()
+        file_size = sample(db_file, temp_dir, scenario_pid, extra_tmp_files, fleet_dir)
+        result_list.add(file_size)
+        if ring is not None:
+            ring.publish(file_size)
+        if metrics is not None:
+            metrics.add(file_size, time.perf_counter() - start)
+        time.sleep(config.SAMPLE_INTERVAL)
+
+    if ring is not None:
+        ring.close()
+    if metrics is not None:
+        metrics.close()
+
+    while action_log_receiver.poll():
+        result_list.add(action_log_receiver.recv())
 
     result_list.write_csv(result_file + ".csv")
 
     with open(result_file + ".pickled", "wb") as pickle_file:
         pickle.dump(result_list, pickle_file)
+
+
+# The monitor on its own, next to any database, serving its samples until
+# interrupted rather than recording them
+def daemon(db_file, temp_dir, pid, metrics_port, interval):
+    metrics = exporter.Exporter()
+    metrics.serve(metrics_port)
+    print(f"Serving samples of {db_file} on http://127.0.0.1:{metrics_port}/metrics")
+    try:
+        while True:
+            start = time.perf_counter()
+            metrics.add(sample(db_file, temp_dir, pid), time.perf_counter() - start)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        metrics.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="SQLiteWALMonitor")
+    parser.add_argument("db", type=str, help="Database to sample")
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=config.METRICS_PORT or 9464,
+        help="Port to serve the samples on, on localhost",
+    )
+    parser.add_argument(
+        "--tmp_dir",
+        type=str,
+        help="Directory SQLite puts its temp files in, not sampled if not given",
+    )
+    parser.add_argument(
+        "--pid",
+        type=int,
+        help="Process using the database, to sample its memory and the temp "
+        "files it has open",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=config.SAMPLE_INTERVAL,
+        help=f"Seconds between samples, default {config.SAMPLE_INTERVAL}",
+    )
+    args = parser.parse_args()
+    daemon(args.db, args.tmp_dir, args.pid, args.port, args.interval)
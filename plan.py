@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import math
+import os
+import pathlib
+import re
+import struct
+import sqlite3
+import time
+
+import numpy as np
+
+import config
+import metrics
+import monitor
+import sqlite_scenarios
+
+# Seconds _log_action sleeps around an action, which end up in the action's
+# segment. Only used to time steps of runs from before steps were timed.
+log_action_seconds = 3.4
+
+pages_note = re.compile(r"Pages Used:(\d+) Free:(\d+)")
+
+# The kinds of step calibrated, the action starting each, and whether it works
+# through the used or the free pages of the database. Checkpoints work through
+# the frames in the WAL.
+calibrated_steps = {
+    "vacuum": ("vacuum", "used"),
+    "vacuum into": ("vacuum into", "used"),
+    "incremental_vacuum": ("incremental_vacuum(0)", "free"),
+    "checkpoint": ("Checkpoint (truncate)", "wal"),
+}
+
+# The pointer map types of pages, which say what would have to be updated if the
+# page were moved
+ptrmap_types = {1: "root", 2: "free", 3: "overflow", 4: "overflow", 5: "btree"}
+
+auto_vacuum_modes = ("NONE", "FULL", "INCREMENTAL")
+
+
+def _read_page(fd, page_size, number):
+    return os.pread(fd, page_size, (number - 1) * page_size)
+
+
+# The -shm WAL index records the last frame in the WAL and how many frames have
+# been checkpointed. Once they're equal the database file is up to date.
+def _wal_checkpointed(db_file):
+    wal = monitor.get_size_or_zero(db_file + "-wal")
+    if wal <= 32:
+        return True
+    try:
+        with open(db_file + "-shm", "rb") as shm:
+            index = shm.read(100)
+    except FileNotFoundError:
+        return False
+    if len(index) < 100:
+        return False
+    (max_frame,) = struct.unpack("=I", index[16:20])
+    (backfilled,) = struct.unpack("=I", index[96:100])
+    return max_frame == backfilled
+
+
+# Every free page, from the trunk pages of the freelist. Each trunk page lists
+# up to a page of leaf pages, so a GB of free pages is a few hundred reads.
+def _freelist(fd, page_size, header):
+    (trunk, count) = struct.unpack(">II", header[32:40])
+    pages = list()
+    while trunk and len(pages) < count:
+        page = _read_page(fd, page_size, trunk)
+        (next_trunk, leaves) = struct.unpack(">II", page[:8])
+        pages.append(np.array([trunk], dtype=np.int64))
+        pages.append(np.frombuffer(page, ">u4", leaves, 8).astype(np.int64))
+        trunk = next_trunk
+    if not pages:
+        return np.zeros(0, dtype=np.int64)
+    return np.sort(np.concatenate(pages))
+
+
+# The page holding the bytes SQLite locks, at 1 GiB into the file, which is
+# never used
+def _pending_byte_page(page_size):
+    return 0x40000000 // page_size + 1
+
+
+# Pointer map pages follow page 1 and then every usable / 5 pages, each with a
+# 5 byte entry of the page's type and parent for the pages up to the next one.
+# A pointer map page due to be the pending byte page is the page after instead.
+def _ptrmap_pages(page_size, usable, first, last):
+    per_map = usable // 5
+    pages = np.arange(2, last + 1, per_map + 1, dtype=np.int64)
+    pages = pages[pages + per_map >= first]
+    pages[pages == _pending_byte_page(page_size)] += 1
+    return pages
+
+
+# The pointer map type of each page in [first, last], bar the pending byte page
+def _ptrmap_types(fd, page_size, usable, first, last):
+    types = list()
+    for ptrmap in _ptrmap_pages(page_size, usable, first, last):
+        page = _read_page(fd, page_size, ptrmap)
+        entries = np.frombuffer(page, np.uint8, (usable // 5) * 5).reshape(-1, 5)
+        numbers = ptrmap + 1 + np.arange(len(entries))
+        wanted = (numbers >= first) & (numbers <= last)
+        wanted &= numbers != _pending_byte_page(page_size)
+        types.append(entries[wanted, 0])
+    if not types:
+        return np.zeros(0, dtype=np.uint8)
+    return np.concatenate(types)
+
+
+# Opens a database without changing anything on disk. Opening a WAL database
+# creates its -shm, and a -wal if there isn't one, even read only. With no -wal
+# there's nothing outside the database file to read, so it's opened immutable,
+# which creates neither.
+def _connect_read_only(db_file):
+    uri = pathlib.Path(os.path.abspath(db_file)).as_uri() + "?mode=ro"
+    if not os.path.exists(db_file + "-wal"):
+        uri += "&immutable=1"
+    return sqlite3.connect(uri, uri=True)
+
+
+# What SQLite reports of a database, opened read only, and where its free pages
+# lie, read from the file itself when it's up to date with the WAL
+class Database:
+    def __init__(self, db_file):
+        connection = _connect_read_only(db_file)
+        cursor = connection.cursor()
+        pragmas = ("page_size", "page_count", "freelist_count", "auto_vacuum")
+        (self.page_size, self.page_count, self.freelist_count, self.auto_vacuum) = [
+            cursor.execute(f"PRAGMA {p};").fetchone()[0] for p in pragmas
+        ]
+        cursor.execute("PRAGMA journal_mode;")
+        self.journal_mode = cursor.fetchone()[0]
+        connection.close()
+        # An immutable connection always reports a rollback journal, but the
+        # header's file format versions are 2 in WAL mode
+        with open(db_file, "rb") as f:
+            if f.read(20)[18] == 2:
+                self.journal_mode = "wal"
+
+        self.db = monitor.get_size_or_zero(db_file)
+        self.wal = monitor.get_size_or_zero(db_file + "-wal")
+        self.shm = monitor.get_size_or_zero(db_file + "-shm")
+        self.used = self.page_count - self.freelist_count
+        # Where an incremental vacuum would truncate the file
+        self.end = self.used
+
+        self.free_pages = None
+        self.tail_types = None
+        if not _wal_checkpointed(db_file):
+            return
+        fd = os.open(db_file, os.O_RDONLY)
+        try:
+            header = _read_page(fd, self.page_size, 1)
+            usable = self.page_size - header[20]
+            self.free_pages = _freelist(fd, self.page_size, header)
+            if self.auto_vacuum:
+                self.tail_types = _ptrmap_types(
+                    fd, self.page_size, usable, self.end + 1, self.page_count
+                )
+        finally:
+            os.close(fd)
+
+    def bytes(self, pages):
+        return pages * self.page_size
+
+    def footprint(self):
+        return self.db + self.wal + self.shm
+
+
+# Runs of consecutive free pages
+def free_extents(free_pages):
+    if len(free_pages) == 0:
+        return 0
+    return int(np.count_nonzero(np.diff(free_pages) != 1) + 1)
+
+
+def _duration(samples, msg, start, end):
+    for d in samples.durations:
+        if d.msg != msg.lower():
+            continue
+        if start <= metrics.seconds_at(samples, d.timestamp):
+            return d.seconds()
+    return max(end - start - log_action_seconds, 0.0)
+
+
+# Each step of a kind in a run, as the seconds taken, the WAL written and the
+# temporary space used per byte of the pages worked through
+def _observations(samples, kind):
+    (msg, basis) = calibrated_steps[kind]
+    last = len(samples.t) - 1
+    note = None
+    for (i, action) in enumerate(samples.action_msgs):
+        match = pages_note.match(action)
+        if match:
+            note = [int(pages) for pages in match.groups()]
+            continue
+        if action != msg:
+            continue
+
+        before = max(samples.action_index[i] - 1, 0)
+        end = samples.action_index[i + 1] if i + 1 < len(samples.action_msgs) else last
+        segment = slice(before, max(end, before + 1))
+        if basis == "used":
+            pages = (
+                note[0] if note else samples.db[before] // sqlite_scenarios.page_size
+            )
+        elif basis == "free":
+            pages = note[1] if note else 0
+        else:
+            pages = samples.wal[before] // (sqlite_scenarios.page_size + 24)
+        # Too few pages to say anything about the rate
+        if pages < 100:
+            continue
+
+        next_t = samples.action_t[i + 1] if i + 1 < len(samples.action_t) else None
+        seconds = _duration(
+            samples,
+            msg,
+            samples.action_t[i],
+            samples.t[last] if next_t is None else next_t,
+        )
+        work = pages * sqlite_scenarios.page_size
+        yield (
+            seconds / work,
+            (samples.wal[segment].max() - samples.wal[before]) / work,
+            (samples.tmp[segment].max() - samples.tmp[before]) / work,
+        )
+
+
+# The median rates of each kind of step over every scenario of the results
+# folders. Kinds never measured are left out.
+def calibrate(directories):
+    observations = {kind: list() for kind in calibrated_steps}
+    for directory in directories:
+        for results in metrics.load_run(directory).values():
+            samples = metrics.Samples(results)
+            for kind in calibrated_steps:
+                observations[kind] += _observations(samples, kind)
+    return {
+        kind: (len(o), np.median(np.array(o), axis=0))
+        for (kind, o) in observations.items()
+        if o
+    }
+
+
+def _ratio(calibration, kind, index, default):
+    if kind in calibration:
+        return calibration[kind][1][index]
+    return default
+
+
+def _seconds(calibration, kind, work):
+    if kind not in calibration:
+        return None
+    return float(calibration[kind][1][0] * work)
+
+
+# Reclaimed space, temporary space, WAL growth, peak disk and duration of each
+# strategy. The WAL is assumed to grow by what's written rather than reusing
+# what it already has, which errs on the large side.
+def predict(db, calibration, chunk_pages):
+    frame_ratio = (db.page_size + 24) / db.page_size
+    used = db.bytes(db.used)
+    free = db.bytes(db.freelist_count)
+
+    vacuum_tmp = int(used * _ratio(calibration, "vacuum", 2, 1.0))
+    vacuum_wal = int(used * _ratio(calibration, "vacuum", 1, frame_ratio))
+    into_tmp = int(used * _ratio(calibration, "vacuum into", 2, 1.0))
+    predictions = {
+        "vacuum": {
+            "reclaimed (B)": free,
+            "tmp (B)": vacuum_tmp,
+            "wal growth (B)": vacuum_wal,
+            "peak disk (B)": db.footprint() + vacuum_tmp + vacuum_wal,
+            "duration (s)": _seconds(calibration, "vacuum", used),
+        },
+        "vacuum into": {
+            "reclaimed (B)": free,
+            "tmp (B)": into_tmp,
+            "wal growth (B)": 0,
+            "peak disk (B)": db.footprint() + into_tmp,
+            "duration (s)": _seconds(calibration, "vacuum into", used),
+        },
+    }
+    if db.auto_vacuum != 2:
+        return predictions
+
+    wal_ratio = _ratio(calibration, "incremental_vacuum", 1, frame_ratio)
+    incremental_wal = int(free * wal_ratio)
+    predictions["incremental_vacuum(0)"] = {
+        "reclaimed (B)": free,
+        "tmp (B)": 0,
+        "wal growth (B)": incremental_wal,
+        "peak disk (B)": db.footprint() + incremental_wal,
+        "duration (s)": _seconds(calibration, "incremental_vacuum", free),
+    }
+
+    # A truncating checkpoint after each chunk shrinks the db and resets the WAL,
+    # so the first chunk is the largest the WAL gets
+    chunks = math.ceil(db.freelist_count / chunk_pages)
+    chunk_wal = int(db.bytes(min(chunk_pages, db.freelist_count)) * wal_ratio)
+    seconds = _seconds(calibration, "incremental_vacuum", free)
+    checkpoint_seconds = _seconds(calibration, "checkpoint", incremental_wal)
+    if seconds is not None and checkpoint_seconds is not None:
+        seconds += checkpoint_seconds
+    else:
+        seconds = None
+    predictions[f"incremental_vacuum({chunk_pages}) x {chunks}"] = {
+        "reclaimed (B)": free,
+        "tmp (B)": 0,
+        "wal growth (B)": chunk_wal,
+        "peak disk (B)": db.footprint() + chunk_wal,
+        "duration (s)": seconds,
+    }
+    return predictions
+
+
+def _print_layout(db):
+    print(f"    page size {db.page_size} B, {db.page_count} pages")
+    print(f"    used {db.used} pages, {db.bytes(db.used)} B")
+    print(f"    free {db.freelist_count} pages, {db.bytes(db.freelist_count)} B")
+    print(
+        f"    journal_mode {db.journal_mode}, "
+        f"auto_vacuum {auto_vacuum_modes[db.auto_vacuum]}"
+    )
+    print(f"    db {db.db} B, wal {db.wal} B, shm {db.shm} B")
+    if db.free_pages is None:
+        print("    freelist layout unknown, the WAL hasn't been checkpointed")
+        return
+    at_end = int(np.count_nonzero(db.free_pages > db.end))
+    print(
+        f"    {free_extents(db.free_pages)} runs of free pages, "
+        f"{at_end} free pages past page {db.end}"
+    )
+    if db.tail_types is not None:
+        moved = [ptrmap_types.get(int(t), "ptrmap") for t in db.tail_types if t != 2]
+        counts = ", ".join(f"{moved.count(kind)} {kind}" for kind in sorted(set(moved)))
+        print(f"    incremental vacuum moves {len(moved)} pages: {counts or 'none'}")
+
+
+def _print_calibration(calibration, directories):
+    print(f"Calibrated from {len(directories)} results folder(s)")
+    for kind in calibrated_steps:
+        if kind not in calibration:
+            print(f"    {kind:<20} not measured, durations unknown")
+            continue
+        (count, (seconds, wal, tmp)) = calibration[kind]
+        print(
+            f"    {kind:<20} {count:>3} steps, "
+            f"{1 / seconds / 10 ** 6 if seconds else math.inf:8.1f} MB/s, "
+            f"wal x{wal:.2f}, tmp x{tmp:.2f}"
+        )
+
+
+def fmt(value):
+    return f"{value:.1f}" if isinstance(value, float) else str(value)
+
+
+def _print_predictions(db, predictions):
+    columns = list(next(iter(predictions.values())))
+    print(f"    {'strategy':<32}" + "".join(f"{c:>18}" for c in columns))
+    for (strategy, p) in predictions.items():
+        values = ["-" if v is None else fmt(v) for v in p.values()]
+        print(f"    {strategy:<32}" + "".join(f"{v:>18}" for v in values))
+    if db.auto_vacuum == 0:
+        print("    incremental vacuum needs auto_vacuum=INCREMENTAL, set by a vacuum")
+    elif db.auto_vacuum == 1:
+        print("    incremental vacuum does nothing with auto_vacuum=FULL")
+    if db.journal_mode != "wal":
+        print("    measured in WAL mode, a rollback journal is written instead")
+
+
+def plan(db_file, calibration, chunk_pages):
+    start = time.perf_counter()
+    db = Database(db_file)
+    print(f"\n{db_file}")
+    _print_layout(db)
+    print("Predicted")
+    _print_predictions(db, predict(db, calibration, chunk_pages))
+    print(f"Inspected in {time.perf_counter() - start:.3f}s")
+
+
+parser = argparse.ArgumentParser(prog="SQLiteWALPlan")
+parser.add_argument(
+    "db", type=str, nargs="+", help="Database to plan compacting, not modified"
+)
+parser.add_argument(
+    "--calibrate",
+    type=str,
+    nargs="*",
+    default=glob.glob(config.WORKING_DIR + "/results/*/"),
+    help="Results folders to measure the rate of each step from, "
+    "default every folder in results",
+)
+parser.add_argument(
+    "--chunk_pages",
+    type=int,
+    default=sqlite_scenarios.twoish_mb_of_pages,
+    help="Pages freed per chunk of a chunked incremental vacuum",
+)
+args = parser.parse_args()
+
+calibration = calibrate(args.calibrate)
+_print_calibration(calibration, args.calibrate)
+for db_file in args.db:
+    plan(db_file, calibration, args.chunk_pages)
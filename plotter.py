@@ -9,6 +9,7 @@ import result
 import glob
 
 import config
+import metrics
 
 cm = 1 / 2.54
 
@@ -28,7 +29,10 @@ def plot_file_data(file_name, show_fig):
     y_tmp = list()
     y_shm = list()
 
-    initial_timestamp = results.l[0].timestamp
+    # The same start as metrics.Samples, so the read probe's timings line up
+    initial_timestamp = next(
+        r.timestamp for r in results.l if isinstance(r, result.FileSize)
+    )
 
     for r in results.l:
         if not isinstance(r, result.FileSize):
@@ -45,22 +49,41 @@ def plot_file_data(file_name, show_fig):
 
     ratio = 1.414
     height = 15 * cm / ratio
-    width = x[-1] / 6 * cm if big_graph else 18 * cm
+    # Long runs at scale would otherwise produce an image too large to render
+    width = min(x[-1] / 6, 300) * cm if big_graph else 18 * cm
     plt.figure(figsize=(width, height))
 
     plt.plot(x, y_db, label="db", color="blue", linewidth=2)
     plt.plot(x, y_wal, label="wal", color="orange", linewidth=2)
     plt.plot(x, y_tmp, label="tmp", color="green", linewidth=2)
 
+    # Samples from inside long statements, between the monitor's samples
+    progress = [r for r in results.l if isinstance(r, result.StatementProgress)]
+    if progress:
+        x_progress = [
+            (r.timestamp - initial_timestamp).total_seconds() for r in progress
+        ]
+        for (series, colour) in (
+            ("db", "blue"),
+            ("wal", "orange"),
+            ("tmp_dir", "green"),
+        ):
+            y = [to_mb(getattr(r.sizes, series)) for r in progress]
+            plt.scatter(x_progress, y, s=4, color=colour, marker="x")
+
     plt.xlabel("Seconds (s)")
     plt.ylabel("Megabyte (MB)")
 
     x_ticks_increment = 10
 
     axes = plt.gca()
-    axes.set_xticks(range(0, int(x[-1]) + 1, x_ticks_increment))
-    axes.set_xticks(range(0, int(x[-1]) + 1), minor=True)
-    axes.set_yticks([0, 4, 20, 40, 60, 80, 85, 90, 95, 100, 105, 110])
+    # The fixed ticks are chosen for the default 100 MB database. Leave larger
+    # runs to matplotlib.
+    if x[-1] <= 1800:
+        axes.set_xticks(range(0, int(x[-1]) + 1, x_ticks_increment))
+        axes.set_xticks(range(0, int(x[-1]) + 1), minor=True)
+    if max(y_db + y_wal + y_tmp) <= 110:
+        axes.set_yticks([0, 4, 20, 40, 60, 80, 85, 90, 95, 100, 105, 110])
     axes.grid(axis="y", alpha=0.4)
 
     plt.title(results.title)
@@ -87,6 +110,14 @@ def plot_file_data(file_name, show_fig):
 
     plt.legend(loc=2)
 
+    samples = metrics.Samples(results)
+    if len(samples.read_seconds):
+        plot_read_latency(samples)
+
+    maintenance = [r for r in results.l if isinstance(r, result.FleetMaintenance)]
+    if maintenance:
+        plot_fleet_maintenance(maintenance, initial_timestamp)
+
     plt.savefig(file_name + ".png", dpi=250)
 
     if show_fig:
@@ -94,6 +125,122 @@ def plot_file_data(file_name, show_fig):
 
     plt.close()
 
+    recoveries = [r for r in results.l if isinstance(r, result.Recovery)]
+    if recoveries:
+        plot_recovery(file_name, results.title, recoveries, show_fig)
+
+
+# How long each recovery took, and its parts, against the size of the WAL left
+# behind by the crash
+def plot_recovery(file_name, title, recoveries, show_fig):
+    recoveries = sorted(recoveries, key=lambda r: r.wal)
+    x = [to_mb(r.wal) for r in recoveries]
+
+    plt.figure(figsize=(18 * cm, 15 * cm / 1.414))
+    for (part, colour) in (
+        ("connect", "blue"),
+        ("first_query", "orange"),
+        ("checkpoint", "green"),
+    ):
+        y = [getattr(r, part) for r in recoveries]
+        plt.plot(x, y, label=part.replace("_", " "), color=colour, marker="o")
+    y = [r.seconds() for r in recoveries]
+    plt.plot(x, y, label="total", color="black", marker="o", linewidth=2)
+
+    plt.xlabel("WAL at crash (MB)")
+    plt.ylabel("Seconds (s)")
+    plt.gca().grid(alpha=0.4)
+    plt.title(f"{title} - recovery")
+    plt.legend(loc=2)
+
+    plt.savefig(file_name + "_recovery.png", dpi=250)
+
+    if show_fig:
+        plt.show()
+
+    plt.close()
+
+
+# Every read on a second axis, with the p99 latency of the reads during each
+# maintenance step drawn across the step
+def plot_read_latency(samples):
+    axes = plt.gca().twinx()
+    axes.scatter(
+        samples.read_t,
+        samples.read_seconds * 1000,
+        s=1,
+        color="grey",
+        alpha=0.3,
+        label="read",
+    )
+    for (msg, begin, end, p99) in metrics.read_windows(samples):
+        if p99 is None:
+            continue
+        axes.hlines(p99 * 1000, begin, end, color="purple", linewidth=3)
+        axes.text(
+            x=begin,
+            y=p99 * 1000,
+            s=f"p99 {p99 * 1000:.1f} ms",
+            color="purple",
+            fontsize="x-small",
+            verticalalignment="bottom",
+        )
+    axes.set_ylabel("Read latency (ms)")
+    axes.legend(loc=1)
+
+
+# How many of a fleet's maintenance jobs were running and waiting over time
+def plot_fleet_maintenance(maintenance, initial_timestamp):
+    axes = plt.gca().twinx()
+    x = [(r.timestamp - initial_timestamp).total_seconds() for r in maintenance]
+    axes.step(x, [r.running for r in maintenance], label="running", color="purple")
+    axes.step(x, [r.queued for r in maintenance], label="queued", color="grey")
+    axes.set_ylabel("Maintenance jobs")
+    axes.legend(loc=1)
+
+
+# The median of repeated trials of a scenario, with the 10th to 90th percentile
+# shaded. Each trial is resampled onto a common timeline first.
+def plot_trials(group, file_names, show_fig):
+
+    runs = [metrics.Samples(result.load(f)) for f in file_names]
+    x = np.linspace(0, np.median([r.t[-1] for r in runs]), 1000)
+
+    plt.figure(figsize=(18 * cm, 15 * cm / 1.414))
+
+    for (series, colour) in (("db", "blue"), ("wal", "orange"), ("tmp", "green")):
+        y = np.array([np.interp(x, r.t, to_mb(getattr(r, series))) for r in runs])
+        (low, median, high) = np.percentile(y, [10, 50, 90], axis=0)
+        plt.plot(x, median, label=series, color=colour, linewidth=2)
+        plt.fill_between(x, low, high, color=colour, alpha=0.2)
+
+    plt.xlabel("Seconds (s)")
+    plt.ylabel("Megabyte (MB)")
+    plt.gca().grid(axis="y", alpha=0.4)
+    plt.title(f"{result.load(file_names[0]).title} - {len(runs)} trials")
+    plt.legend(loc=2)
+
+    directory = os.path.dirname(file_names[0])
+    plt.savefig(f"{directory}/results_scenario_{group}_trials.png", dpi=250)
+
+    if show_fig:
+        plt.show()
+
+    plt.close()
+
+
+def plot_all_trials_in_dir(directory, show_plot):
+    print("Plotting trials...")
+    groups = dict()
+    for f in glob.glob(directory + "/*.pickled"):
+        group = metrics.trial_group(metrics.scenario_key(f))
+        if group is not None:
+            groups.setdefault(group, list()).append(f)
+    for (group, file_names) in groups.items():
+        print(f"Plotting {len(file_names)} trials of {group}...")
+        plot_trials(group, file_names, show_plot)
+    print("... done")
+
 
 def plot_single_file(file_name, show_plot):
     plot_file_data(file_name, show_plot)
@@ -108,24 +255,33 @@ def plot_all_files_in_dir(directory):
     print("... done")
 
 
-parser = argparse.ArgumentParser(prog="SQLiteWALPlotter")
-parser.add_argument(
-    "result",
-    default=False,
-    type=str,
-    help="Result folder to plot all results, or a single pickled result file",
-)
-parser.add_argument(
-    "--show_plot",
-    action="store_true",
-    help="Show the plot. Only valid when when single file provided as result.",
-)
-args = parser.parse_args()
-
-if os.path.isdir(args.result):
-    plot_all_files_in_dir(args.result)
-
-elif os.path.isfile(args.result):
-    plot_single_file(args.result, args.show_plot)
-else:
-    print(f"Not valid results: {args.results}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="SQLiteWALPlotter")
+    parser.add_argument(
+        "result",
+        default=False,
+        type=str,
+        help="Result folder to plot all results, or a single pickled result file",
+    )
+    parser.add_argument(
+        "--show_plot",
+        action="store_true",
+        help="Show the plot. Only valid when when single file provided as result.",
+    )
+    parser.add_argument(
+        "--trials",
+        action="store_true",
+        help="Plot the median and spread of repeated trials in the result folder",
+    )
+    args = parser.parse_args()
+
+    if os.path.isdir(args.result) and args.trials:
+        plot_all_trials_in_dir(args.result, args.show_plot)
+
+    elif os.path.isdir(args.result):
+        plot_all_files_in_dir(args.result)
+
+    elif os.path.isfile(args.result):
+        plot_single_file(args.result, args.show_plot)
+    else:
+        print(f"Not valid results: {args.results}")
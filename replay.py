@@ -0,0 +1,167 @@
+import queue
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import capture
+import config
+
+
+# Replays the calls of one of the captured connections, in order, each no
+# earlier than its time in the capture divided by the speed
+class Replayer(threading.Thread):
+    def __init__(self, connect, start, speed, connection_id):
+        super().__init__(name=f"replayer {connection_id}", daemon=True)
+        self.connect = connect
+        self.start_time = start
+        self.speed = speed
+        self.calls = queue.Queue(maxsize=1000)
+        self.counts = {"statements": 0, "commits": 0, "errors": 0}
+        self.lag = list()
+        self.error = None
+        self.stopping = threading.Event()
+
+    def _wait(self, record):
+        if self.speed <= 0:
+            return
+        due = self.start_time + record["t"] / 10 ** 6 / self.speed
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.lag.append(-delay)
+
+    def _call(self, connection, record):
+        if "k" in record:
+            # Closing a connection with a transaction open rolls it back
+            if record["k"] == "commit":
+                connection.commit()
+                self.counts["commits"] += 1
+            else:
+                connection.rollback()
+            return
+        self.counts["statements"] += 1
+        if "x" in record:
+            connection.executescript(record["q"])
+        elif "m" in record:
+            connection.executemany(
+                record["q"], [capture.decode_parameters(p) for p in record["m"]]
+            )
+        else:
+            cursor = connection.execute(
+                record["q"], capture.decode_parameters(record["p"])
+            )
+            cursor.fetchall()
+
+    def run(self):
+        connection = self.connect()
+        try:
+            for record in iter(self.calls.get, None):
+                if self.stopping.is_set():
+                    continue
+                self._wait(record)
+                try:
+                    self._call(connection, record)
+                except sqlite3.Error:
+                    # Calls which failed when captured are expected to fail
+                    # again
+                    self.counts["errors"] += 1
+        except Exception as e:
+            self.error = e
+            # Keep draining, so the reader is never left blocked
+            for _ in iter(self.calls.get, None):
+                pass
+        finally:
+            connection.close()
+
+
+# Blocks until done() is true, calling check_disk_space every
+# config.DISK_CHECK_INTERVAL seconds meanwhile
+def _checking_disk_space(done, check_disk_space):
+    while not done(config.DISK_CHECK_INTERVAL):
+        check_disk_space()
+
+
+def _put(calls, record):
+    def done(timeout):
+        try:
+            calls.put(record, timeout=timeout)
+        except queue.Full:
+            return False
+        return True
+
+    return done
+
+
+def _join(replayer):
+    def done(timeout):
+        replayer.join(timeout)
+        return not replayer.is_alive()
+
+    return done
+
+
+# How many connections made the calls in a capture
+def captured_connections(log_file):
+    return max((record["c"] + 1 for record in capture.read(log_file)), default=0)
+
+
+# Replays a capture against the database at speed times the captured rate, or
+# as fast as possible if the speed isn't positive. Each captured connection is
+# replayed on a connection and thread of its own, as sharing one would have one
+# connection's commit or rollback end another's transaction. A capture from
+# more than max_connections connections isn't replayed, None for no limit.
+# connect opens a connection to the database, and check_disk_space is called
+# every config.DISK_CHECK_INTERVAL seconds.
+def run(connect, log_file, speed, max_connections, check_disk_space):
+    connections = captured_connections(log_file)
+    if max_connections is not None and connections > max_connections:
+        raise ValueError(
+            f"{log_file} was captured from {connections} connections, "
+            f"more than the {max_connections} allowed"
+        )
+    start = time.monotonic()
+    replayers = [Replayer(connect, start, speed, c) for c in range(connections)]
+    for replayer in replayers:
+        replayer.start()
+
+    calls = 0
+    last_check = start
+    last_report = start
+    try:
+        for record in capture.read(log_file):
+            replayer = replayers[record["c"]]
+            _checking_disk_space(_put(replayer.calls, record), check_disk_space)
+            calls += 1
+
+            now = time.monotonic()
+            if now - last_check >= config.DISK_CHECK_INTERVAL:
+                check_disk_space()
+                last_check = now
+            if now - last_report >= config.PROGRESS_INTERVAL:
+                print(f"Replay: {calls} calls queued after {now - start:.1f}s")
+                last_report = now
+        for replayer in replayers:
+            replayer.calls.put(None)
+        for replayer in replayers:
+            _checking_disk_space(_join(replayer), check_disk_space)
+    except BaseException:
+        for replayer in replayers:
+            replayer.stopping.set()
+            replayer.calls.put(None)
+        raise
+
+    for replayer in replayers:
+        if replayer.error is not None:
+            raise replayer.error
+
+    counts = {
+        name: sum(r.counts[name] for r in replayers)
+        for name in ("statements", "commits", "errors")
+    }
+    lag = [seconds for r in replayers for seconds in r.lag]
+    counts["p99 lag (s)"] = float(np.percentile(lag, 99)) if lag else 0.0
+    counts["connections"] = connections
+    return counts
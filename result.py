@@ -1,4 +1,10 @@
 import datetime
+import pickle
+
+
+def load(file_name):
+    with open(file_name, "rb") as pickled_file:
+        return pickle.load(pickled_file)
 
 
 class ResultList:
@@ -13,7 +19,7 @@ class ResultList:
             self.l.append(result)
 
     def _csv_header(self):
-        return "timestamp, db size, shm size, wal size, tmp dir size, note\n"
+        return "timestamp, db size, shm size, wal size, tmp dir size, rss, note\n"
 
     def _sort(self):
         self.l.sort(key=lambda res: res.timestamp)
@@ -37,22 +43,167 @@ class Action:
         return f"ts:{self.timestamp} msg:{self.msg}"
 
     def csv(self):
-        return f"{self.timestamp},,,,,{self.msg}\n"
+        return f"{self.timestamp},,,,,,{self.msg}\n"
+
+
+class Duration:
+    def __init__(self, msg, start):
+        self.timestamp = start
+        self.end = datetime.datetime.now()
+        self.msg = msg
+
+    def seconds(self):
+        return (self.end - self.timestamp).total_seconds()
+
+    def __str__(self):
+        return f"ts:{self.timestamp} end:{self.end} msg:{self.msg}"
+
+    def csv(self):
+        return f"{self.timestamp},,,,,,{self.msg} took {self.seconds():.3f}s\n"
 
 
 class FileSize:
-    def __init__(self, db_size, shm_size, wal_size, tmp_dir_size):
+    # Results pickled before RSS was sampled won't have it set
+    rss = 0
+
+    def __init__(self, db_size, shm_size, wal_size, tmp_dir_size, rss=0):
         self.db = db_size
         self.shm = shm_size
         self.wal = wal_size
         self.tmp_dir = tmp_dir_size
+        self.rss = rss
+        self.timestamp = datetime.datetime.now()
+
+    def __str__(self):
+        return f"ts:{self.timestamp} db:{self.db} shm:{self.shm} wal:{self.wal} tmp:{self.tmp_dir} rss:{self.rss}"
+
+    def total_disk(self):
+        return self.db + self.shm + self.wal + self.tmp_dir
+
+    def csv(self):
+        return f"{self.timestamp}, {self.db}, {self.shm}, {self.wal}, {self.tmp_dir}, {self.rss},\n"
+
+
+# The work done after an action, from the end of the pause following it to the
+# start of the pause ahead of the next action
+class Step:
+    def __init__(self, msg, start):
+        self.timestamp = start
+        self.end = datetime.datetime.now()
+        self.msg = msg
+
+    def __str__(self):
+        return f"ts:{self.timestamp} end:{self.end} msg:{self.msg}"
+
+
+# A query from the read probe. There are too many to be worth a line each in
+# the csv.
+class Read:
+    def __init__(self, kind, start, seconds):
+        self.kind = kind
+        self.timestamp = start
+        self.seconds = seconds
+
+    def __str__(self):
+        return f"ts:{self.timestamp} kind:{self.kind} seconds:{self.seconds}"
+
+
+# A sample from inside a long statement, with the file sizes at the time
+class StatementProgress:
+    def __init__(self, what, statement, event, steps, elapsed, sizes):
+        self.timestamp = sizes.timestamp
+        self.what = what
+        self.statement = statement
+        self.event = event
+        self.steps = steps
+        self.elapsed = elapsed
+        self.sizes = sizes
+
+    def __str__(self):
+        return f"ts:{self.timestamp} what:{self.what} event:{self.event} steps:{self.steps} elapsed:{self.elapsed}"
+
+    def csv(self):
+        s = self.sizes
+        return (
+            f"{self.timestamp}, {s.db}, {s.shm}, {s.wal}, {s.tmp_dir}, {s.rss}, "
+            f"{self.what} {self.event} {self.steps} steps {self.elapsed:.3f}s "
+            f"in {self.statement}\n"
+        )
+
+
+# Page usage of the database. Fragmentation is the fraction of the table's pages
+# out of order, None when it wasn't measured.
+class Pages:
+    def __init__(self, used, free, fragmentation=None):
+        self.used = used
+        self.free = free
+        self.fragmentation = fragmentation
+        self.timestamp = datetime.datetime.now()
+
+    def __str__(self):
+        return f"ts:{self.timestamp} used:{self.used} free:{self.free} fragmentation:{self.fragmentation}"
+
+    def csv(self):
+        note = f"Pages Used:{self.used} Free:{self.free}"
+        if self.fragmentation is not None:
+            note += f" Fragmented:{self.fragmentation:.3f}"
+        return f"{self.timestamp},,,,,,{note}\n"
+
+
+# Reopening the database after the writer was killed
+class Recovery:
+    def __init__(self, start, wal, connect, first_query, checkpoint, quick_check):
+        self.timestamp = start
+        self.wal = wal
+        self.connect = connect
+        self.first_query = first_query
+        self.checkpoint = checkpoint
+        self.quick_check = quick_check
+
+    def seconds(self):
+        return self.connect + self.first_query + self.checkpoint
+
+    def __str__(self):
+        return f"ts:{self.timestamp} wal:{self.wal} seconds:{self.seconds()} quick_check:{self.quick_check}"
+
+    def csv(self):
+        return (
+            f"{self.timestamp},,,,,,Recovered {self.wal} byte wal in "
+            f"{self.seconds():.3f}s (connect {self.connect:.3f}s "
+            f"first query {self.first_query:.3f}s "
+            f"checkpoint {self.checkpoint:.3f}s)\n"
+        )
+
+
+# The sizes summed over every database of a fleet, how many there are and the
+# largest footprint of any one of them
+class FleetSize(FileSize):
+    def __init__(
+        self, db_size, shm_size, wal_size, tmp_dir_size, rss, databases, largest
+    ):
+        super().__init__(db_size, shm_size, wal_size, tmp_dir_size, rss)
+        self.databases = databases
+        self.largest = largest
+
+    def csv(self):
+        return (
+            f"{self.timestamp}, {self.db}, {self.shm}, {self.wal}, {self.tmp_dir}, "
+            f"{self.rss}, {self.databases} databases largest {self.largest}\n"
+        )
+
+
+# Fleet maintenance jobs waiting for a slot, and running
+class FleetMaintenance:
+    def __init__(self, queued, running):
         self.timestamp = datetime.datetime.now()
+        self.queued = queued
+        self.running = running
 
     def __str__(self):
-        return f"ts:{self.timestamp} db:{self.db} shm:{self.shm} wal:{self.wal} tmp:{self.tmp_dir}"
+        return f"ts:{self.timestamp} queued:{self.queued} running:{self.running}"
 
     def csv(self):
-        return f"{self.timestamp}, {self.db}, {self.shm}, {self.wal}, {self.tmp_dir},\n"
+        return f"{self.timestamp},,,,,,Maintenance queued:{self.queued} running:{self.running}\n"
 
 
 class Title:
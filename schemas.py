@@ -0,0 +1,85 @@
+import config
+
+# Shapes of the Data table the scenarios write to. Every profile takes the same
+# INSERT, UPDATE and DELETE statements on Data (PrimaryKey, Stuff), so any
+# scenario can be run against any profile.
+
+
+class Profile:
+    def __init__(self, description, statements, blob=False):
+        self.description = description
+        self.statements = statements
+        self.blob = blob
+
+
+def _data_table(stuff_type="TEXT", suffix=""):
+    return f"""
+    CREATE TABLE Data (
+        PrimaryKey INTEGER PRIMARY KEY,
+        Stuff {stuff_type}){suffix};
+    """
+
+
+# Rows are spread over several tables by key, behind a Data view whose triggers
+# send each statement to the right table
+def _split_tables(count):
+    tables = [f"Data{i}" for i in range(count)]
+    statements = [
+        f"CREATE TABLE {t} (PrimaryKey INTEGER PRIMARY KEY, Stuff TEXT);"
+        for t in tables
+    ]
+    statements.append(
+        "CREATE VIEW Data AS "
+        + " UNION ALL ".join(f"SELECT PrimaryKey, Stuff FROM {t}" for t in tables)
+        + ";"
+    )
+    inserts = "".join(
+        f"INSERT INTO {t} SELECT NEW.PrimaryKey, NEW.Stuff "
+        f"WHERE NEW.PrimaryKey % {count} = {i}; "
+        for (i, t) in enumerate(tables)
+    )
+    updates = "".join(
+        f"UPDATE {t} SET Stuff = NEW.Stuff WHERE PrimaryKey = OLD.PrimaryKey; "
+        for t in tables
+    )
+    deletes = "".join(
+        f"DELETE FROM {t} WHERE PrimaryKey = OLD.PrimaryKey; " for t in tables
+    )
+    statements += [
+        f"CREATE TRIGGER DataInsert INSTEAD OF INSERT ON Data BEGIN {inserts}END;",
+        f"CREATE TRIGGER DataUpdate INSTEAD OF UPDATE ON Data BEGIN {updates}END;",
+        f"CREATE TRIGGER DataDelete INSTEAD OF DELETE ON Data BEGIN {deletes}END;",
+    ]
+    return statements
+
+
+profiles = {
+    "rowid": Profile("rowid table, TEXT payload", [_data_table()]),
+    "blob": Profile("rowid table, BLOB payload", [_data_table("BLOB")], blob=True),
+    "indexed": Profile(
+        "rowid table, TEXT payload, indexes on the payload's length and prefix",
+        [
+            _data_table(),
+            "CREATE INDEX DataLength ON Data (length(Stuff));",
+            "CREATE INDEX DataPrefix ON Data (substr(Stuff, 1, 32));",
+        ],
+    ),
+    "without_rowid": Profile(
+        "WITHOUT ROWID table, TEXT payload",
+        [_data_table(suffix=" WITHOUT ROWID")],
+    ),
+    "multi_table": Profile("3 rowid tables, TEXT payload", _split_tables(3)),
+}
+
+
+def create(cursor, name):
+    for statement in profiles[name].statements:
+        cursor.execute(statement)
+
+
+# A payload of the type the profile in use stores
+def payload(size, fill="x"):
+    stuff = fill * size
+    if profiles[config.SCHEMA].blob:
+        return stuff.encode()
+    return stuff
@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import datetime
+import glob
+import itertools
+import math
+import os
+import pickle
+import time
+
+import numpy as np
+
+import config
+import metrics
+import result
+import sqlite_scenarios
+
+page_size = sqlite_scenarios.page_size
+frame_size = page_size + 24
+wal_header = 32
+# Pages SQLite's default wal_autocheckpoint lets the WAL reach
+autocheckpoint_pages = 1000
+# Each 32 KB block of the -shm WAL index covers this many frames
+shm_block_frames = 4096
+shm_block = 32768
+# Bytes of the record around each row's payload
+record_overhead = 5
+# Pages written by a commit besides those of the rows: page 1, and the leaf
+# and interior page above the rows
+commit_overhead = 3
+# Pages of SQLite's default 2000 KiB page cache. A vacuum dirties each free
+# page it drops from the end of the file, and those which don't fit in the
+# cache are spilled to the WAL. Each page moved down from the end is written
+# too. Both were fitted to results/20210314_175150, 100 rows of 1 MB with SQLite
+# 3.31.
+cache_pages = 428
+vacuum_overhead = 2
+
+
+class NotSimulated(Exception):
+    pass
+
+
+# The bytes of a row's payload kept on its b-tree leaf, and the overflow pages
+# holding the rest, as SQLite splits them
+def split_payload(payload, usable=page_size):
+    max_local = usable - 35
+    min_local = (usable - 12) * 32 // 255 - 23
+    if payload <= max_local:
+        return (payload, 0)
+    local = min_local + (payload - min_local) % (usable - 4)
+    if local > max_local:
+        local = min_local
+    return (local, math.ceil((payload - local) / (usable - 4)))
+
+
+# Pages of a table of rows rows, without the pointer map: page 1, the b-tree
+# and the overflow pages
+def content_pages(rows, row_size, usable=page_size):
+    (local, overflow) = split_payload(row_size + record_overhead, usable)
+    # The cell, its overflow pointer, size and rowid varints and cell pointer
+    cell = local + (4 if overflow else 0) + 8
+    per_leaf = max(1, (usable - 8) // cell)
+    leaves = math.ceil(rows / per_leaf)
+    interior = math.ceil(leaves / ((usable - 12) // 8)) if leaves > 1 else 0
+    return 1 + max(1, leaves + interior) + rows * overflow
+
+
+# Pointer map pages among the first page_count pages
+def ptrmap_pages(page_count, usable=page_size):
+    return math.ceil((page_count - 1) / (usable // 5 + 1))
+
+
+# The pages of a database whose content is content pages, once pointer map
+# pages are added among them
+def with_ptrmap(content):
+    total = content
+    while content + ptrmap_pages(total) != total:
+        total = content + ptrmap_pages(total)
+    return total
+
+
+def database_pages(rows, row_size):
+    return with_ptrmap(content_pages(rows, row_size))
+
+
+# Follows the db, WAL, shm and temp sizes of a scenario through page
+# arithmetic, in place of sqlite_scenarios' steps. Every change of size is
+# recorded as a sample, with the same actions the real steps log, giving a
+# ResultList metrics and the plotter can read.
+class Model:
+    def __init__(self, row_size):
+        self.row_size = row_size
+        self.results = result.ResultList()
+        self.clock = datetime.datetime(2000, 1, 1)
+        self.rows = 0
+        # One more than the highest rowid left, and the free pages after the
+        # last of the rows, which a vacuum can drop without moving anything
+        self.top = 0
+        self.tail_free = 0
+        self.autocheckpoint = autocheckpoint_pages
+        self.tmp = 0
+        # A new database in WAL mode: page 1, a pointer map page and the table
+        # root, with only page 1 checkpointed
+        self.page_count = 3
+        self.db = page_size
+        self.frames = 0
+        self.wal = 0
+        self.backfilled = True
+        self.shm = shm_block
+        self._commit(3)
+
+    # Also the monitor pipe of the scenario's handles
+    def send(self, r):
+        self._add(r)
+
+    def _add(self, r):
+        self.clock += datetime.timedelta(milliseconds=1)
+        r.timestamp = self.clock
+        self.results.add(r)
+
+    def _sample(self):
+        self._add(result.FileSize(self.db, self.shm, self.wal, self.tmp))
+
+    def latest(self):
+        return {"db": self.db, "shm": self.shm, "wal": self.wal, "tmp_dir": self.tmp}
+
+    def used(self):
+        return content_pages(self.rows, self.row_size) + ptrmap_pages(self.page_count)
+
+    def _action(self, msg):
+        self._add(result.Action(msg))
+
+    # A commit appends its pages to the WAL, starting again from the beginning
+    # of the file once everything in it has been checkpointed
+    def _commit(self, frames):
+        if self.backfilled:
+            self.frames = 0
+        self.frames += int(frames)
+        self.backfilled = False
+        self.wal = max(self.wal, wal_header + self.frames * frame_size)
+        blocks = math.ceil((self.frames + 34) / shm_block_frames)
+        self.shm = max(self.shm, blocks * shm_block)
+        self._sample()
+        if self.autocheckpoint and self.frames >= self.autocheckpoint:
+            self._checkpoint()
+
+    # Checkpoints copy the WAL back, growing or truncating the db file to the
+    # database's size
+    def _checkpoint(self, truncate=False):
+        self.db = self.page_count * page_size
+        self.backfilled = True
+        if truncate:
+            self.wal = 0
+            self.frames = 0
+        self._sample()
+
+    # Pages are taken from the freelist before growing the file. Returns the
+    # pages written, along with the pointer map pages recording them.
+    def _insert(self, rows):
+        content = content_pages(self.rows + rows, self.row_size)
+        needed = content - content_pages(self.rows, self.row_size)
+        self.rows += rows
+        self.top += rows
+        interior_free = self.page_count - self.used() - self.tail_free
+        self.tail_free = max(0, self.tail_free - max(0, needed - interior_free))
+        self.page_count = max(self.page_count, with_ptrmap(content))
+        return needed + math.ceil(needed / (page_size // 5))
+
+    def write_data(self, td, small_write_transactions, num_rows):
+        self._action(f"Writing {num_rows} rows")
+        if small_write_transactions:
+            for _ in range(num_rows):
+                self._commit(self._insert(1) + commit_overhead)
+        else:
+            self._insert(num_rows)
+            self._commit(self.page_count)
+
+    def delete_data(self, td, small_delete_transactions, start_row, end_row):
+        self._action(f"Deleting rows {start_row} to {end_row - 1}")
+        at_end = end_row >= self.top
+        if small_delete_transactions:
+            for _ in range(start_row, end_row):
+                before = self.used()
+                self.rows -= 1
+                freed = before - self.used()
+                if at_end:
+                    self.tail_free += freed
+                spanned = math.ceil(freed / (page_size // 5))
+                self._commit(freed + spanned + commit_overhead)
+        else:
+            self.rows = 0
+            self.tail_free = self.page_count - self.used()
+            self._commit(self.page_count)
+        if at_end:
+            self.top = start_row
+
+    def checkpoint_truncate(self, td):
+        self._action("Checkpoint (truncate)")
+        self._checkpoint(truncate=True)
+
+    def checkpoint_passive(self, td):
+        self._action("Checkpoint (passive)")
+        self._checkpoint()
+
+    def checkpoint_passive_and_log_pages(self, td):
+        self.checkpoint_passive(td)
+        self._action(f"WAL to DB: {self.frames}")
+
+    def get_pages_usage(self, td):
+        used = self.used()
+        free = self.page_count - used
+        self._action(f"Pages Used:{used} Free:{free}")
+        return (used, free)
+
+    def set_auto_checkpoint(self, td, pages):
+        self._action(f"wal_autocheckpoint({pages})")
+        self.autocheckpoint = pages
+
+    # The copy is built in a temporary file, then written back through the WAL
+    def vacuum(self, td):
+        self._action("vacuum")
+        pages = database_pages(self.rows, self.row_size)
+        self.tmp = pages * page_size
+        self._sample()
+        self.page_count = pages
+        self.tail_free = 0
+        self._commit(pages)
+        self.tmp = 0
+        self._sample()
+
+    # Pointer map pages past the new end of the file go too, on top of the
+    # free pages asked for. Free pages before the last of the rows are filled
+    # by moving pages down from the end.
+    def incremental_vacuum(self, td, pages):
+        self._action(f"incremental_vacuum({pages})")
+        free = self.page_count - self.used()
+        freed = free if pages <= 0 else min(pages, free)
+        dropped = min(freed, self.tail_free)
+        self.tail_free -= dropped
+        others = self.page_count - ptrmap_pages(self.page_count) - freed
+        self.page_count = with_ptrmap(others)
+        spilled = max(0, dropped - cache_pages)
+        self._commit(freed - dropped + spilled + vacuum_overhead)
+
+    def wait_until(self, td, description, condition, timeout=60):
+        self._action(f"Waiting until {description}")
+        return condition(self.latest())
+
+    def incremental_vacuum_until(self, td, pages, description, condition):
+        while True:
+            (_, freelist_count) = self.get_pages_usage(td)
+            if freelist_count == 0:
+                return False
+            self.incremental_vacuum(td, pages)
+            if condition(self.latest()):
+                self._action(f"Stopped vacuuming, {description}")
+                return True
+
+    # Closing the connection checkpoints and removes the WAL and shm, and the
+    # copy reopened in WAL mode starts a new shm
+    def _swap_in(self, pages):
+        self.page_count = pages
+        self.tail_free = 0
+        self.db = self.tmp
+        self.tmp = 0
+        self.wal = 0
+        self.frames = 0
+        self.backfilled = True
+        self.shm = shm_block
+        self._sample()
+
+    def vacuum_into(self, td, target_dir=None):
+        self._action("vacuum into")
+        pages = database_pages(self.rows, self.row_size)
+        self.tmp = pages * page_size
+        self._sample()
+        self._action("Swap in compacted db")
+        self._swap_in(pages)
+
+    # The backup copies every page, free ones included, then the copy is
+    # incrementally vacuumed in place
+    def backup_compact(
+        self, td, pages_per_step, step_delay, target_dir=None, writer=None
+    ):
+        self._action(f"backup (pages={pages_per_step} delay={step_delay}s)")
+        self.tmp = self.page_count * page_size
+        self._sample()
+        pages = self.page_count - (self.page_count - self.used())
+        self.tmp = pages * page_size
+        self._sample()
+        self._swap_in(pages)
+
+    # The writer's small rows make no difference to the sizes worth simulating
+    def start_concurrent_writer(self, td):
+        self._action("Starting concurrent writer")
+        return None
+
+    def stop_concurrent_writer(self, td, writer):
+        self._action("Stopped concurrent writer")
+
+    def not_simulated(self, *args):
+        raise NotSimulated()
+
+    def close(self):
+        self._action("Closing connection")
+        self.db = self.page_count * page_size
+        self.wal = 0
+        self.shm = 0
+        self._sample()
+
+
+def scenarios():
+    return {
+        int(name.split("_")[1]): function
+        for (name, function) in vars(sqlite_scenarios).items()
+        if name.startswith("scenario_")
+    }
+
+
+# Swaps sqlite_scenarios' steps for the model's while the scenario runs
+@contextlib.contextmanager
+def _simulating(model):
+    steps = {
+        "_write_data": model.write_data,
+        "_delete_data": model.delete_data,
+        "_checkpoint_truncate": model.checkpoint_truncate,
+        "_checkpoint_passive": model.checkpoint_passive,
+        "_checkpoint_passive_and_log_pages": model.checkpoint_passive_and_log_pages,
+        "_get_pages_usage": model.get_pages_usage,
+        "_set_auto_checkpoint": model.set_auto_checkpoint,
+        "_vacuum": model.vacuum,
+        "_incremental_vacuum": model.incremental_vacuum,
+        "_wait_until": model.wait_until,
+        "_incremental_vacuum_until": model.incremental_vacuum_until,
+        "_vacuum_into": model.vacuum_into,
+        "_backup_compact": model.backup_compact,
+        "_start_concurrent_writer": model.start_concurrent_writer,
+        "_stop_concurrent_writer": model.stop_concurrent_writer,
+        "_log_page_usage": model.not_simulated,
+        "_run_workload": model.not_simulated,
+        "_replay_capture": model.not_simulated,
+        "_group_commit_write": model.not_simulated,
+        "_crash_writer": model.not_simulated,
+    }
+    originals = {name: getattr(sqlite_scenarios, name) for name in steps}
+    for (name, step) in steps.items():
+        setattr(sqlite_scenarios, name, step)
+    try:
+        yield
+    finally:
+        for (name, step) in originals.items():
+            setattr(sqlite_scenarios, name, step)
+
+
+class SimulatedHandles:
+    def __init__(self, model):
+        self.monitor_pipe = model
+        self.live = model
+        self.step = None
+
+
+# The results a scenario would give, or None if it has steps which can't be
+# simulated
+def simulate(scenario, num_rows, row_size):
+    rows = config.NUM_ROWS_IN_DB
+    config.NUM_ROWS_IN_DB = num_rows
+    model = Model(row_size)
+    try:
+        with _simulating(model):
+            scenarios()[scenario](SimulatedHandles(model))
+    except NotSimulated:
+        return None
+    finally:
+        config.NUM_ROWS_IN_DB = rows
+    model.close()
+    return model.results
+
+
+compared_kpis = ("peak wal (B)", "peak db+shm+wal+tmp (B)", "final db (B)")
+
+
+def _error(real, simulated):
+    if real == 0:
+        return 0.0 if simulated == 0 else math.inf
+    return (simulated - real) / real * 100
+
+
+# The rows and row size of a run, from its versions.txt
+def _run_parameters(directory):
+    parameters = {"num_rows": config.NUM_ROWS_IN_DB, "row_size": config.ROW_SIZE}
+    try:
+        with open(directory + "/versions.txt") as version_file:
+            for line in version_file:
+                (key, _, value) = line.strip().partition(": ")
+                if key in parameters:
+                    parameters[key] = int(value)
+    except FileNotFoundError:
+        pass
+    return (parameters["num_rows"], parameters["row_size"])
+
+
+# Simulates every scenario of a results folder and compares it with what was
+# measured: the peaks and final size in percent, and the db and WAL size after
+# each action in bytes, where the simulation took the same actions. Returns the
+# percentages.
+def validate(directory):
+    (num_rows, row_size) = _run_parameters(directory)
+    print(f"Validating against {directory}, {num_rows} rows of {row_size} B")
+    errors = list()
+    for path in sorted(glob.glob(directory + "/results_scenario_*.pickled")):
+        key = metrics.scenario_key(path)
+        scenario = int(key.partition("_")[0])
+        simulated = simulate(scenario, num_rows, row_size)
+        if simulated is None:
+            print(f"    {key:<8} not simulated")
+            continue
+        real = metrics.summarise(result.load(path))
+        model = metrics.summarise(simulated)
+
+        line = list()
+        for name in compared_kpis:
+            error = _error(real["kpis"][name], model["kpis"][name])
+            errors.append(abs(error))
+            line.append(f"{name} {error:+.1f}%")
+        if len(real["actions"]) == len(model["actions"]):
+            step_errors = [
+                abs(m[column] - r[column])
+                for (r, m) in zip(real["actions"], model["actions"])
+                for column in ("db after (B)", "wal after (B)")
+            ]
+            line.append(f"worst step {max(step_errors) / 10 ** 6:.1f} MB off")
+        else:
+            line.append("steps differ")
+        print(f"    {key:<8} " + ", ".join(line))
+    if errors:
+        print(
+            f"Median error {np.median(errors):.1f}%, "
+            f"worst {np.max(errors):.1f}% over {len(errors)} comparisons"
+        )
+    return errors
+
+
+# Every combination of scenario, rows and row size, one line each
+def sweep(scenario_ids, rows, row_sizes, output):
+    print(
+        f"    {'scenario':>8} {'rows':>8} {'row size':>10}"
+        + "".join(f"{name:>26}" for name in compared_kpis)
+    )
+    for (scenario, num_rows, row_size) in itertools.product(
+        scenario_ids, rows, row_sizes
+    ):
+        simulated = simulate(scenario, num_rows, row_size)
+        if simulated is None:
+            print(f"    {scenario:>8} not simulated")
+            continue
+        kpis = metrics.summarise(simulated)["kpis"]
+        print(
+            f"    {scenario:>8} {num_rows:>8} {row_size:>10}"
+            + "".join(f"{kpis[name]:>26}" for name in compared_kpis)
+        )
+        if output is not None:
+            name = f"{output}/results_scenario_{scenario}_{num_rows}x{row_size}"
+            with open(name + ".pickled", "wb") as pickle_file:
+                pickle.dump(simulated, pickle_file)
+
+
+parser = argparse.ArgumentParser(prog="SQLiteWALSimulate")
+parser.add_argument(
+    "--scenario",
+    type=int,
+    nargs="+",
+    help="Scenarios to simulate, default all",
+)
+parser.add_argument(
+    "--rows",
+    type=int,
+    nargs="+",
+    default=[config.NUM_ROWS_IN_DB],
+    help="Numbers of rows to simulate",
+)
+parser.add_argument(
+    "--row_size",
+    type=int,
+    nargs="+",
+    default=[config.ROW_SIZE],
+    help="Row sizes to simulate",
+)
+parser.add_argument(
+    "--validate",
+    type=str,
+    help="Results folder to compare the simulation with instead",
+)
+parser.add_argument(
+    "--output",
+    type=str,
+    help="Folder to write each simulation to, to be plotted or summarised",
+)
+args = parser.parse_args()
+
+start = time.perf_counter()
+if args.validate:
+    validate(args.validate)
+else:
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+    sweep(args.scenario or sorted(scenarios()), args.rows, args.row_size, args.output)
+print(f"Simulated in {(time.perf_counter() - start) * 1000:.0f} ms")
@@ -1,12 +1,27 @@
 import sqlite3
 import os
 import time
+import datetime
+import shutil
+import threading
+import concurrent.futures
+import pathlib
+import random
+import multiprocessing
+import signal
+import contextlib
+import inspect
 
 import config
+import group_commit
+import monitor
+import replay
 import result
+import schemas
+import template
+import workload
 
 mb = 10 ** 6
-one_mb_data = "x" * mb
 
 page_size = 4096
 # 2.13 MB. Arbitrarily was targeting 2 MB, but better if we don't overshoot the
@@ -14,15 +29,73 @@ page_size = 4096
 twoish_mb_of_pages = 520
 
 
+class DiskSpaceError(Exception):
+    pass
+
+
 def _manual_prompt(msg):
     if config.MANUAL_PROMPT:
         input("\n" + msg)
 
 
+# The pauses either side of an action keep the samples of one step apart from
+# the next, so each step is also recorded without them
 def _log_action(td, msg):
+    end_step(td)
     time.sleep(3)
     td.monitor_pipe.send(result.Action(msg))
     time.sleep(0.4)
+    td.step = (msg, datetime.datetime.now())
+
+
+def end_step(td):
+    if td.step is not None:
+        (msg, start) = td.step
+        td.monitor_pipe.send(result.Step(msg, start))
+        td.step = None
+
+
+# Scenarios are written in terms of a 100 row database, so scale row numbers
+# with the number of rows actually in use.
+def _percent_of_rows(percent):
+    return config.NUM_ROWS_IN_DB * percent // 100
+
+
+def _report_progress(what, done, total, start):
+    elapsed = time.monotonic() - start
+    rate = done / elapsed if elapsed > 0 else 0
+    print(f"{what}: {done}/{total} rows, {rate:.1f} rows/s")
+
+
+def _free_bytes(directory):
+    stats = os.statvfs(directory)
+    return stats.f_bavail * stats.f_frsize
+
+
+def _low_disk_space(td, needed=0):
+    for directory in (os.path.dirname(td.db_file), td.temp_dir):
+        free = _free_bytes(directory)
+        if free - needed < config.MIN_FREE_BYTES:
+            return (
+                f"{directory} has {free} bytes free, need {needed} "
+                f"and {config.MIN_FREE_BYTES} in reserve"
+            )
+    return None
+
+
+# Call before a step, with a rough idea of how much the step will write
+def _check_disk_space(td, needed=0):
+    reason = _low_disk_space(td, needed)
+    if reason is not None:
+        raise DiskSpaceError(reason)
+
+
+def _db_size(td):
+    return os.stat(td.db_file).st_size
+
+
+def _log_duration(td, msg, start):
+    td.monitor_pipe.send(result.Duration(msg, start))
 
 
 def _get_pages_usage(td):
@@ -36,50 +109,126 @@ def _get_pages_usage(td):
     return (used_count, freelist_count)
 
 
+# Kept on td, so the setting survives the database being reopened
 def _set_auto_checkpoint(td, pages):
     cmd = f"wal_autocheckpoint({pages})"
     _log_action(td, cmd)
+    td.auto_checkpoint = pages
     td.cursor.execute("PRAGMA " + cmd)
 
 
 def _write_data(td, small_write_transactions, num_rows):
     _manual_prompt("Before writing data")
+    _check_disk_space(td, num_rows * config.ROW_SIZE)
     _log_action(td, f"Writing {num_rows} rows")
+    step_start = datetime.datetime.now()
+    row_data = schemas.payload(config.ROW_SIZE)
+    start = time.monotonic()
+    last_report = start
+    last_check = start
     for i in range(num_rows):
         td.cursor.execute(
             "INSERT INTO Data (PrimaryKey, Stuff) VALUES (?, ?);",
             (
                 i,
-                one_mb_data,
+                row_data,
             ),
         )
         if small_write_transactions == True:
             td.connection.commit()
+        if time.monotonic() - last_check >= config.DISK_CHECK_INTERVAL:
+            _check_disk_space(td)
+            last_check = time.monotonic()
+        if time.monotonic() - last_report >= config.PROGRESS_INTERVAL:
+            _report_progress("Writing", i + 1, num_rows, start)
+            last_report = time.monotonic()
     td.connection.commit()
+    _log_duration(td, "write", step_start)
 
 
 def _delete_data(td, small_delete_transactions, start_row, end_row):
     _manual_prompt("Before delete execute")
+    _check_disk_space(td)
     _log_action(td, f"Deleting rows {start_row} to {end_row - 1}")
+    step_start = datetime.datetime.now()
     if small_delete_transactions == True:
+        start = time.monotonic()
+        last_report = start
+        last_check = start
         for i in range(start_row, end_row):
             td.cursor.execute("DELETE FROM Data WHERE PrimaryKey = ?;", (i,))
             td.connection.commit()
+            if time.monotonic() - last_check >= config.DISK_CHECK_INTERVAL:
+                _check_disk_space(td)
+                last_check = time.monotonic()
+            if time.monotonic() - last_report >= config.PROGRESS_INTERVAL:
+                _report_progress(
+                    "Deleting", i + 1 - start_row, end_row - start_row, start
+                )
+                last_report = time.monotonic()
     else:
         td.cursor.execute("DELETE FROM Data;")
         td.connection.commit()
+    _log_duration(td, "delete", step_start)
 
 
 def _checkpoint_truncate(td):
     _manual_prompt("Before checkpoint truncate")
+    _check_disk_space(td)
     _log_action(td, "Checkpoint (truncate)")
+    start = datetime.datetime.now()
     td.cursor.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    _log_duration(td, "checkpoint (truncate)", start)
+
+
+def _template_file(small_write_transactions):
+    key = template.key(
+        config.SCHEMA,
+        config.NUM_ROWS_IN_DB,
+        config.ROW_SIZE,
+        small_write_transactions,
+        page_size,
+        sqlite3.sqlite_version,
+        inspect.getsource(setup_database),
+        inspect.getsource(_write_data),
+        inspect.getsource(schemas),
+    )
+    name = f"{config.SCHEMA}_{config.NUM_ROWS_IN_DB}x{config.ROW_SIZE}_{key}.db"
+    return os.path.join(config.TEMPLATE_DIR, name)
+
+
+# Every row written and the WAL checkpointed, for scenarios measuring what comes
+# after. With config.TEMPLATE_DIR set, each distinct populated database is only
+# written once, then saved as a template and cloned from it after that.
+def _populate(td, small_write_transactions):
+    if config.TEMPLATE_DIR is None:
+        _write_data(td, small_write_transactions, config.NUM_ROWS_IN_DB)
+        _checkpoint_truncate(td)
+        return
+
+    template_file = _template_file(small_write_transactions)
+    if not os.path.exists(template_file):
+        _write_data(td, small_write_transactions, config.NUM_ROWS_IN_DB)
+        _checkpoint_truncate(td)
+        _log_action(td, f"Saving template {os.path.basename(template_file)}")
+        template.save(td.db_file, template_file)
+        return
+
+    _manual_prompt("Before cloning template")
+    _check_disk_space(td, os.stat(template_file).st_size)
+    _log_action(td, f"Cloning template {os.path.basename(template_file)}")
+    start = datetime.datetime.now()
+    method = _restore_snapshot(td, template_file)
+    _log_duration(td, f"clone ({method})", start)
 
 
 def _checkpoint_passive(td):
     _manual_prompt("Before checkpoint passive")
+    _check_disk_space(td)
     _log_action(td, "Checkpoint (passive)")
+    start = datetime.datetime.now()
     td.cursor.execute("PRAGMA wal_checkpoint(PASSIVE);")
+    _log_duration(td, "checkpoint (passive)", start)
 
 
 # Call immediately after a checkpoint
@@ -98,17 +247,297 @@ def _checkpoint_passive_and_log_pages(td):
     _log_wal_checkpoint(td)
 
 
+# Samples a long statement from the inside. SQLite calls progress() every
+# config.STATEMENT_PROGRESS_STEPS virtual machine instructions, and trace() as
+# each statement starts. Samples are sent at most every
+# config.STATEMENT_PROGRESS_INTERVAL seconds. After config.STATEMENT_BUDGET
+# seconds of running the statement is either paused for
+# config.STATEMENT_PAUSE seconds and given another budget, or cancelled.
+class _StatementProgress:
+    def __init__(self, td, what):
+        self.td = td
+        self.what = what
+        self.statement = what
+        self.steps = 0
+        self.start = time.monotonic()
+        self.last_sample = self.start
+        self.running_since = self.start
+        self.cancelled = False
+
+    def trace(self, statement):
+        self.statement = " ".join(statement.split())[:80]
+
+    def progress(self):
+        self.steps += config.STATEMENT_PROGRESS_STEPS
+        now = time.monotonic()
+        budget = config.STATEMENT_BUDGET
+        if budget is not None and now - self.running_since > budget:
+            if config.STATEMENT_OVER_BUDGET == "cancel":
+                self.cancelled = True
+                self._sample(now, "cancelled")
+                return 1
+            self._sample(now, "paused")
+            time.sleep(config.STATEMENT_PAUSE)
+            self.running_since = time.monotonic()
+        elif now - self.last_sample >= config.STATEMENT_PROGRESS_INTERVAL:
+            self._sample(now, "running")
+        return 0
+
+    def _sample(self, now, event):
+        self.last_sample = now
+        sizes = monitor.get_file_sizes(
+            self.td.db_file,
+            self.td.db_file + "-shm",
+            self.td.db_file + "-wal",
+            self.td.temp_dir,
+            os.getpid(),
+        )
+        self.td.monitor_pipe.send(
+            result.StatementProgress(
+                self.what, self.statement, event, self.steps, now - self.start, sizes
+            )
+        )
+
+
+# Instrument the statements run within, if config.STATEMENT_PROGRESS_STEPS is
+# set. A statement cancelled for going over budget is logged rather than
+# raised, and the caller can check whether it was.
+@contextlib.contextmanager
+def _statement_progress(td, what):
+    progress = _StatementProgress(td, what)
+    if config.STATEMENT_PROGRESS_STEPS <= 0:
+        yield progress
+        return
+
+    td.connection.set_progress_handler(
+        progress.progress, config.STATEMENT_PROGRESS_STEPS
+    )
+    td.connection.set_trace_callback(progress.trace)
+    try:
+        yield progress
+    except sqlite3.OperationalError:
+        if progress.cancelled is False:
+            raise
+        # Not _log_action(), whose pauses would count towards the step
+        td.monitor_pipe.send(
+            result.Action(
+                f"Cancelled {what} after {time.monotonic() - progress.start:.1f}s"
+            )
+        )
+    finally:
+        td.connection.set_progress_handler(None, 0)
+        td.connection.set_trace_callback(None)
+
+
 def _vacuum(td):
     _manual_prompt("Before vacuum")
+    # Room for the temporary copy, and the copy written back through the WAL
+    _check_disk_space(td, _db_size(td))
     _log_action(td, "vacuum")
-    td.cursor.execute("vacuum;")
+    start = datetime.datetime.now()
+    with _statement_progress(td, "vacuum"):
+        td.cursor.execute("vacuum;")
+    _log_duration(td, "vacuum", start)
 
 
 def _incremental_vacuum(td, pages):
     _manual_prompt("Before incremental vacuum")
+    _check_disk_space(td)
     _log_action(td, f"incremental_vacuum({pages})")
-    td.cursor.execute(f"PRAGMA incremental_vacuum({pages});")
+    # incremental_vacuum frees a page per step and returns no rows. Newer
+    # Pythons stop stepping a statement with no result columns after the first
+    # step, so execute() and fetchall() only free a single page.
+    start = datetime.datetime.now()
+    with _statement_progress(td, f"incremental_vacuum({pages})"):
+        td.cursor.executescript(f"PRAGMA incremental_vacuum({pages});")
+    _log_duration(td, f"incremental_vacuum({pages})", start)
+
+
+# Wait for the monitor's live samples to meet a condition, such as the WAL
+# having been truncated. Returns False if it doesn't happen in time.
+def _wait_until(td, description, condition, timeout=60):
+    _log_action(td, f"Waiting until {description}")
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        sample = td.live.latest()
+        if sample is not None and condition(sample):
+            return True
+        time.sleep(config.SAMPLE_INTERVAL / 2)
+    _log_action(td, f"Timed out waiting until {description}")
+    return False
+
+
+# Vacuum in chunks until there's nothing left to vacuum or the live samples meet
+# the condition. Returns True if stopped by the condition.
+def _incremental_vacuum_until(td, pages, description, condition):
+    while True:
+        (_, freelist_count) = _get_pages_usage(td)
+        if freelist_count == 0:
+            return False
+        _incremental_vacuum(td, pages)
+        # Give the monitor a chance to see the result of the vacuum
+        time.sleep(config.SAMPLE_INTERVAL * 2)
+        if condition(td.live.latest()):
+            _log_action(td, f"Stopped vacuuming, {description}")
+            return True
+
+
+def _log_page_usage(td):
+    _log_action(td, "Measuring page usage")
+    td.monitor_pipe.send(workload.page_usage(td, with_fragmentation=True))
+
+
+# Churn the rows already written with config's workload settings
+def _run_workload(td):
+    _manual_prompt("Before workload")
+    _check_disk_space(td)
+    distribution = config.WORKLOAD_DISTRIBUTION
+    _log_action(
+        td,
+        f"Workload of {config.WORKLOAD_OPERATIONS} {distribution} operations "
+        f"at {config.WORKLOAD_RATE}/s, seed {config.WORKLOAD_SEED}",
+    )
+    start = datetime.datetime.now()
+    counts = workload.run(
+        td,
+        distribution,
+        config.WORKLOAD_OPERATIONS,
+        config.WORKLOAD_RATE,
+        config.WORKLOAD_SEED,
+        lambda: _check_disk_space(td),
+    )
+    _log_duration(td, "workload", start)
+    _log_action(
+        td,
+        "Workload inserted {insert}, updated {update}, deleted {delete}".format(
+            **counts
+        ),
+    )
+
+
+# Run in its own process by _crash_writer, and killed part way through. Given
+# only what it needs to open the database, as the scenario's connections can't
+# be handed to a process which isn't forked.
+def _crashing_writer(
+    db_file, temp_dir, temp_store, row_size, action, started, finished
+):
+    connection = _open(db_file, temp_dir, temp_store)
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA wal_autocheckpoint(0);")
+    started.set()
+    if action == "write":
+        cursor.execute("SELECT coalesce(max(PrimaryKey) + 1, 0) FROM Data;")
+        key = cursor.fetchone()[0]
+        cursor.fetchall()
+        while True:
+            cursor.execute(
+                "INSERT INTO Data (PrimaryKey, Stuff) VALUES (?, ?);",
+                (key, schemas.payload(row_size)),
+            )
+            connection.commit()
+            key += 1
+    elif action == "vacuum":
+        cursor.execute("vacuum;")
+    finished.set()
+    while True:
+        time.sleep(1)
+
+
+def _size_or_zero(file_name):
+    try:
+        return os.path.getsize(file_name)
+    except FileNotFoundError:
+        return 0
+
+
+# The monitor samples too slowly to catch a fast writer, so watch the WAL
+# directly
+def _until_crash_point(td, wal_limit, finished):
+    last_check = time.monotonic()
+    while finished.is_set() is False:
+        if time.monotonic() - last_check >= config.DISK_CHECK_INTERVAL:
+            _check_disk_space(td)
+            last_check = time.monotonic()
+        if _size_or_zero(td.db_file + "-wal") > wal_limit:
+            return
+        time.sleep(0.001)
+
+
+# Every connection is closed and a separate process writes until the WAL is
+# larger than wal_limit, then it's killed with SIGKILL, as if the service had
+# crashed. Then the database is recovered.
+def _crash_writer(td, action, wal_limit):
+    if td.probe is not None:
+        # An open connection would keep the WAL index, so there'd be nothing
+        # to recover
+        stop_read_probe(td)
+    _log_action(td, f"Crashing writer: {action} until wal > {wal_limit / mb:.1f} MB")
+    td.cursor.fetchall()
+    td.cursor.close()
+    td.connection.close()
+
+    started = multiprocessing.Event()
+    finished = multiprocessing.Event()
+    writer = multiprocessing.Process(
+        name="crashing writer",
+        target=_crashing_writer,
+        args=(
+            td.db_file,
+            td.temp_dir,
+            td.temp_store,
+            config.ROW_SIZE,
+            action,
+            started,
+            finished,
+        ),
+    )
+    writer.start()
+    started.wait()
+    try:
+        _until_crash_point(td, wal_limit, finished)
+    except DiskSpaceError:
+        os.kill(writer.pid, signal.SIGKILL)
+        writer.join()
+        _connect(td)
+        raise
+    os.kill(writer.pid, signal.SIGKILL)
+    writer.join()
+
+    wal_bytes = _size_or_zero(td.db_file + "-wal")
+    if finished.is_set():
+        _log_action(td, f"Writer finished {action} before being killed")
+    _log_action(td, f"Killed writer, wal {wal_bytes} bytes")
+    _recover(td, wal_bytes)
+
+
+# Time what a restarting service waits for: opening the database, the first
+# query, which has to rebuild the WAL index from the WAL, and the first
+# checkpoint. Then check the database survived.
+def _recover(td, wal_bytes):
+    start = datetime.datetime.now()
+    timer = time.perf_counter()
+    _connect(td)
+    connected = time.perf_counter()
+    td.cursor.execute("SELECT max(PrimaryKey) FROM Data;")
     td.cursor.fetchall()
+    queried = time.perf_counter()
+    td.cursor.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    td.cursor.fetchall()
+    checkpointed = time.perf_counter()
+    td.cursor.execute("PRAGMA quick_check;")
+    quick_check = "; ".join(row[0] for row in td.cursor.fetchall())
+
+    td.monitor_pipe.send(
+        result.Recovery(
+            start,
+            wal_bytes,
+            connected - timer,
+            queried - connected,
+            checkpointed - queried,
+            quick_check,
+        )
+    )
+    _log_action(td, f"quick_check: {quick_check}")
 
 
 def _check_for_open_transaction(td):
@@ -119,6 +548,94 @@ def _check_for_open_transaction(td):
     assert td.connection.in_transaction == False
 
 
+# Start again from a copy of the database taken when the capture began
+def _restore_snapshot(td, snapshot):
+    if td.probe is not None:
+        td.probe.pause()
+    try:
+        td.cursor.close()
+        td.connection.close()
+        for stale in (td.db_file + "-wal", td.db_file + "-shm"):
+            if os.path.exists(stale):
+                os.remove(stale)
+        # Cloned alongside and renamed into place rather than overwritten, so
+        # anything still holding the old file open keeps its own copy
+        sibling = td.db_file + "-swap"
+        method = template.clone(snapshot, sibling)
+        os.replace(sibling, td.db_file)
+        _connect(td)
+        td.cursor.execute("PRAGMA journal_mode=WAL;")
+        td.cursor.fetchall()
+    finally:
+        if td.probe is not None:
+            td.probe.resume()
+    return method
+
+
+# Replay the traffic in config.REPLAY_LOG, from the snapshot taken alongside it
+# if there is one, otherwise against the database as it is
+def _replay_capture(td):
+    if config.REPLAY_LOG is None:
+        _log_action(td, "No capture to replay, see config.REPLAY_LOG")
+        return
+    _manual_prompt("Before replay")
+    _check_disk_space(td)
+    snapshot = config.REPLAY_LOG + ".db"
+    if os.path.exists(snapshot):
+        _log_action(td, f"Restoring {snapshot}")
+        _restore_snapshot(td, snapshot)
+    _log_action(td, f"Replaying {config.REPLAY_LOG} at {config.REPLAY_SPEED}x")
+    start = datetime.datetime.now()
+    counts = replay.run(
+        lambda: _open(
+            td.db_file, td.temp_dir, td.temp_store, config.REPLAY_BUSY_TIMEOUT
+        ),
+        config.REPLAY_LOG,
+        config.REPLAY_SPEED,
+        config.REPLAY_MAX_CONNECTIONS,
+        lambda: _check_disk_space(td),
+    )
+    _log_duration(td, "replay", start)
+    _log_action(
+        td,
+        "Replayed {statements} statements, {commits} commits, {errors} errors "
+        "on {connections} connections, p99 lag {p99 lag (s):.3f}s".format(**counts),
+    )
+
+
+# Writes every row from config.GROUP_COMMIT_PRODUCERS threads, through a
+# writer connection of its own committing up to max_rows rows at a time
+def _group_commit_write(td, max_rows, max_bytes, max_latency):
+    _manual_prompt("Before group commit write")
+    num_rows = config.NUM_ROWS_IN_DB
+    _check_disk_space(td, num_rows * config.ROW_SIZE)
+    _log_action(
+        td,
+        f"Writing {num_rows} rows from {config.GROUP_COMMIT_PRODUCERS} producers, "
+        f"up to {max_rows} rows, {max_bytes} bytes or {max_latency}s per commit",
+    )
+    # Nothing of ours may be left holding the database open meanwhile
+    td.cursor.fetchall()
+    td.connection.commit()
+    start = datetime.datetime.now()
+    stats = group_commit.run(
+        td.db_file,
+        config.GROUP_COMMIT_PRODUCERS,
+        num_rows,
+        schemas.payload(config.ROW_SIZE),
+        max_rows,
+        max_bytes,
+        max_latency,
+    )
+    _log_duration(td, "group commit write", start)
+    _log_action(
+        td,
+        "{rows per second:.1f} rows/s, latency p50 {latency p50 (s):.4f}s "
+        "p99 {latency p99 (s):.4f}s, {transactions} commits, "
+        "{wal bytes} bytes to the WAL".format(**stats),
+    )
+
+
 def _assert_page_size(td):
 
     td.cursor.execute("PRAGMA page_size;")
@@ -127,6 +644,352 @@ def _assert_page_size(td):
     assert db_page_size == page_size
 
 
+# Waits up to timeout seconds for another connection's lock, as
+# sqlite3.connect() does
+def _open(db_file, temp_dir, temp_store, timeout=5.0):
+    # The disk watchdog interrupts statements from its own thread
+    connection = sqlite3.connect(db_file, timeout=timeout, check_same_thread=False)
+
+    # SQLite only reads SQLITE_TMPDIR once, when the library is initialised,
+    # which newer Pythons do on import. Set the directory explicitly instead.
+    connection.execute(f"PRAGMA temp_store_directory = '{os.path.abspath(temp_dir)}';")
+    if temp_store is not None:
+        connection.execute(f"PRAGMA temp_store={temp_store};")
+    return connection
+
+
+# Reopens with the connection's settings from before, as cloning a template or
+# swapping in a compacted copy closes the connection part way through a scenario
+def _connect(td):
+    td.connection = _open(td.db_file, td.temp_dir, td.temp_store)
+    td.cursor = td.connection.cursor()
+    if td.auto_checkpoint is not None:
+        td.cursor.execute(f"PRAGMA wal_autocheckpoint({td.auto_checkpoint});")
+
+
+def compact_file(db_file, target_dir=None):
+    if target_dir is None:
+        target_dir = os.path.dirname(db_file)
+    return os.path.join(target_dir, os.path.basename(db_file) + "-compact")
+
+
+# Replace the database with a compacted copy of it. The connection has to be
+# closed first so that the old WAL has been checkpointed and removed, and
+# nothing is left holding the old file open.
+def _swap_in(td, new_file):
+    start = datetime.datetime.now()
+    if td.probe is not None:
+        td.probe.pause()
+
+    td.cursor.close()
+    td.connection.close()
+
+    db_dir = os.path.dirname(os.path.abspath(td.db_file))
+    if os.stat(new_file).st_dev != os.stat(db_dir).st_dev:
+        # os.replace() is only atomic within a filesystem, so bring the copy
+        # over first.
+        sibling = td.db_file + "-swap"
+        shutil.copyfile(new_file, sibling)
+        os.remove(new_file)
+        new_file = sibling
+
+    for stale in (td.db_file + "-wal", td.db_file + "-shm"):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    os.replace(new_file, td.db_file)
+
+    # VACUUM INTO doesn't carry WAL mode over to the copy
+    _connect(td)
+    td.cursor.execute("PRAGMA journal_mode=WAL;")
+    td.cursor.fetchall()
+    if td.probe is not None:
+        td.probe.resume()
+    _log_duration(td, "swap", start)
+
+
+def _vacuum_into(td, target_dir=None):
+    target = compact_file(td.db_file, target_dir)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.exists(target):
+        os.remove(target)
+
+    _manual_prompt("Before vacuum into")
+    _check_disk_space(td, _db_size(td))
+    _log_action(td, "vacuum into")
+    start = datetime.datetime.now()
+    with _statement_progress(td, "vacuum into") as progress:
+        td.cursor.execute("VACUUM INTO ?;", (target,))
+    _log_duration(td, "vacuum into", start)
+    if progress.cancelled:
+        os.remove(target)
+        return
+
+    _log_action(td, "Swap in compacted db")
+    _swap_in(td, target)
+
+
+# Commits small rows through a connection of its own at a fixed interval,
+# recording how long each commit takes. Maintenance holding the database's
+# write lock keeps the writer waiting on SQLite's busy handler, which shows up
+# as commit latency, and commits still blocked after
+# config.CONCURRENT_WRITE_BUSY_TIMEOUT seconds are counted as failed. Swapping
+# in a new database file pauses the writer, closing its connection, and it
+# reconnects to the new file when resumed.
+class _ConcurrentWriter(threading.Thread):
+    def __init__(self, td, interval):
+        super().__init__(name="writer", daemon=True)
+        self.td = td
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.commits = list()
+        self.failures = 0
+        self.paused = False
+        self.connection = None
+
+    def pause(self):
+        self.lock.acquire()
+        self.paused = True
+        self._disconnect()
+
+    def resume(self):
+        self.paused = False
+        self.lock.release()
+
+    def _disconnect(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def run(self):
+        key = 10 ** 6
+        while self.stop_event.is_set() is False:
+            start = datetime.datetime.now()
+            with self.lock:
+                if self.connection is None:
+                    # Closed by pause() from the scenario's thread
+                    self.connection = sqlite3.connect(
+                        self.td.db_file,
+                        timeout=config.CONCURRENT_WRITE_BUSY_TIMEOUT,
+                        check_same_thread=False,
+                    )
+                try:
+                    self.connection.execute(
+                        "INSERT INTO Data (PrimaryKey, Stuff) VALUES (?, ?);",
+                        (key, schemas.payload(config.CONCURRENT_WRITE_SIZE)),
+                    )
+                    self.connection.commit()
+                    self.commits.append(result.Duration("writer commit", start))
+                    key += 1
+                except sqlite3.OperationalError:
+                    self.connection.rollback()
+                    self.failures += 1
+            self.stop_event.wait(self.interval)
+        with self.lock:
+            self._disconnect()
+
+
+# Checks free space while a step is running and interrupts the statement in
+# progress before the disk fills. An interrupt is a no-op if no statement is
+# running at the time, so keep interrupting until stopped.
+class DiskWatchdog(threading.Thread):
+    def __init__(self, td):
+        super().__init__(name="disk watchdog", daemon=True)
+        self.td = td
+        self.stop_event = threading.Event()
+        self.reason = None
+
+    def run(self):
+        while self.stop_event.wait(config.DISK_CHECK_INTERVAL) is False:
+            if self.reason is None:
+                self.reason = _low_disk_space(self.td)
+            if self.reason is not None:
+                try:
+                    self.td.connection.interrupt()
+                except sqlite3.ProgrammingError:
+                    # Connection closed, e.g. while being swapped
+                    pass
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+# Reads from separate connections throughout a scenario, as user queries would,
+# to see how much maintenance slows them down. Each worker runs a mix of point
+# lookups and range scans. Swapping in a new database file pauses the probe,
+# which closes the workers' connections so nothing is left holding the old file
+# or its WAL index open, and the workers reconnect to the new file when it
+# resumes.
+class ReadProbe:
+    def __init__(self, td, threads):
+        self.td = td
+        self.threads = threads
+        self.locks = [threading.Lock() for _ in range(threads)]
+        self.connections = [None] * threads
+        self.stop_event = threading.Event()
+        self.reads = list()
+        self.pool = None
+        self.workers = list()
+
+    def start(self):
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            self.threads, thread_name_prefix="reader"
+        )
+        self.workers = [self.pool.submit(self._read, i) for i in range(self.threads)]
+
+    def pause(self):
+        for (worker, lock) in enumerate(self.locks):
+            lock.acquire()
+            self._disconnect(worker)
+
+    def resume(self):
+        for lock in self.locks:
+            lock.release()
+
+    def _disconnect(self, worker):
+        if self.connections[worker] is not None:
+            self.connections[worker].close()
+            self.connections[worker] = None
+
+    # Sends the latency of every query to the monitor. Raises any error a
+    # worker stopped with.
+    def stop(self):
+        self.stop_event.set()
+        self.pool.shutdown()
+        for worker in self.workers:
+            worker.result()
+        for read in self.reads:
+            self.td.monitor_pipe.send(read)
+        return len(self.reads)
+
+    # Closed by pause() from the scenario's thread
+    def _connect(self):
+        uri = pathlib.Path(os.path.abspath(self.td.db_file)).as_uri() + "?mode=ro"
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    def _read(self, worker):
+        rng = random.Random(config.READ_PROBE_SEED + worker)
+        while self.stop_event.is_set() is False:
+            with self.locks[worker]:
+                if self.connections[worker] is None:
+                    self.connections[worker] = self._connect()
+                connection = self.connections[worker]
+
+                key = rng.randrange(max(config.NUM_ROWS_IN_DB, 1))
+                if rng.random() < config.READ_PROBE_POINT_FRACTION:
+                    kind = "point"
+                    query = "SELECT Stuff FROM Data WHERE PrimaryKey = ?;"
+                    params = (key,)
+                else:
+                    kind = "range"
+                    query = (
+                        "SELECT PrimaryKey FROM Data WHERE PrimaryKey BETWEEN ? AND ?;"
+                    )
+                    params = (key, key + config.READ_PROBE_RANGE_ROWS - 1)
+
+                start = datetime.datetime.now()
+                timer = time.perf_counter()
+                connection.execute(query, params).fetchall()
+                seconds = time.perf_counter() - timer
+            self.reads.append(result.Read(kind, start, seconds))
+            self.stop_event.wait(config.READ_PROBE_INTERVAL)
+        with self.locks[worker]:
+            self._disconnect(worker)
+
+
+def start_read_probe(td, threads):
+    _log_action(td, f"Starting read probe with {threads} threads")
+    td.probe = ReadProbe(td, threads)
+    td.probe.start()
+
+
+def stop_read_probe(td):
+    reads = td.probe.stop()
+    td.probe = None
+    _log_action(td, f"Stopped read probe after {reads} reads")
+
+
+def _start_concurrent_writer(td):
+    _log_action(td, "Starting concurrent writer")
+    # A statement left in progress, such as one only read with fetchone(),
+    # would keep a read transaction open on the scenario's connection
+    td.cursor.fetchall()
+    writer = _ConcurrentWriter(td, config.CONCURRENT_WRITE_INTERVAL)
+    writer.start()
+    return writer
+
+
+def _stop_concurrent_writer(td, writer):
+    writer.stop_event.set()
+    writer.join()
+    for commit in writer.commits:
+        td.monitor_pipe.send(commit)
+    _log_action(
+        td,
+        f"Stopped concurrent writer after {len(writer.commits)} commits, "
+        f"{writer.failures} timed out",
+    )
+
+
+# Copy the database a few pages at a time with the online backup API, sleeping
+# between steps to spread out the I/O, then compact the copy and swap it in.
+# The copy includes the free pages, so it is the incremental vacuum of the copy
+# which reclaims the space, without touching the live database's WAL.
+def _backup_compact(td, pages_per_step, step_delay, target_dir=None, writer=None):
+    target = compact_file(td.db_file, target_dir)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.exists(target):
+        os.remove(target)
+
+    _manual_prompt("Before backup")
+    _check_disk_space(td, _db_size(td))
+    _log_action(td, f"backup (pages={pages_per_step} delay={step_delay}s)")
+
+    # Anything committed after the final step would be lost by the swap, so
+    # the writer is paused from the final step until the copy is swapped in.
+    # A commit from the writer's connection while the backup is in progress
+    # makes SQLite start the backup again from the first page, so after
+    # config.BACKUP_MAX_RESTARTS restarts the writer is paused for the rest of
+    # the backup, or it might never finish.
+    td.cursor.execute("PRAGMA page_count;")
+    page_count = td.cursor.fetchall()[0][0]
+    restarts = 0
+    last_remaining = page_count
+
+    def throttle(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if remaining > last_remaining:
+            restarts += 1
+            td.monitor_pipe.send(result.Action(f"Backup restarted ({restarts})"))
+        last_remaining = remaining
+        if writer is not None and not writer.paused:
+            if remaining <= pages_per_step or restarts >= config.BACKUP_MAX_RESTARTS:
+                writer.pause()
+        if remaining > 0:
+            time.sleep(step_delay)
+
+    try:
+        if writer is not None and (pages_per_step < 0 or page_count <= pages_per_step):
+            writer.pause()
+        start = datetime.datetime.now()
+        destination = sqlite3.connect(target)
+        td.connection.backup(destination, pages=pages_per_step, progress=throttle)
+        _log_duration(td, "backup", start)
+
+        start = datetime.datetime.now()
+        destination.executescript("PRAGMA incremental_vacuum;")
+        destination.close()
+        _log_duration(td, "compact copy", start)
+
+        _swap_in(td, target)
+    finally:
+        if writer is not None and writer.paused:
+            writer.resume()
+    _log_action(td, f"Backup restarted {restarts} times")
+
+
 def setup_database(td, db_file):
 
     os.makedirs(os.path.dirname(db_file), exist_ok=True)
@@ -134,19 +997,13 @@ def setup_database(td, db_file):
     if os.path.exists(db_file):
         os.remove(db_file)
 
-    td.connection = sqlite3.connect(db_file)
-    td.cursor = td.connection.cursor()
+    td.db_file = db_file
+    _connect(td)
 
     td.cursor.execute("PRAGMA auto_vacuum=2;")
     td.cursor.execute("PRAGMA journal_mode=WAL;")
 
-    td.cursor.execute(
-        """
-    CREATE TABLE Data (
-        PrimaryKey INTEGER PRIMARY KEY,
-        Stuff TEXT);
-    """
-    )
+    schemas.create(td.cursor, config.SCHEMA)
 
     _assert_page_size(td)
 
@@ -156,6 +1013,7 @@ def cleanup_database(td):
     _log_action(td, "Closing connection")
     td.cursor.close()
     td.connection.close()
+    end_step(td)
 
 
 def scenario_00_large_write_single_commit(td):
@@ -216,8 +1074,7 @@ def scenario_12_small_transaction_vacuum_populated_checkpoint_db(td):
         )
     )
 
-    _write_data(td, True, config.NUM_ROWS_IN_DB)
-    _checkpoint_truncate(td)
+    _populate(td, True)
     _vacuum(td)
     _checkpoint_truncate(td)
 
@@ -229,8 +1086,7 @@ def scenario_20_vacuum_previously_populated_db(td):
     ##################################################
     # Write data
     ##################################################
-    _write_data(td, True, config.NUM_ROWS_IN_DB)
-    _checkpoint_truncate(td)
+    _populate(td, True)
 
     ##################################################
     # Delete all data
@@ -255,8 +1111,7 @@ def scenario_21_vacuum_and_checkpoint_previously_populated_db(td):
     ##################################################
     # Write data
     ##################################################
-    _write_data(td, True, config.NUM_ROWS_IN_DB)
-    _checkpoint_truncate(td)
+    _populate(td, True)
 
     ##################################################
     # Delete all data
@@ -290,7 +1145,7 @@ def scenario_30_delete_and_entire_incremental_vacuum_first_15(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 0, 15)
+    _delete_data(td, True, 0, _percent_of_rows(15))
     _checkpoint_truncate(td)
 
     ##################################################
@@ -315,7 +1170,7 @@ def scenario_31_delete_and_entire_incremental_vacuum_last_15(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 85, config.NUM_ROWS_IN_DB)
+    _delete_data(td, True, _percent_of_rows(85), config.NUM_ROWS_IN_DB)
     _checkpoint_truncate(td)
 
     ##################################################
@@ -340,7 +1195,7 @@ def scenario_32_delete_and_entire_incremental_vacuum_first_60(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 0, 60)
+    _delete_data(td, True, 0, _percent_of_rows(60))
     _checkpoint_truncate(td)
 
     ##################################################
@@ -365,7 +1220,7 @@ def scenario_33_delete_and_entire_incremental_vacuum_last_60(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 40, config.NUM_ROWS_IN_DB)
+    _delete_data(td, True, _percent_of_rows(40), config.NUM_ROWS_IN_DB)
     _checkpoint_truncate(td)
 
     ##################################################
@@ -415,7 +1270,7 @@ def scenario_35_delete_and_entire_incremental_vacuum_last_3_checkpoint(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 97, config.NUM_ROWS_IN_DB)
+    _delete_data(td, True, _percent_of_rows(97), config.NUM_ROWS_IN_DB)
     _checkpoint_truncate(td)
 
     ##################################################
@@ -441,13 +1296,13 @@ def scenario_40_delete_and_granular_incremental_vacuum_first_15(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 0, 15)
+    _delete_data(td, True, 0, _percent_of_rows(15))
     _checkpoint_truncate(td)
 
     ##################################################
     # Try and shrink the DB with incremental_vacuum
     ##################################################
-    for i in range(1000):
+    while True:
         (_, freelist_count) = _get_pages_usage(td)
         if freelist_count == 0:
             break
@@ -468,13 +1323,13 @@ def scenario_41_delete_and_granular_incremental_vacuum_last_15(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 85, config.NUM_ROWS_IN_DB)
+    _delete_data(td, True, _percent_of_rows(85), config.NUM_ROWS_IN_DB)
     _checkpoint_truncate(td)
 
     ##################################################
     # Try and shrink the DB with incremental_vacuum
     ##################################################
-    for i in range(1000):
+    while True:
         (_, freelist_count) = _get_pages_usage(td)
         if freelist_count == 0:
             break
@@ -495,13 +1350,13 @@ def scenario_42_delete_and_granular_incremental_vacuum_first_60(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 0, 60)
+    _delete_data(td, True, 0, _percent_of_rows(60))
     _checkpoint_truncate(td)
 
     ##################################################
     # Try and shrink the DB with incremental_vacuum
     ##################################################
-    for i in range(1000):
+    while True:
         (_, freelist_count) = _get_pages_usage(td)
         if freelist_count == 0:
             break
@@ -522,13 +1377,13 @@ def scenario_43_delete_and_granular_incremental_vacuum_last_60(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 40, config.NUM_ROWS_IN_DB)
+    _delete_data(td, True, _percent_of_rows(40), config.NUM_ROWS_IN_DB)
     _checkpoint_truncate(td)
 
     ##################################################
     # Try and shrink the DB with incremental_vacuum
     ##################################################
-    for i in range(1000):
+    while True:
         (_, freelist_count) = _get_pages_usage(td)
         if freelist_count == 0:
             break
@@ -551,13 +1406,13 @@ def scenario_44_delete_and_granular_incremental_vacuum_first_15_checkpoint(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 0, 15)
+    _delete_data(td, True, 0, _percent_of_rows(15))
     _checkpoint_truncate(td)
 
     ##################################################
     # Try and shrink the DB with incremental_vacuum
     ##################################################
-    for i in range(1000):
+    while True:
         (_, free_count) = _get_pages_usage(td)
         if free_count == 0:
             break
@@ -581,13 +1436,13 @@ def scenario_45_delete_and_granular_incremental_vacuum_last_15_checkpoint(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 85, config.NUM_ROWS_IN_DB)
+    _delete_data(td, True, _percent_of_rows(85), config.NUM_ROWS_IN_DB)
     _checkpoint_truncate(td)
 
     ##################################################
     # Try and shrink the DB with incremental_vacuum
     ##################################################
-    for i in range(1000):
+    while True:
         (_, free_count) = _get_pages_usage(td)
         if free_count == 0:
             break
@@ -602,13 +1457,12 @@ def scenario_50_delete_first_15(td):
     ##################################################
     # Write data
     ##################################################
-    _write_data(td, True, config.NUM_ROWS_IN_DB)
-    _checkpoint_truncate(td)
+    _populate(td, True)
 
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 0, 15)
+    _delete_data(td, True, 0, _percent_of_rows(15))
     _get_pages_usage(td)
     _checkpoint_truncate(td)
 
@@ -620,13 +1474,12 @@ def scenario_51_delete_last_15(td):
     ##################################################
     # Write data
     ##################################################
-    _write_data(td, True, config.NUM_ROWS_IN_DB)
-    _checkpoint_truncate(td)
+    _populate(td, True)
 
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 85, config.NUM_ROWS_IN_DB)
+    _delete_data(td, True, _percent_of_rows(85), config.NUM_ROWS_IN_DB)
     _get_pages_usage(td)
     _checkpoint_truncate(td)
 
@@ -645,7 +1498,7 @@ def scenario_60_delete_and_granular_incremental_vacuum_last_15_595(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 85, config.NUM_ROWS_IN_DB)
+    _delete_data(td, True, _percent_of_rows(85), config.NUM_ROWS_IN_DB)
     _checkpoint_truncate(td)
 
     ##################################################
@@ -675,7 +1528,7 @@ def scenario_61_delete_and_granular_incremental_vacuum_last_15_596(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 85, config.NUM_ROWS_IN_DB)
+    _delete_data(td, True, _percent_of_rows(85), config.NUM_ROWS_IN_DB)
     _checkpoint_truncate(td)
 
     ##################################################
@@ -705,7 +1558,7 @@ def scenario_62_delete_and_granular_incremental_vacuum_last_15_595(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 85, config.NUM_ROWS_IN_DB)
+    _delete_data(td, True, _percent_of_rows(85), config.NUM_ROWS_IN_DB)
     _checkpoint_truncate(td)
 
     ##################################################
@@ -736,7 +1589,7 @@ def scenario_63_delete_and_granular_incremental_vacuum_last_15_596(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 85, config.NUM_ROWS_IN_DB)
+    _delete_data(td, True, _percent_of_rows(85), config.NUM_ROWS_IN_DB)
     _checkpoint_truncate(td)
 
     ##################################################
@@ -767,7 +1620,7 @@ def scenario_64_delete_and_granular_incremental_vacuum_last_15_200(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 85, config.NUM_ROWS_IN_DB)
+    _delete_data(td, True, _percent_of_rows(85), config.NUM_ROWS_IN_DB)
     _checkpoint_truncate(td)
 
     ##################################################
@@ -797,7 +1650,7 @@ def scenario_65_delete_and_granular_incremental_vacuum_last_15_200(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 85, config.NUM_ROWS_IN_DB)
+    _delete_data(td, True, _percent_of_rows(85), config.NUM_ROWS_IN_DB)
     _checkpoint_truncate(td)
 
     ##################################################
@@ -838,7 +1691,7 @@ def scenario_66_delete_and_entire_incremetal_last_15_no_autocheckpoint(td):
     ##################################################
     # Delete some data
     ##################################################
-    _delete_data(td, True, 85, config.NUM_ROWS_IN_DB)
+    _delete_data(td, True, _percent_of_rows(85), config.NUM_ROWS_IN_DB)
     _get_pages_usage(td)
     _checkpoint_passive_and_log_pages(td)
     _checkpoint_truncate(td)
@@ -850,3 +1703,432 @@ def scenario_66_delete_and_entire_incremetal_last_15_no_autocheckpoint(td):
     _incremental_vacuum(td, 0)
     _checkpoint_passive_and_log_pages(td)
     _get_pages_usage(td)
+
+
+def scenario_70_delete_first_60_in_place_vacuum(td):
+
+    td.monitor_pipe.send(
+        result.Title("Delete First 60 Rows, In Place Vacuum, Checkpoint (S.70)")
+    )
+
+    ##################################################
+    # Write data
+    ##################################################
+    _write_data(td, True, config.NUM_ROWS_IN_DB)
+
+    ##################################################
+    # Delete some data
+    ##################################################
+    _delete_data(td, True, 0, _percent_of_rows(60))
+    _checkpoint_truncate(td)
+
+    ##################################################
+    # Compact in place, for comparison with S.71
+    ##################################################
+    _get_pages_usage(td)
+    _vacuum(td)
+    _checkpoint_truncate(td)
+    _get_pages_usage(td)
+
+
+def scenario_71_delete_first_60_vacuum_into_and_swap(td):
+
+    td.monitor_pipe.send(
+        result.Title("Delete First 60 Rows, Vacuum Into And Swap (S.71)")
+    )
+
+    ##################################################
+    # Write data
+    ##################################################
+    _write_data(td, True, config.NUM_ROWS_IN_DB)
+
+    ##################################################
+    # Delete some data
+    ##################################################
+    _delete_data(td, True, 0, _percent_of_rows(60))
+    _checkpoint_truncate(td)
+
+    ##################################################
+    # Compact into a separate file and swap it in
+    ##################################################
+    _get_pages_usage(td)
+    _vacuum_into(td, config.COMPACT_DIR)
+    _get_pages_usage(td)
+
+
+def scenario_72_delete_first_60_in_place_vacuum_concurrent_writer(td):
+
+    td.monitor_pipe.send(
+        result.Title("Delete First 60 Rows, Vacuum With Concurrent Writer (S.72)")
+    )
+
+    ##################################################
+    # Write data
+    ##################################################
+    _write_data(td, True, config.NUM_ROWS_IN_DB)
+
+    ##################################################
+    # Delete some data
+    ##################################################
+    _delete_data(td, True, 0, _percent_of_rows(60))
+    _checkpoint_truncate(td)
+
+    ##################################################
+    # Compact in place while another thread commits, for comparison with S.73
+    ##################################################
+    _get_pages_usage(td)
+    writer = _start_concurrent_writer(td)
+    _vacuum(td)
+    _stop_concurrent_writer(td, writer)
+    _checkpoint_truncate(td)
+    _get_pages_usage(td)
+
+
+def scenario_73_delete_first_60_throttled_backup_concurrent_writer(td):
+
+    td.monitor_pipe.send(
+        result.Title(
+            "Delete First 60 Rows, Throttled Backup With Concurrent Writer (S.73)"
+        )
+    )
+
+    ##################################################
+    # Write data
+    ##################################################
+    _write_data(td, True, config.NUM_ROWS_IN_DB)
+
+    ##################################################
+    # Delete some data
+    ##################################################
+    _delete_data(td, True, 0, _percent_of_rows(60))
+    _checkpoint_truncate(td)
+
+    ##################################################
+    # Compact through a throttled backup while another thread commits
+    ##################################################
+    _get_pages_usage(td)
+    writer = _start_concurrent_writer(td)
+    _backup_compact(
+        td,
+        config.BACKUP_PAGES_PER_STEP,
+        config.BACKUP_STEP_DELAY,
+        config.COMPACT_DIR,
+        writer,
+    )
+    _stop_concurrent_writer(td, writer)
+    _get_pages_usage(td)
+
+
+def scenario_74_delete_first_15_incremental_vacuum_checkpoint_on_wal_size(td):
+
+    td.monitor_pipe.send(
+        result.Title(
+            "Delete First 15 Rows, Incremental Vacuum, Checkpoint At 8 MB WAL (S.74)"
+        )
+    )
+
+    ##################################################
+    # Checkpoints are left to the scenario
+    ##################################################
+    _set_auto_checkpoint(td, 0)
+
+    ##################################################
+    # Write data
+    ##################################################
+    _populate(td, True)
+
+    ##################################################
+    # Delete some data
+    ##################################################
+    _delete_data(td, True, 0, _percent_of_rows(15))
+    _checkpoint_truncate(td)
+    _wait_until(td, "wal truncated", lambda sample: sample["wal"] == 0)
+
+    ##################################################
+    # Vacuum until the WAL reaches 8 MB, then checkpoint it away
+    ##################################################
+    wal_limit = 8 * mb
+    while _incremental_vacuum_until(
+        td, 200, "wal > 8 MB", lambda sample: sample["wal"] > wal_limit
+    ):
+        _checkpoint_truncate(td)
+        _wait_until(td, "wal truncated", lambda sample: sample["wal"] == 0)
+
+    _checkpoint_truncate(td)
+    _get_pages_usage(td)
+
+
+def scenario_80_workload_in_place_vacuum(td):
+
+    td.monitor_pipe.send(
+        result.Title(
+            f"Workload ({config.WORKLOAD_DISTRIBUTION}), In Place Vacuum (S.80)"
+        )
+    )
+
+    ##################################################
+    # Write data, then churn it
+    ##################################################
+    _write_data(td, True, config.NUM_ROWS_IN_DB)
+    _log_page_usage(td)
+    _run_workload(td)
+    _checkpoint_truncate(td)
+
+    ##################################################
+    # Compact in place
+    ##################################################
+    _log_page_usage(td)
+    _vacuum(td)
+    _checkpoint_truncate(td)
+    _log_page_usage(td)
+
+
+def scenario_81_workload_entire_incremental_vacuum(td):
+
+    td.monitor_pipe.send(
+        result.Title(
+            f"Workload ({config.WORKLOAD_DISTRIBUTION}), "
+            "Entire Incremental Vacuum (S.81)"
+        )
+    )
+
+    ##################################################
+    # Write data, then churn it
+    ##################################################
+    _write_data(td, True, config.NUM_ROWS_IN_DB)
+    _log_page_usage(td)
+    _run_workload(td)
+    _checkpoint_truncate(td)
+
+    ##################################################
+    # Give back every free page in one go
+    ##################################################
+    _log_page_usage(td)
+    _incremental_vacuum(td, 0)
+    _checkpoint_truncate(td)
+    _log_page_usage(td)
+
+
+def scenario_82_workload_granular_incremental_vacuum_checkpoint(td):
+
+    td.monitor_pipe.send(
+        result.Title(
+            f"Workload ({config.WORKLOAD_DISTRIBUTION}), "
+            "Granular Incr Vacuum 200, Checkpoint (S.82)"
+        )
+    )
+
+    ##################################################
+    # Write data, then churn it
+    ##################################################
+    _write_data(td, True, config.NUM_ROWS_IN_DB)
+    _log_page_usage(td)
+    _run_workload(td)
+    _checkpoint_truncate(td)
+
+    ##################################################
+    # Give back the free pages in chunks, checkpointing between them
+    ##################################################
+    _log_page_usage(td)
+    (_, pages_to_vacuum) = _get_pages_usage(td)
+
+    step_size = 200
+
+    for i in range(int(pages_to_vacuum / step_size + 1)):
+        _incremental_vacuum(td, step_size)
+        _checkpoint_passive_and_log_pages(td)
+
+    _checkpoint_truncate(td)
+    _log_page_usage(td)
+
+
+def scenario_83_workload_vacuum_into_and_swap(td):
+
+    td.monitor_pipe.send(
+        result.Title(
+            f"Workload ({config.WORKLOAD_DISTRIBUTION}), Vacuum Into And Swap (S.83)"
+        )
+    )
+
+    ##################################################
+    # Write data, then churn it
+    ##################################################
+    _write_data(td, True, config.NUM_ROWS_IN_DB)
+    _log_page_usage(td)
+    _run_workload(td)
+    _checkpoint_truncate(td)
+
+    ##################################################
+    # Compact into a separate file and swap it in
+    ##################################################
+    _log_page_usage(td)
+    _vacuum_into(td, config.COMPACT_DIR)
+    _log_page_usage(td)
+
+
+def _replay_title(what, scenario):
+    name = os.path.basename(config.REPLAY_LOG or "nothing")
+    return result.Title(f"Replay ({name}), {what} (S.{scenario})")
+
+
+def scenario_84_replay_in_place_vacuum(td):
+
+    td.monitor_pipe.send(_replay_title("In Place Vacuum", 84))
+
+    ##################################################
+    # Replay captured traffic
+    ##################################################
+    _replay_capture(td)
+    _checkpoint_truncate(td)
+
+    ##################################################
+    # Compact in place
+    ##################################################
+    _log_page_usage(td)
+    _vacuum(td)
+    _checkpoint_truncate(td)
+    _log_page_usage(td)
+
+
+def scenario_85_replay_entire_incremental_vacuum(td):
+
+    td.monitor_pipe.send(_replay_title("Entire Incremental Vacuum", 85))
+
+    ##################################################
+    # Replay captured traffic
+    ##################################################
+    _replay_capture(td)
+    _checkpoint_truncate(td)
+
+    ##################################################
+    # Give back every free page in one go
+    ##################################################
+    _log_page_usage(td)
+    _incremental_vacuum(td, 0)
+    _checkpoint_truncate(td)
+    _log_page_usage(td)
+
+
+def scenario_86_replay_granular_incremental_vacuum_checkpoint(td):
+
+    td.monitor_pipe.send(_replay_title("Granular Incr Vacuum 200, Checkpoint", 86))
+
+    ##################################################
+    # Replay captured traffic
+    ##################################################
+    _replay_capture(td)
+    _checkpoint_truncate(td)
+
+    ##################################################
+    # Give back the free pages in chunks, checkpointing between them
+    ##################################################
+    _log_page_usage(td)
+    (_, pages_to_vacuum) = _get_pages_usage(td)
+
+    step_size = 200
+
+    for i in range(int(pages_to_vacuum / step_size + 1)):
+        _incremental_vacuum(td, step_size)
+        _checkpoint_passive_and_log_pages(td)
+
+    _checkpoint_truncate(td)
+    _log_page_usage(td)
+
+
+def scenario_87_replay_vacuum_into_and_swap(td):
+
+    td.monitor_pipe.send(_replay_title("Vacuum Into And Swap", 87))
+
+    ##################################################
+    # Replay captured traffic
+    ##################################################
+    _replay_capture(td)
+    _checkpoint_truncate(td)
+
+    ##################################################
+    # Compact into a separate file and swap it in
+    ##################################################
+    _log_page_usage(td)
+    _vacuum_into(td, config.COMPACT_DIR)
+    _log_page_usage(td)
+
+
+def scenario_88_per_row_and_group_commits(td):
+
+    td.monitor_pipe.send(
+        result.Title(
+            f"Per Row vs Group Commits, {config.GROUP_COMMIT_PRODUCERS} Producers "
+            "(S.88)"
+        )
+    )
+
+    ##################################################
+    # Write data from many producers, committing every row on its own
+    ##################################################
+    _group_commit_write(td, 1, 0, 0)
+    _checkpoint_truncate(td)
+    _delete_data(td, False, 0, config.NUM_ROWS_IN_DB)
+    _checkpoint_truncate(td)
+
+    ##################################################
+    # Write it again, coalescing the producers' rows into shared commits
+    ##################################################
+    _group_commit_write(
+        td,
+        config.GROUP_COMMIT_MAX_ROWS,
+        config.GROUP_COMMIT_MAX_BYTES,
+        config.GROUP_COMMIT_MAX_LATENCY,
+    )
+    _checkpoint_truncate(td)
+    _log_page_usage(td)
+
+
+def scenario_90_crash_writer_at_wal_sizes(td):
+
+    td.monitor_pipe.send(result.Title("Crash Writer At WAL Sizes, Recover (S.90)"))
+
+    ##################################################
+    # Write data
+    ##################################################
+    _populate(td, True)
+
+    ##################################################
+    # Kill a writer with ever larger WALs, timing each recovery
+    ##################################################
+    for fraction in config.CRASH_WAL_FRACTIONS:
+        wal_limit = int(fraction * config.NUM_ROWS_IN_DB * config.ROW_SIZE)
+        _crash_writer(td, "write", wal_limit)
+    _get_pages_usage(td)
+
+
+def scenario_91_delete_first_60_crash_mid_vacuum(td):
+
+    td.monitor_pipe.send(
+        result.Title("Delete First 60 Rows, Crash Mid Vacuum, Recover, Vacuum (S.91)")
+    )
+
+    ##################################################
+    # Write data
+    ##################################################
+    _write_data(td, True, config.NUM_ROWS_IN_DB)
+
+    ##################################################
+    # Delete some data
+    ##################################################
+    _delete_data(td, True, 0, _percent_of_rows(60))
+    _checkpoint_truncate(td)
+
+    ##################################################
+    # Kill the vacuum half way through writing the compacted pages to the WAL
+    ##################################################
+    (used_count, _) = _get_pages_usage(td)
+    wal_limit = used_count * page_size // 2
+    _crash_writer(td, "vacuum", wal_limit)
+
+    ##################################################
+    # Vacuum again after recovering
+    ##################################################
+    _get_pages_usage(td)
+    _vacuum(td)
+    _checkpoint_truncate(td)
+    _get_pages_usage(td)
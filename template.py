@@ -0,0 +1,56 @@
+import fcntl
+import hashlib
+import os
+import shutil
+
+# ioctl sharing a file's extents with another, on filesystems which can (btrfs,
+# XFS, bcachefs, ...)
+FICLONE = 0x40049409
+stream_buffer = 2 ** 20
+
+
+def _copy_file_range(source, destination):
+    remaining = os.fstat(source.fileno()).st_size
+    while remaining > 0:
+        copied = os.copy_file_range(source.fileno(), destination.fileno(), remaining)
+        if copied == 0:
+            break
+        remaining -= copied
+
+
+# Copies source to destination as cheaply as the filesystem allows: a reflink
+# shares the blocks until either file is written to, copy_file_range() keeps the
+# copy in the kernel, and failing both it's read and written a buffer at a
+# time. Returns which it was.
+def clone(source, destination):
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return "reflink"
+        except OSError:
+            pass
+        try:
+            _copy_file_range(src, dst)
+            return "copy_file_range"
+        except (OSError, AttributeError):
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+        shutil.copyfileobj(src, dst, stream_buffer)
+        return "stream"
+
+
+# Saves a copy of db_file as template_file. Written alongside and renamed into
+# place, so a template is never seen half written, even by trials running side
+# by side.
+def save(db_file, template_file):
+    os.makedirs(os.path.dirname(template_file), exist_ok=True)
+    partial = f"{template_file}.{os.getpid()}"
+    method = clone(db_file, partial)
+    os.replace(partial, template_file)
+    return method
+
+
+# A short hash of everything a template's contents depend on
+def key(*parts):
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:16]
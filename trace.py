@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import json
+import os
+import time
+
+import metrics
+import result
+
+# Tracks of each scenario's process
+steps_tid = 1
+timed_tid = 2
+writer_tid = 3
+recovery_tid = 4
+progress_tid = 5
+track_names = {
+    steps_tid: "steps",
+    timed_tid: "timed steps",
+    writer_tid: "concurrent writer",
+    recovery_tid: "recovery",
+    progress_tid: "statement progress",
+}
+
+
+# Trace event timestamps are microseconds
+def _us(timestamp):
+    return round(timestamp.timestamp() * 10 ** 6)
+
+
+def _slice(pid, tid, name, start, end, args=None):
+    event = {
+        "ph": "X",
+        "pid": pid,
+        "tid": tid,
+        "name": name,
+        "ts": _us(start),
+        "dur": max(0, _us(end) - _us(start)),
+    }
+    if args:
+        event["args"] = args
+    return event
+
+
+def _counter(pid, name, timestamp, args):
+    return {"ph": "C", "pid": pid, "name": name, "ts": _us(timestamp), "args": args}
+
+
+def _metadata(pid, tid, name, args):
+    return {"ph": "M", "pid": pid, "tid": tid, "name": name, "args": args}
+
+
+def _instant(pid, tid, name, timestamp):
+    return {
+        "ph": "i",
+        "s": "t",
+        "pid": pid,
+        "tid": tid,
+        "name": name,
+        "ts": _us(timestamp),
+    }
+
+
+# Each step as a slice, without the pauses around its action, and any other
+# action as an instant. Results from before steps were recorded have each action
+# as a slice lasting until the next action, or the end of the scenario.
+def _action_slices(pid, records):
+    actions = [r for r in records if isinstance(r, result.Action)]
+    steps = [r for r in records if isinstance(r, result.Step)]
+    if steps:
+        step_names = {s.msg for s in steps}
+        slices = [_slice(pid, steps_tid, s.msg, s.timestamp, s.end) for s in steps]
+        instants = [
+            _instant(pid, steps_tid, a.msg, a.timestamp)
+            for a in actions
+            if a.msg not in step_names
+        ]
+        return slices + instants
+    end = max(r.timestamp for r in records)
+    ends = [a.timestamp for a in actions[1:]] + [end]
+    return [
+        _slice(pid, steps_tid, a.msg, a.timestamp, e) for (a, e) in zip(actions, ends)
+    ]
+
+
+def _record_events(pid, r):
+    if isinstance(r, result.FleetSize):
+        return [
+            _counter(pid, "file size", r.timestamp, _sizes(r)),
+            _counter(pid, "rss", r.timestamp, {"rss": r.rss}),
+            _counter(
+                pid,
+                "fleet",
+                r.timestamp,
+                {"databases": r.databases, "largest": r.largest},
+            ),
+        ]
+    if isinstance(r, result.FileSize):
+        return [
+            _counter(pid, "file size", r.timestamp, _sizes(r)),
+            _counter(pid, "rss", r.timestamp, {"rss": r.rss}),
+        ]
+    if isinstance(r, result.Duration):
+        tid = writer_tid if r.msg == "writer commit" else timed_tid
+        return [_slice(pid, tid, r.msg, r.timestamp, r.end)]
+    if isinstance(r, result.Read):
+        return [_counter(pid, "read latency", r.timestamp, {r.kind: r.seconds})]
+    if isinstance(r, result.Pages):
+        events = [_counter(pid, "pages", r.timestamp, {"used": r.used, "free": r.free})]
+        if r.fragmentation is not None:
+            events.append(
+                _counter(pid, "fragmentation", r.timestamp, {"ratio": r.fragmentation})
+            )
+        return events
+    if isinstance(r, result.StatementProgress):
+        return [
+            {
+                "ph": "i",
+                "s": "t",
+                "pid": pid,
+                "tid": progress_tid,
+                "name": f"{r.what} {r.event}",
+                "ts": _us(r.timestamp),
+                "args": {"steps": r.steps, "elapsed": r.elapsed},
+            },
+            _counter(pid, "file size", r.timestamp, _sizes(r.sizes)),
+        ]
+    if isinstance(r, result.Recovery):
+        return _recovery_slices(pid, r)
+    if isinstance(r, result.FleetMaintenance):
+        return [
+            _counter(
+                pid,
+                "maintenance",
+                r.timestamp,
+                {"queued": r.queued, "running": r.running},
+            )
+        ]
+    return []
+
+
+def _sizes(r):
+    return {"db": r.db, "shm": r.shm, "wal": r.wal, "tmp": r.tmp_dir}
+
+
+# Reopening after a crash, one after the other: connecting, the first query and
+# the checkpoint
+def _recovery_slices(pid, r):
+    events = list()
+    start = r.timestamp
+    for (name, seconds) in (
+        ("connect", r.connect),
+        ("first query", r.first_query),
+        ("checkpoint", r.checkpoint),
+    ):
+        end = start + datetime.timedelta(seconds=seconds)
+        args = {"wal": r.wal, "quick_check": r.quick_check}
+        events.append(_slice(pid, recovery_tid, name, start, end, args))
+        start = end
+    return events
+
+
+# The events of one scenario's results, as process pid
+def scenario_events(pid, name, results):
+    events = [
+        _metadata(pid, 0, "process_name", {"name": name}),
+        _metadata(pid, 0, "process_sort_index", {"sort_index": pid}),
+    ]
+    for (tid, track) in track_names.items():
+        events.append(_metadata(pid, tid, "thread_name", {"name": track}))
+    if not results.l:
+        return events
+    events += _action_slices(pid, results.l)
+    for r in results.l:
+        events += _record_events(pid, r)
+    return events
+
+
+def _name(key, results):
+    return f"{key}: {results.title}" if results.title else key
+
+
+def write_trace(events, file_name):
+    with open(file_name, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def trace_file(file_name):
+    results = result.load(file_name)
+    name = _name(metrics.scenario_key(file_name), results)
+    events = scenario_events(1, name, results)
+    write_trace(events, file_name + ".trace.json")
+    return file_name + ".trace.json"
+
+
+# Every scenario of a results folder in one trace, a process each
+def trace_dir(directory):
+    run = metrics.load_run(directory)
+    events = list()
+    for (pid, key) in enumerate(sorted(run, key=metrics.sort_key), 1):
+        events += scenario_events(pid, _name(key, run[key]), run[key])
+    write_trace(events, directory + "/trace.json")
+    return directory + "/trace.json"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="SQLiteWALTrace")
+    parser.add_argument(
+        "result",
+        type=str,
+        help="Result folder to trace every scenario of, "
+        "or a single pickled result file",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if os.path.isdir(args.result):
+        output = trace_dir(args.result)
+    elif os.path.isfile(args.result):
+        output = trace_file(args.result)
+    else:
+        raise SystemExit(f"Not valid results: {args.result}")
+    print(f"Wrote {output} in {time.perf_counter() - start:.3f}s")
@@ -0,0 +1,146 @@
+import functools
+import sqlite3
+import time
+
+import numpy as np
+
+import config
+import result
+import schemas
+
+operations = ("insert", "update", "delete")
+
+# How rows are picked for updates and deletes:
+# - uniform: any row is as likely as any other.
+# - zipf: skewed towards the newest rows, the newest being most likely.
+# - window: only the oldest config.WORKLOAD_WINDOW of the rows, as if they were
+#   expiring.
+distributions = ("uniform", "zipf", "window")
+
+
+@functools.lru_cache(maxsize=4)
+def _zipf_cdf(count):
+    weights = 1 / np.arange(1, count + 1) ** config.WORKLOAD_ZIPF_EXPONENT
+    return np.cumsum(weights) / weights.sum()
+
+
+def choose_index(rng, distribution, count):
+    if distribution == "uniform":
+        return int(rng.integers(count))
+    if distribution == "zipf":
+        rank = int(np.searchsorted(_zipf_cdf(count), rng.random()))
+        return count - 1 - min(rank, count - 1)
+    if distribution == "window":
+        return int(rng.integers(max(1, int(count * config.WORKLOAD_WINDOW))))
+    raise ValueError(f"Unknown distribution {distribution}")
+
+
+# Fraction of pages which don't follow on from the page before them in the
+# order of their b-tree, overflow pages included, over every table and index.
+# None if SQLite was built without the dbstat virtual table.
+def fragmentation(cursor):
+    try:
+        cursor.execute("SELECT name, pageno FROM dbstat ORDER BY name, path;")
+    except sqlite3.OperationalError:
+        return None
+    rows = cursor.fetchall()
+    names = np.array([row[0] for row in rows])
+    pages = np.array([row[1] for row in rows])
+    same_tree = names[1:] == names[:-1]
+    if not same_tree.any():
+        return 0.0
+    return float(np.mean((np.diff(pages) != 1)[same_tree]))
+
+
+def page_usage(td, with_fragmentation=False):
+    td.cursor.execute("PRAGMA page_count;")
+    page_count = td.cursor.fetchone()[0]
+    td.cursor.execute("PRAGMA freelist_count;")
+    freelist_count = td.cursor.fetchone()[0]
+    fragmented = fragmentation(td.cursor) if with_fragmentation else None
+    td.cursor.fetchall()
+    return result.Pages(page_count - freelist_count, freelist_count, fragmented)
+
+
+# The rows of one database, and the next operation to apply to them. The same
+# random generator gives the same sequence of operations, given the same
+# starting rows.
+class Churn:
+    def __init__(self, td, distribution, rng):
+        self.td = td
+        self.distribution = distribution
+        self.rng = rng
+        self.mix = np.array(config.WORKLOAD_MIX, dtype=np.float64)
+        self.mix /= self.mix.sum()
+        (self.min_size, self.max_size) = [
+            int(config.ROW_SIZE * multiple) for multiple in config.WORKLOAD_ROW_SIZES
+        ]
+
+        td.cursor.execute("SELECT PrimaryKey FROM Data ORDER BY PrimaryKey;")
+        self.keys = [row[0] for row in td.cursor.fetchall()]
+        self.next_key = self.keys[-1] + 1 if self.keys else 0
+
+    # Insert, update or delete a row, commit, and return which it was
+    def step(self):
+        operation = operations[self.rng.choice(len(operations), p=self.mix)]
+        if not self.keys:
+            operation = "insert"
+        size = int(self.rng.integers(self.min_size, self.max_size + 1))
+
+        cursor = self.td.cursor
+        if operation == "insert":
+            cursor.execute(
+                "INSERT INTO Data (PrimaryKey, Stuff) VALUES (?, ?);",
+                (self.next_key, schemas.payload(size)),
+            )
+            self.keys.append(self.next_key)
+            self.next_key += 1
+        elif operation == "update":
+            key = self.keys[self._choose()]
+            cursor.execute(
+                "UPDATE Data SET Stuff = ? WHERE PrimaryKey = ?;",
+                (schemas.payload(size, "y"), key),
+            )
+        else:
+            key = self.keys.pop(self._choose())
+            cursor.execute("DELETE FROM Data WHERE PrimaryKey = ?;", (key,))
+        self.td.connection.commit()
+        return operation
+
+    def _choose(self):
+        return choose_index(self.rng, self.distribution, len(self.keys))
+
+
+# Interleaved inserts, updates which change the size of the row and deletes, at
+# a target rate in operations per second, each committed on its own.
+# check_disk_space is called every config.DISK_CHECK_INTERVAL seconds.
+def run(td, distribution, num_operations, rate, seed, check_disk_space):
+    churn = Churn(td, distribution, np.random.default_rng(seed))
+    counts = dict.fromkeys(operations, 0)
+
+    start = time.monotonic()
+    last_report = start
+    last_pages = start
+    last_check = start
+    for i in range(num_operations):
+        delay = start + i / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        counts[churn.step()] += 1
+
+        now = time.monotonic()
+        if now - last_check >= config.DISK_CHECK_INTERVAL:
+            check_disk_space()
+            last_check = now
+        if now - last_pages >= config.WORKLOAD_PAGES_INTERVAL:
+            td.monitor_pipe.send(page_usage(td))
+            last_pages = now
+        if now - last_report >= config.PROGRESS_INTERVAL:
+            print(
+                f"Workload: {i + 1}/{num_operations} operations, "
+                f"{(i + 1) / (now - start):.1f} ops/s"
+            )
+            last_report = now
+
+    return counts